@@ -526,7 +526,7 @@ async function loadAuditLogs() {
         const accion = document.getElementById('filter-action').value;
         
         let url = `${API_BASE_URL}/auth/audit-logs?limit=100`;
-        if (usuario) url += `&usuario=${usuario}`;
+        if (usuario) url += `&usuario=${encodeURIComponent(usuario)}`;
         if (accion) url += `&accion=${accion}`;
         
         const response = await fetch(url, {
@@ -604,11 +604,12 @@ async function loadSettings() {
         const users = await usersResponse.json();
         document.getElementById('total-users').textContent = users.length;
         
-        const auditResponse = await fetch(`${API_BASE_URL}/auth/audit-logs?limit=1000`, {
+        // Conteo agregado en el servidor (últimos 7 días) en lugar de traer los logs
+        const auditResponse = await fetch(`${API_BASE_URL}/auth/audit-logs/resumen`, {
             headers: { 'Authorization': `Bearer ${authToken}` }
         });
         const audit = await auditResponse.json();
-        document.getElementById('total-audit').textContent = audit.length;
+        document.getElementById('total-audit').textContent = audit.total;
         
     } catch (error) {
         console.error('Error al cargar estadísticas:', error);
@@ -0,0 +1,102 @@
+# temp_backend/audit_export.py
+"""
+Exportación en streaming del log de auditoría (NDJSON o CSV, gzip).
+
+Las entradas salen del iterador de audit_store.iter_audit página por página,
+se serializan y se comprimen de forma incremental; en memoria solo vive la
+página actual de Cosmos. Después de cada página el gzip se vacía con
+Z_SYNC_FLUSH, así que lo recibido antes de un corte de conexión se puede
+descomprimir completo hasta la última línea entera.
+
+Reanudar: cada línea/fila trae timestamp e id; con los de la última recibida
+(ultimo_timestamp, ultimo_id) o con un cursor de /auth/audit-logs
+(continuation) la exportación sigue justo después, sin repetir entradas.
+
+Configuración (variables de entorno):
+    AUDIT_EXPORT_PAGE_SIZE   entradas por página de Cosmos (default 500)
+"""
+
+import csv
+import io
+import json
+import os
+import zlib
+from typing import AsyncIterator, Optional
+
+from audit_store import iter_audit
+
+AUDIT_EXPORT_PAGE_SIZE = int(os.environ.get("AUDIT_EXPORT_PAGE_SIZE", "500"))
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+CSV_COLUMNS = ("timestamp", "id", "dia", "usuario", "campus", "accion", "recurso", "detalles", "ip", "user_agent")
+
+
+def _ndjson_line(entry: dict) -> str:
+    clean = {k: v for k, v in entry.items() if not k.startswith("_") and k != "ttl"}
+    return json.dumps(clean, ensure_ascii=False, default=str) + "\n"
+
+
+class _CSVWriter:
+    """csv.writer sobre un buffer que se vacía después de cada página."""
+
+    def __init__(self):
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+
+    def header(self) -> str:
+        self.writer.writerow(CSV_COLUMNS)
+        return self.take()
+
+    def row(self, entry: dict):
+        self.writer.writerow(["" if entry.get(c) is None else entry[c] for c in CSV_COLUMNS])
+
+    def take(self) -> str:
+        data = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
+
+
+async def export_audit(helper, desde: str, hasta: str, fmt: str = "ndjson", compress: bool = True,
+                       cursor: Optional[str] = None, page_size: int = AUDIT_EXPORT_PAGE_SIZE,
+                       summary: Optional[dict] = None, **filters) -> AsyncIterator[bytes]:
+    """
+    Genera el archivo de exportación por chunks (uno por página). La cabecera
+    CSV solo se escribe al empezar, no al reanudar. Si se pasa summary, se
+    actualiza in situ con el total exportado y la última entrada enviada.
+    """
+    summary = summary if summary is not None else {}
+    summary.update({"total": 0, "ultimo_timestamp": None, "ultimo_id": None})
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16) if compress else None
+    csv_writer = _CSVWriter() if fmt == "csv" else None
+
+    def encode(text: str, flush: bool = False) -> bytes:
+        data = text.encode("utf-8")
+        if compressor is None:
+            return data
+        out = compressor.compress(data)
+        return out + compressor.flush(zlib.Z_SYNC_FLUSH) if flush else out
+
+    if csv_writer is not None and cursor is None:
+        yield encode(csv_writer.header(), flush=True)
+
+    chunk = []
+    async for entry in iter_audit(helper, desde, hasta, cursor=cursor, page_size=page_size, **filters):
+        if csv_writer is not None:
+            csv_writer.row(entry)
+        else:
+            chunk.append(_ndjson_line(entry))
+        summary["total"] += 1
+        summary["ultimo_timestamp"], summary["ultimo_id"] = entry.get("timestamp"), entry.get("id")
+        if summary["total"] % page_size == 0:
+            yield encode(csv_writer.take() if csv_writer is not None else "".join(chunk), flush=True)
+            chunk = []
+    tail = encode(csv_writer.take() if csv_writer is not None else "".join(chunk))
+    if compressor is not None:
+        tail += compressor.flush()
+    if tail:
+        yield tail
@@ -0,0 +1,387 @@
+# temp_backend/audit_logger.py
+"""
+Auditoría write-behind: log_audit() solo encola la entrada y una tarea de
+fondo la escribe en Cosmos por lotes, fuera de la latencia del request.
+
+- Cola acotada (AUDIT_QUEUE_SIZE). Si se llena, AUDIT_OVERFLOW_POLICY decide:
+    spill        la entrada va directo al archivo de respaldo (default, no se pierde)
+    drop_oldest  se descarta la entrada más vieja de la cola
+    drop_newest  se descarta la entrada nueva
+- Cada lote (hasta AUDIT_BATCH_SIZE entradas, o lo acumulado en
+  AUDIT_FLUSH_INTERVAL_MS) se escribe con create_item concurrentes; el
+  throttling de RU lo aplica cosmos_helper como en cualquier escritura.
+- Las entradas que Cosmos rechaza (no disponible, 429 agotado, 5xx) se
+  agregan como NDJSON al archivo AUDIT_SPILL_FILE y se reintentan cada
+  AUDIT_SPILL_RETRY_SECONDS. Un 409 cuenta como escrita (reintento de una
+  entrada que sí llegó).
+- El archivo de respaldo es compartido por los workers de gunicorn: para
+  reintentarlo un proceso primero lo renombra (os.replace, atómico) a un
+  nombre propio ({spill}.{pid}.{sufijo}.replay) y luego lo lee; cada append
+  y cada lectura toman un flock del archivo, así un append que ya lo tenía
+  abierto termina antes de la lectura o se repite sobre el archivo nuevo. El
+  archivo reclamado se borra solo cuando sus entradas ya se escribieron en
+  Cosmos o volvieron al respaldo; si el proceso muere antes, otro worker lo
+  adopta cuando el PID de su nombre ya no existe. La E/S de archivo corre en
+  un hilo (asyncio.to_thread), fuera del event loop.
+- stop() (shutdown de la app) escribe lo pendiente; lo que no alcance a
+  escribirse en AUDIT_SHUTDOWN_TIMEOUT_SECONDS va al archivo de respaldo.
+
+Configuración (variables de entorno):
+    AUDIT_QUEUE_SIZE                entradas en memoria (default 10000)
+    AUDIT_BATCH_SIZE                entradas por lote (default 100)
+    AUDIT_FLUSH_INTERVAL_MS         espera máxima para completar un lote (default 500)
+    AUDIT_OVERFLOW_POLICY           spill | drop_oldest | drop_newest (default spill)
+    AUDIT_SPILL_FILE                archivo de respaldo (default ./audit_spill.ndjson)
+    AUDIT_SPILL_RETRY_SECONDS       reintento del archivo de respaldo (default 60)
+    AUDIT_SHUTDOWN_TIMEOUT_SECONDS  tope para vaciar la cola al apagar (default 10)
+"""
+
+import asyncio
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from typing import List, Optional, Tuple
+
+from azure.cosmos.exceptions import CosmosHttpResponseError
+
+try:
+    import fcntl
+except ImportError:
+    # Windows (desarrollo local): sin flock; un solo proceso escribe el respaldo
+    fcntl = None
+
+AUDIT_QUEUE_SIZE = int(os.environ.get("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_BATCH_SIZE = int(os.environ.get("AUDIT_BATCH_SIZE", "100"))
+AUDIT_FLUSH_INTERVAL_MS = float(os.environ.get("AUDIT_FLUSH_INTERVAL_MS", "500"))
+AUDIT_OVERFLOW_POLICY = os.environ.get("AUDIT_OVERFLOW_POLICY", "spill").lower()
+AUDIT_SPILL_FILE = os.environ.get("AUDIT_SPILL_FILE", "audit_spill.ndjson")
+AUDIT_SPILL_RETRY_SECONDS = float(os.environ.get("AUDIT_SPILL_RETRY_SECONDS", "60"))
+AUDIT_SHUTDOWN_TIMEOUT_SECONDS = float(os.environ.get("AUDIT_SHUTDOWN_TIMEOUT_SECONDS", "10"))
+
+OVERFLOW_POLICIES = ("spill", "drop_oldest", "drop_newest")
+
+
+def _lock_file(f):
+    """flock exclusivo del archivo abierto (se libera al cerrarlo)."""
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+
+def _pid_alive(pid: int) -> bool:
+    """True si el proceso pid existe. En Windows no se consulta (os.kill lo terminaría): se asume vivo."""
+    if os.name == "nt":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _is_current(f, path: str) -> bool:
+    """True si path sigue apuntando al archivo abierto (nadie lo renombró)."""
+    try:
+        return os.fstat(f.fileno()).st_ino == os.stat(path).st_ino
+    except FileNotFoundError:
+        return False
+
+
+class AuditLogger:
+    """Cola acotada de entradas de auditoría con escritura por lotes en segundo plano."""
+
+    def __init__(self, helper, queue_size: int = AUDIT_QUEUE_SIZE, batch_size: int = AUDIT_BATCH_SIZE,
+                 flush_interval_ms: float = AUDIT_FLUSH_INTERVAL_MS, overflow_policy: str = AUDIT_OVERFLOW_POLICY,
+                 spill_file: str = AUDIT_SPILL_FILE, spill_retry_seconds: float = AUDIT_SPILL_RETRY_SECONDS):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"AUDIT_OVERFLOW_POLICY inválida: {overflow_policy} (use {', '.join(OVERFLOW_POLICIES)})")
+        self.helper = helper
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.overflow_policy = overflow_policy
+        self.spill_file = spill_file
+        self.spill_retry_seconds = spill_retry_seconds
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._task: Optional[asyncio.Task] = None
+        self._inflight: Optional[asyncio.Future] = None
+        self._collecting: List[dict] = []
+        self._spill_lock = threading.Lock()
+        # Archivos .replay que un replay_spill en curso de este proceso está escribiendo
+        self._replaying: set = set()
+        self._next_spill_retry = 0.0
+        self._stats = {
+            "enqueued": 0, "written": 0, "batches": 0,
+            "dropped": 0, "failed": 0, "spilled": 0, "replayed": 0,
+            "last_error": None,
+        }
+
+    # ---------------------------------------------------------------- encolado
+
+    def log(self, entry: dict):
+        """Encola una entrada sin esperar a Cosmos (nunca lanza excepción al llamador)."""
+        self.start()
+        try:
+            self._queue.put_nowait(entry)
+            self._stats["enqueued"] += 1
+            return
+        except asyncio.QueueFull:
+            pass
+        if self.overflow_policy == "drop_newest":
+            self._stats["dropped"] += 1
+        elif self.overflow_policy == "drop_oldest":
+            self._queue.get_nowait()
+            self._queue.task_done()
+            self._stats["dropped"] += 1
+            self._queue.put_nowait(entry)
+            self._stats["enqueued"] += 1
+        else:
+            self._spill_soon([entry])
+
+    def start(self):
+        """Arranca la tarea de escritura en el event loop actual (idempotente)."""
+        if self._task is not None and not self._task.done():
+            return
+        try:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        except RuntimeError:
+            # Sin event loop (scripts sync): las entradas esperan en la cola
+            self._task = None
+
+    async def stop(self, timeout: float = AUDIT_SHUTDOWN_TIMEOUT_SECONDS):
+        """Detiene la tarea y escribe lo pendiente; lo que no alcance va al archivo de respaldo."""
+        deadline = time.monotonic() + timeout
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._inflight is not None and not self._inflight.done():
+            # El lote en curso termina por su cuenta (escrito o respaldado)
+            try:
+                await asyncio.wait_for(asyncio.shield(self._inflight), max(0.0, deadline - time.monotonic()))
+            except (asyncio.TimeoutError, Exception):
+                pass
+        pending, self._collecting = self._collecting + self._drain(self._queue.qsize()), []
+        done = 0
+        try:
+            while done < len(pending):
+                chunk = pending[done:done + self.batch_size]
+                await asyncio.wait_for(self._flush(chunk), max(0.0, deadline - time.monotonic()))
+                done += len(chunk)
+        except asyncio.TimeoutError:
+            leftover = [e for e in pending[done:] if not e.pop("_written", False)]
+            if leftover:
+                await asyncio.to_thread(self._spill, leftover)
+
+    # ---------------------------------------------------------------- escritura
+
+    def _drain(self, limit: int) -> List[dict]:
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+            self._queue.task_done()
+        return batch
+
+    async def _next_batch(self) -> List[dict]:
+        """
+        Espera la primera entrada y junta más hasta llenar el lote o vencer el
+        intervalo. El lote se arma en self._collecting para que stop() no pierda
+        entradas ya sacadas de la cola.
+        """
+        self._collecting.append(await self._queue.get())
+        self._queue.task_done()
+        deadline = time.monotonic() + self.flush_interval
+        while len(self._collecting) < self.batch_size:
+            self._collecting.extend(self._drain(self.batch_size - len(self._collecting)))
+            remaining = deadline - time.monotonic()
+            if len(self._collecting) >= self.batch_size or remaining <= 0:
+                break
+            try:
+                self._collecting.append(await asyncio.wait_for(self._queue.get(), remaining))
+                self._queue.task_done()
+            except asyncio.TimeoutError:
+                break
+        batch, self._collecting = self._collecting, []
+        return batch
+
+    async def _write_one(self, entry: dict) -> bool:
+        try:
+            await self.helper.create_item(entry)
+        except CosmosHttpResponseError as e:
+            if e.status_code != 409:
+                self._stats["last_error"] = f"{e.status_code}: {e.message}"
+                return False
+        except Exception as e:
+            self._stats["last_error"] = str(e)
+            return False
+        entry["_written"] = True
+        return True
+
+    async def _flush(self, batch: List[dict], spill: bool = True) -> List[dict]:
+        """
+        Escribe un lote; retorna las entradas que fallaron (ya enviadas al
+        archivo de respaldo, salvo con spill=False).
+        """
+        results = await asyncio.gather(*(self._write_one(e) for e in batch))
+        self._stats["batches"] += 1
+        self._stats["written"] += sum(results)
+        failed = [e for e in batch if not e.pop("_written", False)]
+        if failed:
+            self._stats["failed"] += len(failed)
+            if spill:
+                await asyncio.to_thread(self._spill, failed)
+        return failed
+
+    async def _cycle(self, batch: List[dict]):
+        failed = await self._flush(batch) if batch else []
+        if not failed and time.monotonic() >= self._next_spill_retry:
+            await self.replay_spill()
+
+    async def _run(self):
+        # Primera vuelta sin lote: reintenta el respaldo que haya dejado una ejecución anterior
+        batch = []
+        while True:
+            # shield: cancelar la tarea (shutdown) no corta un lote a medias
+            self._inflight = asyncio.ensure_future(self._cycle(batch))
+            try:
+                await asyncio.shield(self._inflight)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats["last_error"] = str(e)
+                print(f"⚠️ Error en el escritor de auditoría: {e}")
+            batch = await self._next_batch()
+
+    # ------------------------------------------------------ archivo de respaldo
+
+    def _spill_soon(self, entries: List[dict]):
+        """Respaldo desde código sync (log): en un hilo si hay event loop, si no en línea."""
+        try:
+            asyncio.get_running_loop().run_in_executor(None, self._spill, entries)
+        except RuntimeError:
+            self._spill(entries)
+
+    def _spill(self, entries: List[dict]) -> bool:
+        """
+        Agrega entradas al archivo de respaldo (bloqueante: llamar desde un
+        hilo). Retorna False si no se pudo escribir (las entradas se descartan).
+        """
+        payload = "".join(json.dumps(entry, ensure_ascii=False, default=str) + "\n" for entry in entries)
+        try:
+            with self._spill_lock:
+                while True:
+                    with open(self.spill_file, "a", encoding="utf-8") as f:
+                        _lock_file(f)
+                        if _is_current(f, self.spill_file):
+                            f.write(payload)
+                            f.flush()
+                            break
+                    # Otro proceso reclamó el archivo entre open y flock: usar el nuevo
+            self._stats["spilled"] += len(entries)
+            return True
+        except OSError as e:
+            self._stats["dropped"] += len(entries)
+            self._stats["last_error"] = f"No se pudo escribir {self.spill_file}: {e}"
+            print(f"⚠️ Auditoría descartada ({len(entries)} entradas): {e}")
+            return False
+
+    def _claim(self, source: str) -> Optional[str]:
+        """
+        Renombra source a un archivo propio {spill}.{pid}.{sufijo}.replay
+        (atómico entre procesos); None si otro proceso lo tomó antes.
+        """
+        claimed = f"{self.spill_file}.{os.getpid()}.{uuid.uuid4().hex[:8]}.replay"
+        try:
+            os.replace(source, claimed)
+        except FileNotFoundError:
+            return None
+        return claimed
+
+    def _replay_owner(self, path: str) -> Optional[int]:
+        """PID del proceso que reclamó un archivo .replay (está en su nombre)."""
+        try:
+            return int(path[len(self.spill_file) + 1:].split(".", 1)[0])
+        except ValueError:
+            return None
+
+    def _take_spill(self) -> Tuple[List[dict], List[str]]:
+        """
+        Reclama el archivo de respaldo y retorna sus entradas junto con los
+        archivos reclamados, que se borran (_remove_claimed) solo después de
+        escribir las entradas. También adopta los reclamados que dejó un
+        proceso que ya no existe, o este mismo en un intento que no terminó;
+        reintentar una entrada ya escrita es un 409 inofensivo.
+        """
+        claimed = []
+        with self._spill_lock:
+            for path in glob.glob(f"{glob.escape(self.spill_file)}.*.replay"):
+                if path in self._replaying:
+                    continue
+                pid = self._replay_owner(path)
+                if pid == os.getpid():
+                    claimed.append(path)
+                elif pid is not None and not _pid_alive(pid):
+                    adopted = self._claim(path)
+                    if adopted is not None:
+                        claimed.append(adopted)
+            fresh = self._claim(self.spill_file)
+            if fresh is not None:
+                claimed.append(fresh)
+        entries = []
+        for path in claimed:
+            with open(path, encoding="utf-8") as f:
+                # Espera a un append que abrió el archivo antes del rename
+                _lock_file(f)
+                lines = f.readlines()
+            for line in lines:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+        return entries, claimed
+
+    def _remove_claimed(self, claimed: List[str]):
+        for path in claimed:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    async def replay_spill(self) -> int:
+        """Reintenta las entradas del archivo de respaldo; retorna cuántas se escribieron."""
+        self._next_spill_retry = time.monotonic() + self.spill_retry_seconds
+        entries, claimed = await asyncio.to_thread(self._take_spill)
+        if not claimed:
+            return 0
+        self._replaying.update(claimed)
+        try:
+            replayed, pending = 0, []
+            for start in range(0, len(entries), self.batch_size):
+                chunk = entries[start:start + self.batch_size]
+                failed = await self._flush(chunk, spill=False)
+                replayed += len(chunk) - len(failed)
+                if failed:
+                    # Cosmos sigue sin responder: el resto vuelve al archivo sin intentarlo
+                    pending = failed + entries[start + len(chunk):]
+                    break
+            self._stats["replayed"] += replayed
+            # Los reclamados se borran cuando sus entradas ya están en Cosmos o de
+            # nuevo en el archivo de respaldo; si no, se adoptan en otro intento
+            if not pending or await asyncio.to_thread(self._spill, pending):
+                await asyncio.to_thread(self._remove_claimed, claimed)
+        finally:
+            self._replaying.difference_update(claimed)
+        return replayed
+
+    def stats(self) -> dict:
+        return dict(self._stats, queue_depth=self._queue.qsize(), queue_size=self._queue.maxsize,
+                    overflow_policy=self.overflow_policy)
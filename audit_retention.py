@@ -0,0 +1,429 @@
+# temp_backend/audit_retention.py
+"""
+Retención del log de auditoría: resumen diario, archivo frío y expiración.
+
+Para cada día con entradas más viejas que AUDIT_RETENTION_DAYS:
+  1. Las entradas crudas se escriben a un archivo NDJSON gzip (segmento) en
+     un ArchiveStore: carpeta local o contenedor de Azure Blob Storage. El
+     índice (index.json) registra por día los segmentos, totales y sha256.
+  2. Se guarda un documento de resumen "rollup:<dia>" en el mismo contenedor
+     (conteos por usuario, acción y campus), que no expira.
+  3. A las entradas archivadas se les asigna ttl (AUDIT_EXPIRE_TTL_SECONDS)
+     (patch en batch por día) y Cosmos las borra en segundo plano con RU
+     sobrantes. El contenedor debe tener default TTL -1 (ensure_auth_containers
+     lo crea así). El ttl por defecto de un día deja tiempo a que los lectores
+     recarguen el índice antes de que las entradas desaparezcan de Cosmos.
+
+El job corre en un solo proceso a la vez: toma el lease "audit_retention" del
+mismo almacén de leases que el change feed (CHANGE_FEED_LEASE_FILE o
+CHANGE_FEED_LEASE_CONTAINER) y lo conserva hasta su próxima corrida; los
+demás workers lo saltan. Aun así los segmentos tienen nombres únicos y el
+índice se actualiza de forma condicional (etag), y al leer un día se
+descartan ids repetidos.
+
+Las entradas solo reciben ttl si el archivo es durable (Blob Storage): el
+disco local de Render se borra en cada deploy. AUDIT_ARCHIVE_ALLOW_LOCAL=true
+lo permite con la carpeta local, solo para desarrollo.
+
+Cada paso es idempotente: si el proceso se corta, la siguiente corrida
+retoma el día sin duplicar entradas en el archivo (se omiten ids ya
+archivados). Entradas que llegan tarde a un día ya archivado (p. ej. el
+respaldo de audit_logger) van a un segmento nuevo del mismo día.
+
+Las lecturas de audit_store (consulta, resumen y exportación) leen los días
+archivados desde el archivo en lugar de Cosmos.
+
+Corre como tarea de fondo de main.py (AUDIT_RETENTION_ENABLED=true) o como
+job aparte (cron):
+    python audit_retention.py [--dry-run]
+
+Configuración (variables de entorno):
+    AUDIT_RETENTION_DAYS             días que las entradas crudas viven en Cosmos (default 90)
+    AUDIT_EXPIRE_TTL_SECONDS         ttl de las entradas ya archivadas (default 86400)
+    AUDIT_ARCHIVE_DIR                carpeta del archivo local (default ./audit_archive)
+    AUDIT_ARCHIVE_BLOB_URL           URL SAS de un contenedor de Blob Storage; si se define
+                                     se usa en lugar de la carpeta (requiere azure-storage-blob)
+    AUDIT_ARCHIVE_ALLOW_LOCAL        permitir expirar entradas archivadas en la carpeta local
+                                     (solo desarrollo, default false)
+    AUDIT_ARCHIVE_INDEX_TTL_SECONDS  recarga del índice en los lectores (default 60)
+    AUDIT_RETENTION_ENABLED          correr el job en main.py (default false)
+    AUDIT_RETENTION_INTERVAL_HOURS   intervalo del job en main.py (default 24)
+"""
+
+import asyncio
+import gzip
+import hashlib
+import heapq
+import json
+import os
+import sys
+import time
+import uuid
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+try:
+    import fcntl
+except ImportError:
+    # Windows (desarrollo local): sin flock; un solo proceso escribe el índice
+    fcntl = None
+
+load_dotenv()
+
+from audit_store import AUDIT_PARTITION_KEY
+from change_feed import acquire_lease, default_lease_store, lease_owner
+
+AUDIT_RETENTION_DAYS = int(os.environ.get("AUDIT_RETENTION_DAYS", "90"))
+AUDIT_EXPIRE_TTL_SECONDS = int(os.environ.get("AUDIT_EXPIRE_TTL_SECONDS", "86400"))
+AUDIT_ARCHIVE_DIR = os.environ.get("AUDIT_ARCHIVE_DIR", "audit_archive")
+AUDIT_ARCHIVE_BLOB_URL = os.environ.get("AUDIT_ARCHIVE_BLOB_URL", "")
+AUDIT_ARCHIVE_ALLOW_LOCAL = os.environ.get("AUDIT_ARCHIVE_ALLOW_LOCAL", "false").lower() == "true"
+AUDIT_ARCHIVE_INDEX_TTL_SECONDS = float(os.environ.get("AUDIT_ARCHIVE_INDEX_TTL_SECONDS", "60"))
+AUDIT_RETENTION_ENABLED = os.environ.get("AUDIT_RETENTION_ENABLED", "false").lower() == "true"
+AUDIT_RETENTION_INTERVAL_HOURS = float(os.environ.get("AUDIT_RETENTION_INTERVAL_HOURS", "24"))
+
+INDEX_NAME = "index.json"
+INDEX_WRITE_ATTEMPTS = 10
+RETENTION_LEASE = "audit_retention"
+ROLLUP_TIPO = "rollup_diario"
+SIN_CAMPUS = "Sin campus"
+
+
+# ============================================
+# ALMACENAMIENTO DEL ARCHIVO
+# ============================================
+
+class LocalArchiveStore:
+    """
+    Archivos en una carpeta local; cada escritura es atómica (tmp + rename).
+    El disco de Render se borra en cada deploy: solo para desarrollo, y el job
+    no expira entradas archivadas aquí sin AUDIT_ARCHIVE_ALLOW_LOCAL=true.
+    """
+
+    def __init__(self, root: str = AUDIT_ARCHIVE_DIR, durable: bool = AUDIT_ARCHIVE_ALLOW_LOCAL):
+        self.root = root
+        self.durable = durable
+
+    def read(self, name: str) -> Optional[bytes]:
+        try:
+            with open(os.path.join(self.root, name), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, name: str, data: bytes):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def read_versioned(self, name: str) -> Tuple[Optional[bytes], Optional[str]]:
+        """Contenido y etag (sha256 del contenido); (None, None) si no existe."""
+        data = self.read(name)
+        return data, hashlib.sha256(data).hexdigest() if data is not None else None
+
+    def write_if_match(self, name: str, data: bytes, etag: Optional[str]) -> bool:
+        """Escribe solo si el archivo sigue en la versión etag (None: si no existe)."""
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.lock", "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            if self.read_versioned(name)[1] != etag:
+                return False
+            self.write(name, data)
+            return True
+
+
+class BlobArchiveStore:
+    """Blobs en un contenedor de Azure Blob Storage (URL con SAS de lectura/escritura)."""
+
+    durable = True
+
+    def __init__(self, container_url: str = AUDIT_ARCHIVE_BLOB_URL):
+        try:
+            from azure.storage.blob import ContainerClient
+        except ImportError:
+            raise RuntimeError("AUDIT_ARCHIVE_BLOB_URL requiere el paquete azure-storage-blob")
+        self.container = ContainerClient.from_container_url(container_url)
+
+    def read(self, name: str) -> Optional[bytes]:
+        return self.read_versioned(name)[0]
+
+    def write(self, name: str, data: bytes):
+        self.container.upload_blob(name, data, overwrite=True)
+
+    def read_versioned(self, name: str) -> Tuple[Optional[bytes], Optional[str]]:
+        from azure.core.exceptions import ResourceNotFoundError
+        try:
+            downloader = self.container.download_blob(name)
+        except ResourceNotFoundError:
+            return None, None
+        return downloader.readall(), downloader.properties.etag
+
+    def write_if_match(self, name: str, data: bytes, etag: Optional[str]) -> bool:
+        from azure.core import MatchConditions
+        from azure.core.exceptions import ResourceExistsError, ResourceModifiedError
+        try:
+            if etag is None:
+                self.container.upload_blob(name, data, overwrite=False)
+            else:
+                self.container.upload_blob(name, data, overwrite=True, etag=etag,
+                                           match_condition=MatchConditions.IfNotModified)
+        except (ResourceExistsError, ResourceModifiedError):
+            return False
+        return True
+
+
+def default_archive_store():
+    """Blob Storage si AUDIT_ARCHIVE_BLOB_URL está definido; si no, carpeta local."""
+    if AUDIT_ARCHIVE_BLOB_URL:
+        return BlobArchiveStore()
+    return LocalArchiveStore()
+
+
+def _empty_index() -> dict:
+    return {"version": 1, "dias": {}}
+
+
+def _sort_key(entry: dict):
+    return entry.get("timestamp") or "", entry.get("id") or ""
+
+
+class AuditArchive:
+    """
+    Índice y segmentos del archivo. El índice se cachea en memoria y se recarga
+    cada AUDIT_ARCHIVE_INDEX_TTL_SECONDS (el job puede correr en otro proceso).
+    """
+
+    def __init__(self, store, index_ttl: float = AUDIT_ARCHIVE_INDEX_TTL_SECONDS):
+        self.store = store
+        self.index_ttl = index_ttl
+        self._index: Optional[dict] = None
+        self._loaded_at = 0.0
+
+    def _load_index(self) -> dict:
+        data = self.store.read(INDEX_NAME)
+        return json.loads(data) if data else _empty_index()
+
+    async def index(self) -> dict:
+        if self._index is None or time.monotonic() - self._loaded_at > self.index_ttl:
+            self._index = await asyncio.to_thread(self._load_index)
+            self._loaded_at = time.monotonic()
+        return self._index
+
+    async def has_day(self, dia: str) -> bool:
+        return dia in (await self.index())["dias"]
+
+    def _read_day(self, dia: str, segments: List[dict]) -> List[dict]:
+        streams = []
+        for segment in segments:
+            data = self.store.read(segment["archivo"])
+            if data is None:
+                raise RuntimeError(f"Segmento de auditoría faltante: {segment['archivo']}")
+            streams.append([json.loads(line) for line in gzip.decompress(data).splitlines() if line.strip()])
+        # Cada segmento ya está en orden descendente; una entrada archivada dos
+        # veces (dos corridas a la vez) se lee una sola
+        entries, seen = [], set()
+        for entry in heapq.merge(*streams, key=_sort_key, reverse=True):
+            if entry.get("id") not in seen:
+                seen.add(entry.get("id"))
+                entries.append(entry)
+        return entries
+
+    async def read_day(self, dia: str) -> List[dict]:
+        """Entradas archivadas de un día, en orden (timestamp, id) descendente."""
+        day = (await self.index())["dias"].get(dia)
+        if not day:
+            return []
+        return await asyncio.to_thread(self._read_day, dia, day["segmentos"])
+
+    async def count_day(self, dia: str, desde: str, hasta: str) -> int:
+        """Entradas archivadas del día dentro de [desde, hasta] (del índice si el día cae completo)."""
+        day = (await self.index())["dias"].get(dia)
+        if not day:
+            return 0
+        if desde[:10] < dia < hasta[:10]:
+            return day["total"]
+        return sum(1 for e in await self.read_day(dia) if desde <= (e.get("timestamp") or "") <= hasta)
+
+    def _add_segment(self, dia: str, entries: List[dict]) -> dict:
+        """
+        Escribe un segmento nuevo y lo registra en el índice (en ese orden). El
+        nombre del segmento es único y el índice se actualiza de forma
+        condicional (etag), así dos escritores no se pisan.
+        """
+        stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        name = f"auditoria/{dia[:4]}/{dia[5:7]}/{dia}-{stamp}-{uuid.uuid4().hex[:8]}.ndjson.gz"
+        body = "".join(json.dumps(e, ensure_ascii=False, default=str) + "\n" for e in entries)
+        data = gzip.compress(body.encode("utf-8"))
+        self.store.write(name, data)
+        segment = {
+            "archivo": name,
+            "total": len(entries),
+            "bytes": len(data),
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "archivado": datetime.utcnow().isoformat() + "Z",
+        }
+        for _ in range(INDEX_WRITE_ATTEMPTS):
+            raw, etag = self.store.read_versioned(INDEX_NAME)
+            index = json.loads(raw) if raw else _empty_index()
+            day = index["dias"].setdefault(dia, {"total": 0, "segmentos": []})
+            day["segmentos"].append(segment)
+            day["total"] += len(entries)
+            if self.store.write_if_match(INDEX_NAME, json.dumps(index, indent=2).encode("utf-8"), etag):
+                self._index, self._loaded_at = index, time.monotonic()
+                return segment
+        raise RuntimeError(f"No se pudo registrar {name} en el índice: demasiadas escrituras concurrentes")
+
+    async def add_segment(self, dia: str, entries: List[dict]) -> dict:
+        return await asyncio.to_thread(self._add_segment, dia, entries)
+
+
+# ============================================
+# JOB DE RETENCIÓN
+# ============================================
+
+def _raw(entry: dict) -> dict:
+    """Entrada tal como se archiva: sin propiedades de sistema ni ttl."""
+    return {k: v for k, v in entry.items() if not k.startswith("_") and k != "ttl"}
+
+
+def build_rollup(dia: str, entries: List[dict]) -> dict:
+    por_usuario, por_accion, por_campus = Counter(), Counter(), Counter()
+    for entry in entries:
+        por_usuario[entry.get("usuario") or "desconocido"] += 1
+        por_accion[entry.get("accion") or "desconocida"] += 1
+        por_campus[entry.get("campus") or SIN_CAMPUS] += 1
+    return {
+        "id": f"rollup:{dia}",
+        "dia": dia,
+        "tipo": ROLLUP_TIPO,
+        "total": len(entries),
+        "porUsuario": dict(por_usuario),
+        "porAccion": dict(por_accion),
+        "porCampus": dict(por_campus),
+        "generado": datetime.utcnow().isoformat() + "Z",
+    }
+
+
+async def _oldest_pending_day(helper) -> Optional[str]:
+    """Día de la entrada cruda más vieja que todavía no se archivó (sin ttl)."""
+    result = await helper.query_items(
+        "SELECT TOP 1 c.dia FROM c WHERE IS_DEFINED(c.timestamp) AND NOT IS_DEFINED(c.ttl) "
+        "ORDER BY c.timestamp ASC"
+    )
+    return result[0]["dia"] if result else None
+
+
+async def _pending_entries(helper, dia: str, page_size: int = 1000) -> List[dict]:
+    entries = []
+    query = ("SELECT * FROM c WHERE c.dia = @dia AND IS_DEFINED(c.timestamp) AND NOT IS_DEFINED(c.ttl) "
+             "ORDER BY c.timestamp DESC, c.id DESC")
+    async for items, _ in helper.query_pages(query, [{"name": "@dia", "value": dia}],
+                                             page_size=page_size, partition_key=dia):
+        entries.extend(items)
+    return entries
+
+
+async def _expire(helper, dia: str, ids: List[str]) -> int:
+    """Asigna ttl a las entradas archivadas; retorna cuántas quedaron marcadas."""
+    operations = [
+        ("patch", (entry_id, [{"op": "add", "path": "/ttl", "value": AUDIT_EXPIRE_TTL_SECONDS}]))
+        for entry_id in ids
+    ]
+    results = await helper.execute_batch(operations, partition_key=dia)
+    return sum(1 for r in results if r["status_code"] < 400)
+
+
+async def retain_day(helper, archive: AuditArchive, dia: str, dry_run: bool = False) -> dict:
+    """Archiva, resume y marca para expirar las entradas pendientes de un día."""
+    if not dry_run and not getattr(archive.store, "durable", False):
+        # Con ttl las entradas desaparecen de Cosmos: el archivo tiene que sobrevivir a un deploy
+        raise RuntimeError("El archivo de auditoría no es durable: defina AUDIT_ARCHIVE_BLOB_URL "
+                           "(o AUDIT_ARCHIVE_ALLOW_LOCAL=true solo en desarrollo)")
+    pending = await _pending_entries(helper, dia)
+    archived = await archive.read_day(dia)
+    known = {e["id"] for e in archived}
+    new = [_raw(e) for e in pending if e["id"] not in known]
+    report = {"dia": dia, "pendientes": len(pending), "archivadas": len(new), "expiradas": 0}
+    if dry_run:
+        return report
+    if new:
+        # Primero el archivo: una entrada solo recibe ttl si ya está archivada
+        report["segmento"] = (await archive.add_segment(dia, new))["archivo"]
+        archived = list(heapq.merge(archived, new, key=_sort_key, reverse=True))
+    await helper.upsert_item(build_rollup(dia, archived), dia)
+    report["expiradas"] = await _expire(helper, dia, [e["id"] for e in pending])
+    return report
+
+
+async def run_retention(helper, archive: AuditArchive, retention_days: int = AUDIT_RETENTION_DAYS,
+                        dry_run: bool = False, today: Optional[date] = None) -> List[dict]:
+    """Procesa, del más viejo al más nuevo, los días anteriores al corte de retención."""
+    cutoff = ((today or datetime.utcnow().date()) - timedelta(days=retention_days)).isoformat()
+    reports = []
+    done = set()
+    while True:
+        dia = await _oldest_pending_day(helper)
+        if dia is None or dia >= cutoff or dia in done:
+            break
+        report = await retain_day(helper, archive, dia, dry_run=dry_run)
+        reports.append(report)
+        done.add(dia)
+        print(f"🗄️  Auditoría {dia}: {report['archivadas']} archivadas, {report['expiradas']} con ttl")
+        if dry_run:
+            # Sin marcar ttl el día seguiría siendo el más viejo pendiente
+            break
+    return reports
+
+
+async def run_retention_once(helper, archive: AuditArchive, leases=None, owner: Optional[str] = None,
+                             lease_seconds: float = AUDIT_RETENTION_INTERVAL_HOURS * 3600,
+                             dry_run: bool = False) -> Optional[List[dict]]:
+    """
+    Corre el job solo si este proceso obtiene el lease "audit_retention"
+    (uno solo entre los workers de gunicorn y el cron); None si lo tiene otro.
+    El lease queda tomado lease_seconds: hasta la próxima corrida del dueño.
+    Un dry run no escribe nada y no lo toma.
+    """
+    if not dry_run:
+        leases = leases if leases is not None else default_lease_store()
+        if await acquire_lease(leases, RETENTION_LEASE, owner or lease_owner(), lease_seconds) is None:
+            return None
+    return await run_retention(helper, archive, dry_run=dry_run)
+
+
+async def retention_loop(helper, archive: AuditArchive, interval_hours: float = AUDIT_RETENTION_INTERVAL_HOURS,
+                         leases=None):
+    """Tarea de fondo de main.py: cada interval_hours, corre el job si este worker tiene el lease."""
+    leases = leases if leases is not None else default_lease_store()
+    owner = lease_owner()
+    while True:
+        try:
+            await run_retention_once(helper, archive, leases, owner, lease_seconds=interval_hours * 3600)
+        except Exception as e:
+            print(f"⚠️ Error en la retención de auditoría: {e}")
+        await asyncio.sleep(interval_hours * 3600)
+
+
+async def _main(dry_run: bool):
+    from cosmos_helper import AsyncCosmosDBHelper, close_async_clients
+    helper = AsyncCosmosDBHelper(os.environ.get("COSMOS_CONTAINER_AUDITORIA_DIA", "auditoria_dia"), AUDIT_PARTITION_KEY)
+    try:
+        reports = await run_retention_once(helper, AuditArchive(default_archive_store()), dry_run=dry_run)
+        if reports is None:
+            print("⏭️  Retención omitida: otro proceso tiene el lease audit_retention")
+            return
+        print(f"✅ Retención terminada: {len(reports)} días procesados" + (" (dry run)" if dry_run else ""))
+    finally:
+        await close_async_clients()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main("--dry-run" in sys.argv))
@@ -0,0 +1,201 @@
+# temp_backend/audit_store.py
+"""
+Lectura del log de auditoría particionado por día.
+
+Las entradas se guardan en un contenedor con partition key /dia
+("YYYY-MM-DD" UTC del timestamp), así una consulta de los últimos días toca
+solo esas particiones en lugar de hacer fan-out sobre todo el contenedor.
+El orden es (timestamp, id) descendente y la paginación es por keyset: el
+cursor es la última entrada entregada, no un offset, así que no se salta ni
+repite entradas aunque se sigan escribiendo nuevas mientras se pagina.
+
+Índice compuesto requerido en Cosmos (lo crea ensure_auth_containers):
+    [(/timestamp DESC, /id DESC)]
+
+Configuración (variables de entorno):
+    AUDIT_QUERY_DEFAULT_DAYS   ventana cuando no se indica desde (default 7)
+    AUDIT_QUERY_MAX_DAYS       ventana máxima de una consulta (default 366)
+"""
+
+import base64
+import json
+import os
+from datetime import date, datetime, time as dt_time, timedelta, timezone
+from typing import AsyncIterator, List, Optional, Tuple
+
+AUDIT_QUERY_DEFAULT_DAYS = int(os.environ.get("AUDIT_QUERY_DEFAULT_DAYS", "7"))
+AUDIT_QUERY_MAX_DAYS = int(os.environ.get("AUDIT_QUERY_MAX_DAYS", "366"))
+
+AUDIT_PARTITION_KEY = "/dia"
+
+# Para crear el contenedor: ORDER BY timestamp DESC, id DESC necesita índice compuesto
+AUDIT_INDEXING_POLICY = {
+    "indexingMode": "consistent",
+    "includedPaths": [{"path": "/*"}],
+    "excludedPaths": [{"path": "/detalles/?"}, {"path": "/\"_etag\"/?"}],
+    "compositeIndexes": [[
+        {"path": "/timestamp", "order": "descending"},
+        {"path": "/id", "order": "descending"},
+    ]],
+}
+
+
+def audit_day(timestamp: str) -> str:
+    """Partición de una entrada: el día (UTC) de su timestamp ISO."""
+    return timestamp[:10]
+
+
+def _parse_bound(value: str, end: bool) -> datetime:
+    """Fecha (YYYY-MM-DD) o fecha-hora ISO; una fecha sola como hasta incluye todo el día."""
+    parsed = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        # Los timestamps de auditoría son UTC sin zona (datetime.utcnow().isoformat())
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    if end and len(value.strip()) == 10:
+        parsed = datetime.combine(parsed.date(), dt_time.max)
+    return parsed
+
+
+def parse_range(desde: Optional[str], hasta: Optional[str], now: Optional[datetime] = None) -> Tuple[str, str]:
+    """
+    Normaliza la ventana [desde, hasta] a timestamps ISO UTC comparables con
+    los de las entradas. Sin hasta es ahora; sin desde, AUDIT_QUERY_DEFAULT_DAYS
+    antes de hasta. ValueError si el rango es inválido o excede AUDIT_QUERY_MAX_DAYS.
+    """
+    try:
+        end = _parse_bound(hasta, end=True) if hasta else (now or datetime.utcnow())
+        start = _parse_bound(desde, end=False) if desde else end - timedelta(days=AUDIT_QUERY_DEFAULT_DAYS)
+    except ValueError:
+        raise ValueError("desde/hasta deben ser fechas YYYY-MM-DD o fecha-hora ISO 8601")
+    if start > end:
+        raise ValueError("desde debe ser anterior a hasta")
+    if (end.date() - start.date()).days >= AUDIT_QUERY_MAX_DAYS:
+        raise ValueError(f"La ventana máxima de consulta es de {AUDIT_QUERY_MAX_DAYS} días")
+    return start.isoformat(), end.isoformat()
+
+
+def days_between(desde: str, hasta: str) -> List[str]:
+    """Días (particiones) de la ventana, del más reciente al más antiguo."""
+    first = date.fromisoformat(audit_day(desde))
+    current = date.fromisoformat(audit_day(hasta))
+    days = []
+    while current >= first:
+        days.append(current.isoformat())
+        current -= timedelta(days=1)
+    return days
+
+
+def encode_cursor(entry: dict) -> str:
+    raw = json.dumps({"ts": entry["timestamp"], "id": entry["id"]}).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(token: str) -> Tuple[str, str]:
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token.encode()))
+        if not isinstance(data.get("ts"), str) or not isinstance(data.get("id"), str):
+            raise ValueError(data)
+        return data["ts"], data["id"]
+    except Exception:
+        raise ValueError("Cursor de auditoría inválido")
+
+
+def _day_query(usuario, accion, recurso, cursor) -> Tuple[str, list]:
+    sql = "SELECT * FROM c WHERE c.dia = @dia AND c.timestamp >= @desde AND c.timestamp <= @hasta"
+    params = []
+    if usuario:
+        sql += " AND c.usuario = @usuario"
+        params.append({"name": "@usuario", "value": usuario})
+    if accion:
+        sql += " AND c.accion = @accion"
+        params.append({"name": "@accion", "value": accion})
+    if recurso:
+        sql += " AND c.recurso = @recurso"
+        params.append({"name": "@recurso", "value": recurso})
+    if cursor:
+        sql += " AND (c.timestamp < @cursor_ts OR (c.timestamp = @cursor_ts AND c.id < @cursor_id))"
+        params += [{"name": "@cursor_ts", "value": cursor[0]}, {"name": "@cursor_id", "value": cursor[1]}]
+    return sql + " ORDER BY c.timestamp DESC, c.id DESC", params
+
+
+def _matches(entry: dict, desde, hasta, usuario, accion, recurso, cursor) -> bool:
+    """Mismo filtro que _day_query, para entradas leídas del archivo."""
+    ts, entry_id = entry.get("timestamp") or "", entry.get("id") or ""
+    if not desde <= ts <= hasta:
+        return False
+    if (usuario and entry.get("usuario") != usuario) or (accion and entry.get("accion") != accion) \
+            or (recurso and entry.get("recurso") != recurso):
+        return False
+    return cursor is None or ts < cursor[0] or (ts == cursor[0] and entry_id < cursor[1])
+
+
+async def iter_audit(helper, desde: str, hasta: str, usuario: Optional[str] = None,
+                     accion: Optional[str] = None, recurso: Optional[str] = None,
+                     cursor: Optional[str] = None, page_size: int = 100,
+                     archive=None) -> AsyncIterator[dict]:
+    """
+    Genera las entradas de [desde, hasta] en orden (timestamp, id) descendente,
+    consultando una partición (día) a la vez y a partir del cursor si se indica.
+    Los días que ya pasaron a archive (audit_retention.AuditArchive) se leen
+    del archivo en lugar de Cosmos. Cortar la iteración deja de consultar los
+    días restantes.
+    """
+    after = decode_cursor(cursor) if cursor else None
+    if after and after[0] < hasta:
+        hasta = after[0]
+    sql, extra = _day_query(usuario, accion, recurso, after)
+    for dia in days_between(desde, hasta):
+        if archive is not None and await archive.has_day(dia):
+            for item in await archive.read_day(dia):
+                if _matches(item, desde, hasta, usuario, accion, recurso, after):
+                    yield item
+            continue
+        params = [{"name": "@dia", "value": dia}, {"name": "@desde", "value": desde},
+                  {"name": "@hasta", "value": hasta}] + extra
+        async for items, _ in helper.query_pages(sql, params, page_size=page_size, partition_key=dia):
+            for item in items:
+                yield item
+
+
+async def query_audit_page(helper, desde: str, hasta: str, limit: int, **filters) -> Tuple[List[dict], Optional[str]]:
+    """Una página de a lo más limit entradas y el cursor de la siguiente (None si no hay más)."""
+    entries = []
+    async for entry in iter_audit(helper, desde, hasta, page_size=limit + 1, **filters):
+        entries.append(entry)
+        if len(entries) > limit:
+            return entries[:limit], encode_cursor(entries[limit - 1])
+    return entries, None
+
+
+def _runs(days: List[str]) -> List[Tuple[str, str]]:
+    """Agrupa días (descendentes) en rangos consecutivos [(primero, último), ...]."""
+    runs = []
+    for dia in days:
+        if runs and date.fromisoformat(runs[-1][0]) - timedelta(days=1) == date.fromisoformat(dia):
+            runs[-1] = (dia, runs[-1][1])
+        else:
+            runs.append((dia, dia))
+    return runs
+
+
+async def count_audit(helper, desde: str, hasta: str, archive=None) -> int:
+    """
+    Total de entradas de la ventana: agregado de Cosmos (sin transferir
+    documentos) para los días vivos y el índice del archivo para los archivados.
+    """
+    total = 0
+    live = []
+    for dia in days_between(desde, hasta):
+        if archive is not None and await archive.has_day(dia):
+            total += await archive.count_day(dia, desde, hasta)
+        else:
+            live.append(dia)
+    for first, last in _runs(live):
+        result = await helper.query_items(
+            "SELECT VALUE COUNT(1) FROM c WHERE c.dia >= @d1 AND c.dia <= @d2 "
+            "AND c.timestamp >= @desde AND c.timestamp <= @hasta",
+            [{"name": "@d1", "value": first}, {"name": "@d2", "value": last},
+             {"name": "@desde", "value": desde}, {"name": "@hasta", "value": hasta}],
+        )
+        total += sum(result)
+    return total
@@ -4,11 +4,13 @@ Modelos de datos para el sistema de autenticación y autorización.
 Incluye usuarios, roles, permisos y auditoría.
 """
 
-from pydantic import BaseModel, EmailStr, Field, validator
+import sys
 from typing import Optional, List
 from datetime import datetime
 from enum import Enum
 
+from pydantic import BaseModel, EmailStr, Field, validator
+
 # Definición de roles disponibles en el sistema
 class UserRole(str, Enum):
     ADMIN = "admin"                    # Control total del sistema
@@ -219,10 +221,12 @@ class AuditAction(str, Enum):
     CREATE_USER = "CREATE_USER"
     UPDATE_USER = "UPDATE_USER"
     DELETE_USER = "DELETE_USER"
+    EXPORT_AUDIT = "EXPORT_AUDIT"
 
 class AuditLog(BaseModel):
     id: str  # audit:{timestamp}-{random}
     usuario: str  # username@campus
+    campus: Optional[str] = None
     accion: AuditAction
     recurso: Optional[str] = None  # ID del recurso afectado
     detalles: Optional[str] = None
@@ -290,6 +294,40 @@ ROLE_PERMISSIONS = {
     ]
 }
 
+# Matriz compilada al importar: cada permiso (internado) es un bit y cada rol
+# una máscara, así un chequeo de uno o varios permisos es un AND de enteros.
+PERMISSION_BITS = {
+    sys.intern(permission): 1 << bit
+    for bit, permission in enumerate(sorted({p for perms in ROLE_PERMISSIONS.values() for p in perms}))
+}
+ROLE_PERMISSION_MASKS = {
+    rol: sum(PERMISSION_BITS[p] for p in set(perms)) for rol, perms in ROLE_PERMISSIONS.items()
+}
+ROLE_PERMISSION_SETS = {rol: frozenset(perms) for rol, perms in ROLE_PERMISSIONS.items()}
+
+def permission_mask(*permissions: str) -> int:
+    """Máscara de bits de los permisos; ValueError si alguno no existe en ROLE_PERMISSIONS."""
+    unknown = [p for p in permissions if p not in PERMISSION_BITS]
+    if unknown:
+        raise ValueError(f"Permisos desconocidos: {unknown}")
+    mask = 0
+    for permission in permissions:
+        mask |= PERMISSION_BITS[permission]
+    return mask
+
 def has_permission(rol: UserRole, permission: str) -> bool:
     """Verifica si un rol tiene un permiso específico."""
-    return permission in ROLE_PERMISSIONS.get(rol, [])
+    return permission in ROLE_PERMISSION_SETS.get(rol, ())
+
+def has_permissions(rol: UserRole, *permissions: str, any_of: bool = False) -> bool:
+    """
+    Verifica varios permisos a la vez: todos (default) o al menos uno con
+    any_of=True. Un permiso desconocido cuenta como no otorgado. Sin permisos
+    es un error (all() de nada sería True para cualquier rol).
+    """
+    if not permissions:
+        raise ValueError("has_permissions() necesita al menos un permiso")
+    role_mask = ROLE_PERMISSION_MASKS.get(rol, 0)
+    if any_of:
+        return any(role_mask & PERMISSION_BITS.get(p, 0) for p in permissions)
+    return all(role_mask & PERMISSION_BITS.get(p, 0) for p in permissions)
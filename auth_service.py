@@ -10,16 +10,25 @@ from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
+import hashlib
 import os
 import secrets
+import time
 
 from auth_models import UserInDB, TokenData, UserRole, Campus
+from password_pool import password_pool
+from ttl_cache import TTLCache
 
 # Configuración de seguridad
 SECRET_KEY = os.environ.get("JWT_SECRET_KEY", secrets.token_urlsafe(32))
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 480  # 8 horas
 
+# Claims ya verificados por sha256 del token: cada request autenticado repite
+# el mismo token durante 8 horas. Cada entrada vence en el exp del token.
+JWT_CACHE_SIZE = int(os.environ.get("JWT_CACHE_SIZE", "4096"))
+jwt_claims_cache = TTLCache(JWT_CACHE_SIZE, ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
 # Contexto para hash de contraseñas (bcrypt)
 # Configurar bcrypt para truncar automáticamente contraseñas largas
 pwd_context = CryptContext(
@@ -52,6 +61,16 @@ class AuthService:
             plain_password = password_bytes[:72].decode('utf-8', errors='ignore')
         return pwd_context.verify(plain_password, hashed_password)
     
+    @staticmethod
+    async def hash_password_async(password: str) -> str:
+        """hash_password fuera del event loop (pool acotado de password_pool.py)."""
+        return await password_pool.run(AuthService.hash_password, password)
+    
+    @staticmethod
+    async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+        """verify_password fuera del event loop (pool acotado de password_pool.py)."""
+        return await password_pool.run(AuthService.verify_password, plain_password, hashed_password)
+    
     @staticmethod
     def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
         """Crea un token JWT con los datos del usuario."""
@@ -67,7 +86,14 @@ class AuthService:
     
     @staticmethod
     def decode_token(token: str) -> TokenData:
-        """Decodifica y valida un token JWT."""
+        """
+        Decodifica y valida un token JWT. Un token ya verificado se resuelve
+        desde jwt_claims_cache hasta su exp (el TokenData es compartido: no se modifica).
+        """
+        cache_key = hashlib.sha256(token.encode("utf-8")).digest()
+        cached = jwt_claims_cache.get(cache_key)
+        if cached is not None:
+            return cached
         try:
             payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
             username: str = payload.get("sub")
@@ -81,11 +107,15 @@ class AuthService:
                     headers={"WWW-Authenticate": "Bearer"},
                 )
             
-            return TokenData(
+            token_data = TokenData(
                 username=username,
                 rol=UserRole(rol),
                 campus=Campus(campus)
             )
+            remaining = payload["exp"] - time.time() if "exp" in payload else 0
+            if remaining > 0:
+                jwt_claims_cache.set(cache_key, token_data, ttl=remaining)
+            return token_data
         except JWTError as e:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -145,25 +175,47 @@ def require_role(*allowed_roles: UserRole):
     return role_checker
 
 # Función de dependencia para verificar permisos específicos
-def require_permission(permission: str):
+_permission_checkers = {}
+
+def require_permission(*permissions: str, any_of: bool = False):
     """
-    Decorator de dependencia para verificar que el usuario tenga un permiso específico.
+    Decorator de dependencia para verificar que el usuario tenga uno o varios
+    permisos (todos, o al menos uno con any_of=True).
+    
+    La máscara de bits se calcula una sola vez por combinación de permisos y la
+    dependencia se reutiliza entre rutas: por request el chequeo es un AND.
+    Un permiso que no existe en ROLE_PERMISSIONS, o llamarla sin permisos (la
+    máscara vacía dejaría pasar a todos), falla al declarar la ruta.
     
     Uso:
     @app.post("/carnets", dependencies=[Depends(require_permission("carnets:create"))])
     async def create_carnet():
         return {"message": "Carnet creado"}
     """
-    from auth_models import has_permission
+    from auth_models import ROLE_PERMISSION_MASKS, permission_mask
+    
+    if not permissions:
+        raise ValueError("require_permission() necesita al menos un permiso")
+    
+    key = (permissions, any_of)
+    checker = _permission_checkers.get(key)
+    if checker is not None:
+        return checker
+    
+    mask = permission_mask(*permissions)
+    detail = f"No tienes el permiso: {', '.join(permissions)}" if not any_of else \
+        f"Se requiere alguno de los permisos: {', '.join(permissions)}"
     
     async def permission_checker(current_user: TokenData = Depends(get_current_user)):
-        if not has_permission(current_user.rol, permission):
+        granted = ROLE_PERMISSION_MASKS.get(current_user.rol, 0) & mask
+        if not (granted if any_of else granted == mask):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
-                detail=f"No tienes el permiso: {permission}"
+                detail=detail
             )
         return current_user
     
+    _permission_checkers[key] = permission_checker
     return permission_checker
 
 # Constantes de configuración
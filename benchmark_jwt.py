@@ -0,0 +1,49 @@
+"""
+Micro-benchmark de la verificación de tokens JWT (AuthService.decode_token).
+
+Compara, para un token típico de 8 horas, la verificación completa (HS256 +
+TokenData con coerción de UserRole/Campus) contra la resolución desde el
+caché de claims (sha256 del token + lookup en jwt_claims_cache).
+
+Uso:
+    python benchmark_jwt.py [iteraciones]
+"""
+
+import sys
+import time
+from datetime import timedelta
+
+from auth_models import Campus, UserRole
+from auth_service import ACCESS_TOKEN_EXPIRE_MINUTES, AuthService, jwt_claims_cache
+
+
+def _measure(label: str, fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    per_call_us = (time.perf_counter() - start) / iterations * 1e6
+    print(f"   {label:<28} {per_call_us:9.2f} µs/request")
+    return per_call_us
+
+
+def main(iterations: int = 20000):
+    token = AuthService.create_access_token(
+        {"sub": "benchmark", "rol": UserRole.MEDICO.value, "campus": Campus.CRES_LLANO_LARGO.value},
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES),
+    )
+    print(f"⏱️  decode_token, {iterations} iteraciones, token de {ACCESS_TOKEN_EXPIRE_MINUTES} minutos")
+
+    def uncached():
+        jwt_claims_cache.clear()
+        AuthService.decode_token(token)
+
+    # clear() también entra en la medición sin caché; se descuenta aparte
+    clear_only = _measure("solo clear() (referencia)", jwt_claims_cache.clear, iterations)
+    full = _measure("verificación completa", uncached, iterations) - clear_only
+    AuthService.decode_token(token)
+    cached = _measure("desde caché de claims", lambda: AuthService.decode_token(token), iterations)
+    print(f"✅ Ahorro por request: {full - cached:.2f} µs ({full / cached:.1f}x más rápido)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,199 @@
+# temp_backend/bulk_import.py
+"""
+Importación masiva en streaming (NDJSON, opcionalmente gzip).
+
+El cuerpo del request se lee por chunks, se descomprime incrementalmente y se
+parte en líneas; cada línea se valida contra un modelo Pydantic y se escribe
+con un máximo de IMPORT_CONCURRENCY operaciones en vuelo. El reporte se
+devuelve también como NDJSON, una línea por registro a medida que terminan,
+más una línea final de resumen. En memoria solo viven el chunk actual, una
+línea parcial y las escrituras en curso.
+
+Configuración (variables de entorno):
+    IMPORT_CONCURRENCY       escrituras concurrentes a Cosmos (default 16)
+    IMPORT_MAX_LINE_BYTES    tamaño máximo de una línea (default 1 MB)
+"""
+
+import asyncio
+import json
+import os
+import zlib
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Optional, Tuple
+
+from azure.cosmos.exceptions import CosmosHttpResponseError
+from pydantic import BaseModel, ValidationError
+from starlette.requests import ClientDisconnect
+from starlette.responses import StreamingResponse
+
+IMPORT_CONCURRENCY = int(os.environ.get("IMPORT_CONCURRENCY", "16"))
+IMPORT_MAX_LINE_BYTES = int(os.environ.get("IMPORT_MAX_LINE_BYTES", str(1024 * 1024)))
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+_GZIP_MAGIC = b"\x1f\x8b"
+
+
+class LineTooLong(Exception):
+    """Una línea del NDJSON excede IMPORT_MAX_LINE_BYTES."""
+
+
+class NDJSONImportResponse(StreamingResponse):
+    """
+    StreamingResponse para importaciones: el reporte se genera mientras se lee
+    el body del mismo request (request.stream()), así que no se escucha
+    http.disconnect en paralelo como hace StreamingResponse (ambos competirían
+    por receive()). Una desconexión llega como ClientDisconnect al leer el body
+    o como OSError al escribir.
+    """
+
+    media_type = NDJSON_MEDIA_TYPE
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.stream_response(send)
+        except OSError:
+            raise ClientDisconnect()
+        if self.background is not None:
+            await self.background()
+
+
+async def decompress_stream(chunks: AsyncIterable[bytes], content_encoding: Optional[str] = None) -> AsyncIterator[bytes]:
+    """
+    Descomprime gzip de forma incremental. Se detecta por Content-Encoding o por
+    los bytes mágicos del primer chunk (archivos .ndjson.gz subidos tal cual).
+    """
+    decompressor = None
+    first = True
+    async for chunk in chunks:
+        if not chunk:
+            continue
+        if first:
+            first = False
+            if (content_encoding or "").lower() == "gzip" or chunk.startswith(_GZIP_MAGIC):
+                decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        if decompressor is None:
+            yield chunk
+            continue
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+        while decompressor.eof and decompressor.unused_data:
+            # gzip multi-miembro (archivos concatenados)
+            rest = decompressor.unused_data
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            data = decompressor.decompress(rest)
+            if data:
+                yield data
+    if decompressor is not None:
+        data = decompressor.flush()
+        if data:
+            yield data
+
+
+async def iter_lines(chunks: AsyncIterable[bytes], max_line_bytes: int = IMPORT_MAX_LINE_BYTES) -> AsyncIterator[Tuple[int, object]]:
+    """
+    Genera (número de línea, bytes de la línea) sin líneas vacías. Una línea que
+    excede max_line_bytes se descarta y se genera (número, LineTooLong()).
+    """
+    buffer = b""
+    line_no = 0
+    skipping = False
+    async for chunk in chunks:
+        buffer += chunk
+        while True:
+            newline = buffer.find(b"\n")
+            if newline < 0:
+                break
+            line, buffer = buffer[:newline], buffer[newline + 1:]
+            line_no += 1
+            if skipping:
+                skipping = False
+                continue
+            if len(line) > max_line_bytes:
+                yield line_no, LineTooLong()
+            elif line.strip():
+                yield line_no, line
+        if not skipping and len(buffer) > max_line_bytes:
+            # Línea sin terminar demasiado larga: reportarla y descartar hasta el
+            # próximo \n (que es el que cuenta la línea en line_no)
+            skipping = True
+            buffer = b""
+            yield line_no + 1, LineTooLong()
+        elif skipping:
+            buffer = b""
+    if buffer.strip() and not skipping:
+        yield line_no + 1, buffer
+
+
+def _validation_errors(error: ValidationError) -> list:
+    return [
+        {"loc": list(e.get("loc", ())), "msg": e.get("msg", "")}
+        for e in error.errors()
+    ]
+
+
+async def _process_line(line_no: int, raw, model: type, write: Callable[[BaseModel], Awaitable[dict]]) -> dict:
+    if isinstance(raw, LineTooLong):
+        return {"line": line_no, "status": 413, "error": f"Línea excede {IMPORT_MAX_LINE_BYTES} bytes"}
+    try:
+        data = json.loads(raw)
+    except (ValueError, UnicodeDecodeError) as e:
+        return {"line": line_no, "status": 400, "error": f"JSON inválido: {e}"}
+    if not isinstance(data, dict):
+        return {"line": line_no, "status": 400, "error": "Cada línea debe ser un objeto JSON"}
+    try:
+        record = model(**data)
+    except ValidationError as e:
+        return {"line": line_no, "status": 422, "error": _validation_errors(e)}
+    try:
+        result = await write(record)
+        return {"line": line_no, "status": 201, **result}
+    except CosmosHttpResponseError as e:
+        return {"line": line_no, "status": e.status_code or 500, "error": e.message}
+    except Exception as e:
+        return {"line": line_no, "status": 500, "error": str(e)}
+
+
+async def run_import(
+    lines: AsyncIterable[Tuple[int, object]],
+    model: type,
+    write: Callable[[BaseModel], Awaitable[dict]],
+    concurrency: int = IMPORT_CONCURRENCY,
+    summary: Optional[dict] = None,
+) -> AsyncIterator[bytes]:
+    """
+    Valida y escribe cada línea con a lo sumo `concurrency` escrituras en vuelo.
+    No se lee la siguiente línea mientras el pool está lleno (backpressure sobre
+    el request). Genera el reporte NDJSON en orden de finalización; la última
+    línea es {"summary": {...}}. Si se pasa summary, se actualiza in situ.
+    """
+    summary = summary if summary is not None else {}
+    summary.update({"total": 0, "ok": 0, "errores": 0})
+    pending = set()
+
+    def report(task):
+        result = task.result()
+        summary["total"] += 1
+        summary["ok" if result["status"] < 400 else "errores"] += 1
+        return (json.dumps(result, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+
+    try:
+        try:
+            async for line_no, raw in lines:
+                if len(pending) >= concurrency:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        yield report(task)
+                pending.add(asyncio.create_task(_process_line(line_no, raw, model, write)))
+        except zlib.error as e:
+            # El reporte ya está en curso: el error de lectura va en el resumen
+            summary["error"] = f"gzip inválido: {e}"
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield report(task)
+    finally:
+        # Cliente desconectado o error de lectura: no dejar escrituras huérfanas
+        for task in pending:
+            task.cancel()
+    yield (json.dumps({"summary": summary}) + "\n").encode("utf-8")
@@ -0,0 +1,529 @@
+# temp_backend/change_feed.py
+"""
+Procesador del change feed de Cosmos para vistas materializadas.
+
+Sigue los contenedores fuente (carnets, notas, citas, vacunacion) y entrega
+los documentos cambiados a las vistas registradas (ViewBuilder), que mantienen
+agregados o índices secundarios sin volver a consultar los contenedores.
+
+- Cada vista guarda un lease por contenedor fuente (la continuation del feed)
+  en un LeaseStore: archivo JSON local, contenedor de Cosmos o memoria.
+- Cada lease tiene dueño (owner) y vencimiento (expiresAt): con varios
+  workers de gunicorn solo el dueño procesa esa vista/fuente y avanza la
+  continuation; los demás la toman cuando el dueño la suelta (stop) o deja
+  de renovarla por CHANGE_FEED_LEASE_SECONDS.
+- La entrega es at-least-once: el lease se guarda después de que la vista
+  procesó la página, así que tras un reinicio o un error la página se vuelve a
+  entregar. Las vistas deben ser idempotentes por id de documento.
+- El feed es el de última versión: solo creaciones y actualizaciones (los
+  borrados no aparecen) y de un documento modificado varias veces puede
+  llegar solo la versión final.
+- Las vistas con estado en memoria (durable = False) no persisten su lease:
+  se reconstruyen desde el principio del feed en cada arranque.
+- Una vista durable puede guardar su estado en el lease (state/restore): el
+  dueño lo escribe en cada checkpoint y los demás workers lo cargan cuando
+  avanza, sin releer el feed.
+
+Corre como tarea de fondo de main.py (CHANGE_FEED_ENABLED=true) o como
+worker aparte:
+    python change_feed.py
+
+Configuración (variables de entorno):
+    CHANGE_FEED_ENABLED          arrancar el procesador en main.py (default false)
+    CHANGE_FEED_POLL_SECONDS     espera entre rondas sin cambios (default 5)
+    CHANGE_FEED_PAGE_SIZE        documentos por página del feed (default 100)
+    CHANGE_FEED_LEASE_FILE       archivo de leases (default ./change_feed_leases.json)
+    CHANGE_FEED_LEASE_CONTAINER  si se define, los leases se guardan en ese contenedor (PK /id)
+    CHANGE_FEED_LEASE_SECONDS    vigencia del lease de un worker sin renovarlo (default 60)
+    CHANGE_FEED_VIEWS            vistas del worker: "modulo:Clase,modulo:Clase"
+"""
+
+import asyncio
+import importlib
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from azure.cosmos.exceptions import CosmosHttpResponseError
+from dotenv import load_dotenv
+
+try:
+    import fcntl
+except ImportError:
+    # Windows (desarrollo local): sin flock; un solo proceso usa el archivo de leases
+    fcntl = None
+
+load_dotenv()
+
+CHANGE_FEED_ENABLED = os.environ.get("CHANGE_FEED_ENABLED", "false").lower() == "true"
+CHANGE_FEED_POLL_SECONDS = float(os.environ.get("CHANGE_FEED_POLL_SECONDS", "5"))
+CHANGE_FEED_PAGE_SIZE = int(os.environ.get("CHANGE_FEED_PAGE_SIZE", "100"))
+CHANGE_FEED_LEASE_FILE = os.environ.get("CHANGE_FEED_LEASE_FILE", "change_feed_leases.json")
+CHANGE_FEED_LEASE_CONTAINER = os.environ.get("CHANGE_FEED_LEASE_CONTAINER", "")
+CHANGE_FEED_LEASE_SECONDS = float(os.environ.get("CHANGE_FEED_LEASE_SECONDS", "60"))
+
+# FileLeaseStore: valor de fn en update() para borrar la clave
+_DELETE = object()
+
+
+class ViewBuilder:
+    """
+    Base de una vista materializada. `sources` son las claves de contenedor a las
+    que se suscribe; apply() recibe cada página de documentos cambiados.
+    """
+
+    name: str = ""
+    sources: tuple = ()
+    # False: el estado vive en memoria del proceso y se reconstruye en cada arranque
+    durable: bool = True
+
+    async def reset(self):
+        """Se llama antes de releer el feed desde el principio (vista nueva o sin lease)."""
+
+    async def apply(self, source: str, docs: List[dict]):
+        raise NotImplementedError
+
+    async def caught_up(self, source: str):
+        """Se llama cada vez que la vista quedó al día con una fuente (sin cambios pendientes)."""
+
+    def state(self, source: str) -> Any:
+        """
+        Estado de la vista a guardar en el lease junto con la continuation
+        (None: no se guarda). Con estado la entrega es exactly-once: el estado y
+        la continuation avanzan en la misma escritura.
+        """
+        return None
+
+    async def restore(self, source: str, state: Any):
+        """Carga el estado guardado en el lease (al tomarlo o, sin ser dueño, cuando avanza)."""
+
+
+# ============================================
+# LEASES
+# ============================================
+
+class MemoryLeaseStore:
+    """Leases en memoria del proceso (pruebas y vistas no durables)."""
+
+    def __init__(self):
+        self._leases: Dict[str, dict] = {}
+
+    async def get(self, key: str) -> Optional[dict]:
+        return self._leases.get(key)
+
+    async def set(self, key: str, lease: dict):
+        self._leases[key] = dict(lease)
+
+    async def update(self, key: str, fn) -> Optional[dict]:
+        """
+        Escritura condicional: fn recibe el lease actual (o None) y retorna el
+        nuevo, o None para no escribir. Retorna el lease escrito o None.
+        """
+        lease = fn(self._leases.get(key))
+        if lease is None:
+            return None
+        self._leases[key] = dict(lease)
+        return lease
+
+    async def delete(self, key: str):
+        self._leases.pop(key, None)
+
+
+class FileLeaseStore:
+    """
+    Leases en un archivo JSON local compartido por los procesos del host.
+    Cada escritura relee el archivo bajo flock ({path}.lock) y lo reescribe de
+    forma atómica, así los workers no se pisan los leases entre sí.
+    """
+
+    def __init__(self, path: str = CHANGE_FEED_LEASE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _update(self, key: str, fn) -> Optional[dict]:
+        with self._lock, open(f"{self.path}.lock", "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            leases = self._load()
+            lease = fn(leases.get(key))
+            if lease is None:
+                return None
+            if lease is _DELETE:
+                leases.pop(key, None)
+            else:
+                leases[key] = dict(lease)
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(leases, f, indent=2)
+            os.replace(tmp, self.path)
+            return lease
+
+    async def get(self, key: str) -> Optional[dict]:
+        return (await asyncio.to_thread(self._load)).get(key)
+
+    async def set(self, key: str, lease: dict):
+        await asyncio.to_thread(self._update, key, lambda _: lease)
+
+    async def update(self, key: str, fn) -> Optional[dict]:
+        """Ver MemoryLeaseStore.update; atómico entre procesos del mismo host."""
+        return await asyncio.to_thread(self._update, key, fn)
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self._update, key, lambda lease: _DELETE if lease is not None else None)
+
+
+class ContainerLeaseStore:
+    """
+    Leases como documentos "lease:<clave>" en un contenedor de Cosmos (PK /id).
+    update() es condicional por _etag (If-Match) o por create (409 si otro
+    proceso lo creó primero), así que sirve entre workers y hosts.
+    """
+
+    def __init__(self, helper):
+        self.helper = helper
+
+    async def get(self, key: str) -> Optional[dict]:
+        try:
+            return await self.helper.read_item(f"lease:{key}", f"lease:{key}")
+        except CosmosHttpResponseError as e:
+            if e.status_code == 404:
+                return None
+            raise
+
+    async def set(self, key: str, lease: dict):
+        await self.helper.upsert_item({**lease, "id": f"lease:{key}"}, f"lease:{key}")
+
+    async def update(self, key: str, fn) -> Optional[dict]:
+        """Ver MemoryLeaseStore.update; None también si otro proceso escribió antes."""
+        current = await self.get(key)
+        lease = fn(current)
+        if lease is None:
+            return None
+        body = {**lease, "id": f"lease:{key}"}
+        try:
+            if current is None:
+                await self.helper.create_item(body)
+            else:
+                await self.helper.replace_item(body["id"], body, etag=current.get("_etag"))
+        except CosmosHttpResponseError as e:
+            if e.status_code in (409, 412):
+                return None
+            raise
+        return lease
+
+    async def delete(self, key: str):
+        await self.set(key, {"continuation": None})
+
+
+def _lease_body(lease: Optional[dict]) -> dict:
+    """Campos propios del lease, sin id ni propiedades de sistema de Cosmos (_etag, _ts...)."""
+    return {k: v for k, v in (lease or {}).items() if k != "id" and not k.startswith("_")}
+
+
+def lease_owner() -> str:
+    """Identifica a este proceso como dueño de leases (host:pid:aleatorio)."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+async def acquire_lease(store, key: str, owner: str, seconds: float) -> Optional[dict]:
+    """
+    Toma el lease si está libre, vencido o ya es de owner y lo deja vigente
+    por seconds más. Retorna None si otro dueño lo tiene vigente. Sirve
+    también para elegir un solo worker para un job (ver audit_retention.py).
+    """
+    def claim(current):
+        current = _lease_body(current)
+        if current.get("owner") not in (None, owner) and current.get("expiresAt", 0) > time.time():
+            return None
+        return {**current, "owner": owner, "expiresAt": time.time() + seconds}
+
+    return await store.update(key, claim)
+
+
+def default_lease_store():
+    """Contenedor de leases si CHANGE_FEED_LEASE_CONTAINER está definido; si no, archivo local."""
+    if CHANGE_FEED_LEASE_CONTAINER:
+        from cosmos_helper import AsyncCosmosDBHelper
+        return ContainerLeaseStore(AsyncCosmosDBHelper(CHANGE_FEED_LEASE_CONTAINER, "/id"))
+    return FileLeaseStore()
+
+
+# ============================================
+# PROCESADOR
+# ============================================
+
+class ChangeFeedProcessor:
+    """
+    Lee el change feed de cada contenedor fuente y lo reparte a las vistas
+    suscritas. Una fuente es un AsyncCosmosDBHelper o una función sin
+    argumentos que lo retorna (contenedores con inicialización lazy).
+    """
+
+    def __init__(self, leases=None, poll_seconds: float = CHANGE_FEED_POLL_SECONDS,
+                 page_size: int = CHANGE_FEED_PAGE_SIZE, lease_seconds: float = CHANGE_FEED_LEASE_SECONDS,
+                 owner: Optional[str] = None):
+        self.leases = leases if leases is not None else MemoryLeaseStore()
+        self.poll_seconds = poll_seconds
+        self.page_size = page_size
+        self.lease_seconds = lease_seconds
+        self.owner = owner or lease_owner()
+        self._sources: Dict[str, Any] = {}
+        self._views: Dict[str, ViewBuilder] = {}
+        self._volatile = MemoryLeaseStore()
+        self._owned: Dict[str, Any] = {}
+        # Continuation del estado cargado de leases ajenos (ver _follow)
+        self._followed: Dict[str, Any] = {}
+        self._started: set = set()
+        self._task: Optional[asyncio.Task] = None
+        self._stop = asyncio.Event()
+        self._stats: Dict[str, dict] = {}
+
+    def add_source(self, name: str, source):
+        self._sources[name] = source
+
+    def register(self, view: ViewBuilder) -> ViewBuilder:
+        if not view.name:
+            raise ValueError("La vista necesita un name (se usa en la clave del lease)")
+        unknown = [s for s in view.sources if s not in self._sources]
+        if unknown:
+            raise ValueError(f"Fuentes de change feed desconocidas para {view.name}: {unknown}")
+        self._views[view.name] = view
+        return view
+
+    @property
+    def views(self) -> Dict[str, ViewBuilder]:
+        return dict(self._views)
+
+    def _helper(self, name: str):
+        source = self._sources[name]
+        if not hasattr(source, "read_change_feed"):
+            source = source()
+        return source
+
+    def _lease_store(self, view: ViewBuilder):
+        return self.leases if view.durable else self._volatile
+
+    async def _acquire(self, store, key: str) -> Optional[dict]:
+        """
+        Toma o renueva el lease (ver acquire_lease); no escribe mientras le
+        quede más de la mitad de la vigencia. None si otro worker lo tiene.
+        """
+        lease = await store.get(key)
+        if (lease and lease.get("owner") == self.owner
+                and lease.get("expiresAt", 0) - time.time() > self.lease_seconds / 2):
+            return lease
+        lease = await acquire_lease(store, key, self.owner, self.lease_seconds)
+        if lease is None:
+            self._owned.pop(key, None)
+        else:
+            self._owned[key] = store
+        return lease
+
+    async def _release(self):
+        """Suelta los leases propios para que otro worker los tome sin esperar el vencimiento."""
+        def release(current):
+            current = _lease_body(current)
+            if current.get("owner") != self.owner:
+                return None
+            return {**current, "owner": None, "expiresAt": 0}
+
+        for key, store in list(self._owned.items()):
+            try:
+                await store.update(key, release)
+            except Exception as e:
+                print(f"⚠️ Change feed: no se pudo soltar el lease {key}: {e}")
+        self._owned.clear()
+
+    async def _take(self, view: ViewBuilder, store, key: str, source: str) -> Optional[dict]:
+        """_acquire que, al pasar a ser dueño, carga en la vista el estado guardado en el lease."""
+        was_owner = key in self._owned
+        lease = await self._acquire(store, key)
+        if lease is not None and not was_owner:
+            self._followed.pop(key, None)
+            if "state" in lease:
+                await view.restore(source, lease["state"])
+        return lease
+
+    async def _follow(self, view: ViewBuilder, store, key: str, source: str) -> bool:
+        """
+        Sin ser dueño del lease: carga el estado que guardó el dueño cuando su
+        continuation avanzó. Retorna True si la vista quedó al día.
+        """
+        lease = await store.get(key) or {}
+        if "state" not in lease:
+            return False
+        if key not in self._followed or lease.get("continuation") != self._followed[key]:
+            await view.restore(source, lease["state"])
+            self._followed[key] = lease.get("continuation")
+        return True
+
+    async def _start_view(self, view: ViewBuilder):
+        """
+        Primera ronda de la vista: si este proceso tiene todos sus leases y
+        ninguno tiene continuation, se reconstruye desde el principio.
+        """
+        store = self._lease_store(view)
+        leases = [await self._take(view, store, f"{view.name}:{source}", source) for source in view.sources]
+        if all(leases) and not any(lease.get("continuation") for lease in leases):
+            await view.reset()
+        self._started.add(view.name)
+
+    async def _drain(self, view: ViewBuilder, source: str):
+        """
+        Entrega a la vista todas las páginas pendientes de una fuente. Retorna
+        (documentos entregados, vista al día); sin el lease solo sigue el estado
+        que guarda su dueño.
+        """
+        store = self._lease_store(view)
+        key = f"{view.name}:{source}"
+        stats = self._stats.setdefault(key, {"processed": 0, "errors": 0, "last_error": None, "last_checkpoint": None})
+        lease = await self._take(view, store, key, source)
+        if lease is None:
+            return 0, await self._follow(view, store, key, source)
+        continuation = lease.get("continuation")
+        helper = self._helper(source)
+        delivered = 0
+        while True:
+            docs, next_continuation = await helper.read_change_feed(continuation, page_size=self.page_size)
+            if docs:
+                await view.apply(source, docs)
+                delivered += len(docs)
+            # Fin del feed: sin continuation nueva. Una página corta no lo indica
+            # (el feed puede cortar páginas antes de page_size).
+            if not next_continuation or next_continuation == continuation:
+                break
+            continuation = next_continuation
+            stats["last_checkpoint"] = datetime.utcnow().isoformat() + "Z"
+            fields = {"continuation": continuation, "updatedAt": stats["last_checkpoint"],
+                      "processed": lease.get("processed", 0) + delivered}
+            state = view.state(source)
+            if state is not None:
+                fields["state"] = state
+
+            def checkpoint(current):
+                current = _lease_body(current)
+                if current.get("owner") != self.owner:
+                    return None
+                return {**current, **fields, "expiresAt": time.time() + self.lease_seconds}
+
+            if await store.update(key, checkpoint) is None:
+                # Otro worker tomó el lease (el nuestro venció): deja de avanzar y
+                # en la próxima ronda sigue el estado que guarde el nuevo dueño
+                self._owned.pop(key, None)
+                self._followed.pop(key, None)
+                print(f"⚠️ Change feed {key}: lease tomado por otro worker")
+                stats["processed"] += delivered
+                return delivered, False
+            if not docs:
+                break
+        stats["processed"] += delivered
+        return delivered, True
+
+    async def run_once(self) -> int:
+        """Una ronda sobre todas las vistas y fuentes; retorna los documentos entregados."""
+        delivered = 0
+        for view in list(self._views.values()):
+            for source in view.sources:
+                key = f"{view.name}:{source}"
+                try:
+                    if view.name not in self._started:
+                        await self._start_view(view)
+                    count, up_to_date = await self._drain(view, source)
+                    delivered += count
+                    if up_to_date:
+                        await view.caught_up(source)
+                except Exception as e:
+                    # El lease no avanza: la página se reintenta en la próxima ronda.
+                    # Se olvida el lease para recargar el estado guardado (el de la
+                    # memoria puede tener aplicada parte de la página).
+                    self._owned.pop(key, None)
+                    self._followed.pop(key, None)
+                    stats = self._stats.setdefault(key, {"processed": 0, "errors": 0, "last_checkpoint": None})
+                    stats["errors"] += 1
+                    stats["last_error"] = str(e)
+                    print(f"⚠️ Change feed {key}: {e}")
+        return delivered
+
+    async def run_forever(self):
+        """Procesa rondas hasta stop(); espera poll_seconds solo cuando no hubo cambios."""
+        while not self._stop.is_set():
+            if await self.run_once():
+                continue
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        """Arranca el procesador como tarea de fondo del event loop actual."""
+        if self._task is None or self._task.done():
+            self._stop.clear()
+            self._task = asyncio.create_task(self.run_forever())
+        return self._task
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self._release()
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "owner": self.owner,
+            "owned": sorted(self._owned),
+            "views": {name: list(view.sources) for name, view in self._views.items()},
+            "leases": {key: dict(value) for key, value in self._stats.items()},
+        }
+
+
+def load_views(spec: str) -> Iterable[ViewBuilder]:
+    """Instancia las vistas de "modulo:Clase,modulo:Clase" (CHANGE_FEED_VIEWS)."""
+    for entry in filter(None, (e.strip() for e in spec.split(","))):
+        module_name, _, attr = entry.partition(":")
+        yield getattr(importlib.import_module(module_name), attr)()
+
+
+def default_sources() -> Dict[str, Any]:
+    """Contenedores fuente con los mismos nombres y partition keys que main.py."""
+    from cosmos_helper import AsyncCosmosDBHelper, get_citas_helper_async
+    return {
+        "carnets": AsyncCosmosDBHelper(os.environ["COSMOS_CONTAINER_CARNETS"], "/id"),
+        "notas": AsyncCosmosDBHelper(os.environ["COSMOS_CONTAINER_NOTAS"], "/matricula"),
+        "citas": get_citas_helper_async,
+        "vacunacion": AsyncCosmosDBHelper(
+            os.environ.get("COSMOS_CONTAINER_VACUNACION", "Tarjeta_vacunacion"), "/matricula"
+        ),
+    }
+
+
+async def _worker():
+    from cosmos_helper import close_async_clients
+    processor = ChangeFeedProcessor(leases=default_lease_store())
+    for name, source in default_sources().items():
+        processor.add_source(name, source)
+    for view in load_views(os.environ.get("CHANGE_FEED_VIEWS", "")):
+        processor.register(view)
+    print(f"🔄 Change feed worker: vistas {list(processor.views)}")
+    try:
+        await processor.run_forever()
+    finally:
+        await processor._release()
+        await close_async_clients()
+
+
+if __name__ == "__main__":
+    asyncio.run(_worker())
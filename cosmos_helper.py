@@ -1,84 +1,601 @@
+import asyncio
+import json
 import os
-import time
+import re
+import threading
+from copy import deepcopy
+from azure.core import MatchConditions
 from azure.cosmos import CosmosClient
-from azure.cosmos.exceptions import CosmosHttpResponseError
+from azure.cosmos.aio import CosmosClient as AsyncCosmosClient
+from azure.cosmos.documents import ConnectionPolicy, RetryOptions
+from azure.cosmos.exceptions import CosmosBatchOperationError, CosmosHttpResponseError
 from dotenv import load_dotenv
 
 load_dotenv()
 
-COSMOS_URL = os.environ["COSMOS_URL"]
-COSMOS_KEY = os.environ["COSMOS_KEY"]
-DB_NAME = os.environ["COSMOS_DB"]
+from storage_backends import AsyncLocalContainer, get_local_container, is_local_backend
+from cosmos_throttle import call_with_throttle, acall_with_throttle, settle_charge
+from ru_metrics import COSMOS_QUERY_METRICS, RUCapture, ru_accumulator
 
-class CosmosDBHelper:
-    def __init__(self, container_name, partition_key):
-        self.client = CosmosClient(COSMOS_URL, credential=COSMOS_KEY)
-        self.database = self.client.get_database_client(DB_NAME)
-        self.container = self.database.get_container_client(container_name)
+# Con STORAGE_BACKEND=memory|sqlite no se necesita una cuenta de Cosmos
+if is_local_backend():
+    COSMOS_URL = os.environ.get("COSMOS_URL", "")
+    COSMOS_KEY = os.environ.get("COSMOS_KEY", "")
+    DB_NAME = os.environ.get("COSMOS_DB", "local")
+else:
+    COSMOS_URL = os.environ["COSMOS_URL"]
+    COSMOS_KEY = os.environ["COSMOS_KEY"]
+    DB_NAME = os.environ["COSMOS_DB"]
+
+# ============================================
+# REGISTRO DE CLIENTES COMPARTIDOS (uno por proceso)
+# ============================================
+# Cada CosmosClient tiene su propio pool de conexiones, handshakes TLS y
+# lectura de metadata de la cuenta. Todos los helpers y las rutas de citas
+# comparten un solo cliente (sync y aio) y un solo handle de base de datos;
+# los proxies de contenedor se cachean por nombre.
+# Con un backend local (storage_backends.py) el registro entrega contenedores
+# locales con la misma interfaz y no se crea ningún CosmosClient.
+_registry_lock = threading.Lock()
+_client = None
+_database = None
+_containers = {}
+_async_client = None
+_async_database = None
+_async_containers = {}
+
+def _connection_policy():
+    """
+    Política de conexión sin reintentos de throttling del SDK: los 429 los maneja
+    cosmos_throttle.py (bucket de RU + backoff), así no se multiplican los reintentos.
+    """
+    policy = ConnectionPolicy()
+    policy.RetryOptions = RetryOptions(max_retry_attempt_count=0)
+    return policy
+
+def get_cosmos_client():
+    """Retorna el CosmosClient síncrono compartido del proceso."""
+    global _client
+    if _client is None:
+        with _registry_lock:
+            if _client is None:
+                _client = CosmosClient(COSMOS_URL, credential=COSMOS_KEY, connection_policy=_connection_policy())
+    return _client
+
+def get_database():
+    """Retorna el DatabaseProxy síncrono compartido."""
+    global _database
+    if _database is None:
+        client = get_cosmos_client()
+        with _registry_lock:
+            if _database is None:
+                _database = client.get_database_client(DB_NAME)
+    return _database
+
+def get_container(container_name, partition_key="/id"):
+    """Retorna el ContainerProxy síncrono cacheado para container_name."""
+    if is_local_backend():
+        return get_local_container(container_name, partition_key)
+    container = _containers.get(container_name)
+    if container is None:
+        database = get_database()
+        with _registry_lock:
+            container = _containers.get(container_name)
+            if container is None:
+                container = database.get_container_client(container_name)
+                _containers[container_name] = container
+    return container
+
+def get_async_cosmos_client():
+    """Retorna el CosmosClient aio compartido del proceso."""
+    global _async_client
+    if _async_client is None:
+        with _registry_lock:
+            if _async_client is None:
+                _async_client = AsyncCosmosClient(COSMOS_URL, credential=COSMOS_KEY, connection_policy=_connection_policy())
+    return _async_client
+
+def get_async_database():
+    """Retorna el DatabaseProxy aio compartido."""
+    global _async_database
+    if _async_database is None:
+        client = get_async_cosmos_client()
+        with _registry_lock:
+            if _async_database is None:
+                _async_database = client.get_database_client(DB_NAME)
+    return _async_database
+
+def get_async_container(container_name, partition_key="/id"):
+    """Retorna el ContainerProxy aio cacheado para container_name."""
+    if is_local_backend():
+        return AsyncLocalContainer(get_local_container(container_name, partition_key))
+    container = _async_containers.get(container_name)
+    if container is None:
+        database = get_async_database()
+        with _registry_lock:
+            container = _async_containers.get(container_name)
+            if container is None:
+                container = database.get_container_client(container_name)
+                _async_containers[container_name] = container
+    return container
+
+# ============================================
+# QUERIES ACOTADAS A UNA PARTICIÓN
+# ============================================
+_FROM_ALIAS_RE = re.compile(r"\bFROM\s+(\w+)", re.IGNORECASE)
+_WHERE_RE = re.compile(r"\bWHERE\b(.*?)(?:\bORDER\s+BY\b|\bGROUP\s+BY\b|\bOFFSET\b|$)", re.IGNORECASE | re.DOTALL)
+_STRING_RE = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+# Operadores que pueden ampliar o negar un término: con cualquiera de ellos no se detecta
+_UNSAFE_RE = re.compile(r"\b(?:OR|NOT|SELECT|EXISTS|ARRAY)\b|\?", re.IGNORECASE)
+_AND_OR_PAREN_RE = re.compile(r"\(|\)|\bAND\b", re.IGNORECASE)
+_VALUE = r"(?P<value>@\w+|'\d+'|-?\d+(?:\.\d+)?)"
+
+def _conjuncts(where):
+    """Términos de un WHERE unidos por AND fuera de paréntesis; None si los paréntesis no cierran."""
+    terms, depth, start = [], 0, 0
+    for match in _AND_OR_PAREN_RE.finditer(where):
+        token = match.group(0)
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+            if depth < 0:
+                return None
+        elif depth == 0:
+            terms.append(where[start:match.start()].strip())
+            start = match.end()
+    if depth != 0:
+        return None
+    terms.append(where[start:].strip())
+    return terms
+
+def detect_partition_key(sql, params, partition_key_path):
+    """
+    Si el WHERE de la query es una conjunción (solo AND) y uno de sus términos
+    es la igualdad de la propiedad de partition key (p. ej. c.matricula = @m en
+    un contenedor /matricula), retorna ese valor para enrutar la query a una
+    sola partición. Con OR, NOT, subqueries o el término entre paréntesis
+    retorna None: la query va cross-partition, que siempre es correcto.
+    """
+    field = partition_key_path.strip("/")
+    if not field or "/" in field:
+        return None
+    # Los literales de texto se reemplazan por '<n>' para que su contenido no
+    # parezca SQL (p. ej. 'A OR B' o una comilla dentro del valor)
+    literals = []
+
+    def mask(match):
+        literals.append(match.group(0)[1:-1])
+        return f"'{len(literals) - 1}'"
+    masked = _STRING_RE.sub(mask, sql)
+    alias_match = _FROM_ALIAS_RE.search(masked)
+    where_match = _WHERE_RE.search(masked)
+    if not alias_match or not where_match or _UNSAFE_RE.search(where_match.group(1)):
+        return None
+    terms = _conjuncts(where_match.group(1))
+    if terms is None:
+        return None
+    prop = rf"{re.escape(alias_match.group(1))}\s*(?:\.\s*{re.escape(field)}|\[\s*'(?P<key>\d+)'\s*\])"
+    for term in terms:
+        match = (re.fullmatch(rf"{prop}\s*=\s*{_VALUE}", term, re.IGNORECASE)
+                 or re.fullmatch(rf"{_VALUE}\s*=\s*{prop}", term, re.IGNORECASE))
+        if not match or (match.group("key") is not None and literals[int(match.group("key"))] != field):
+            continue
+        token = match.group("value")
+        if token.startswith("@"):
+            for param in params or []:
+                if param.get("name") == token:
+                    return param.get("value")
+            return None
+        if token.startswith("'"):
+            return literals[int(token[1:-1])]
+        return float(token) if "." in token else int(token)
+    return None
+
+def partition_query_kwargs(sql, params, partition_key_path, partition_key=None):
+    """kwargs de query_items: partition_key si se conoce (o se detecta), si no cross-partition."""
+    if partition_key is None:
+        partition_key = detect_partition_key(sql, params, partition_key_path)
+    if partition_key is not None:
+        return {"partition_key": partition_key}
+    return {"enable_cross_partition_query": True}
+
+# ============================================
+# BATCH TRANSACCIONAL POR PARTICIÓN
+# ============================================
+BATCH_MAX_OPERATIONS = 100  # Límite de Cosmos por batch transaccional
+
+def _document_pk(body, partition_key_path):
+    value = body
+    for segment in (s for s in partition_key_path.split("/") if s):
+        if not isinstance(value, dict) or segment not in value:
+            return None
+        value = value[segment]
+    return value
+
+def plan_batches(operations, partition_key_path, partition_key=None):
+    """
+    Agrupa operaciones de batch por partition key y las parte en lotes de
+    BATCH_MAX_OPERATIONS. Cada operación usa el formato del SDK:
+        ("create", (doc,))  ("upsert", (doc,))  ("replace", (id, doc))
+        ("delete", (id,))   ("read", (id,))     ("patch", (id, operaciones))
+        [+ dict de opciones]
+    La partition key se toma del documento; para delete/read/patch (o para forzarla)
+    va en las opciones como {"partition_key": valor}, o para todo el batch en
+    partition_key. Retorna [(pk, [(índice original, operación), ...]), ...].
+    """
+    groups = {}
+    for index, operation in enumerate(operations):
+        op, args = operation[0], operation[1]
+        options = dict(operation[2]) if len(operation) > 2 else {}
+        pk = options.pop("partition_key", partition_key)
+        if pk is None and op.lower() in ("create", "upsert", "replace"):
+            pk = _document_pk(args[-1], partition_key_path)
+        if pk is None:
+            raise ValueError(f"Operación {index} ({op}) sin partition key")
+        sdk_operation = (op, tuple(args), options) if options else (op, tuple(args))
+        groups.setdefault(json.dumps(pk), (pk, []))[1].append((index, sdk_operation))
+    plan = []
+    for pk, entries in groups.values():
+        for start in range(0, len(entries), BATCH_MAX_OPERATIONS):
+            plan.append((pk, entries[start:start + BATCH_MAX_OPERATIONS]))
+    return plan
+
+def _batch_results(pk, chunk, outcome):
+    """Resultado por operación de un lote: respuesta del batch o del error."""
+    if isinstance(outcome, CosmosBatchOperationError):
+        responses = outcome.operation_responses or []
+    elif isinstance(outcome, CosmosHttpResponseError):
+        responses = []
+    else:
+        responses = list(outcome)
+    results = []
+    for position, (index, operation) in enumerate(chunk):
+        response = responses[position] if position < len(responses) else {}
+        status = int(response.get("statusCode") or getattr(outcome, "status_code", 0) or 500)
+        result = {
+            "index": index,
+            "operation": operation[0].lower(),
+            "partition_key": pk,
+            "status_code": status,
+            "etag": response.get("eTag"),
+            "resource": response.get("resourceBody"),
+        }
+        if status == 424:
+            result["error"] = "Operación no aplicada: falló otra operación del mismo batch"
+        elif status >= 400:
+            result["error"] = response.get("message") or getattr(outcome, "http_error_message", None)
+        results.append(result)
+    return results
+
+def _throttled_batch(error):
+    """Un batch con una operación en 429 se reintenta entero en la capa de throttling."""
+    throttled = CosmosHttpResponseError(status_code=429, message=error.http_error_message)
+    throttled.headers = error.headers or {}
+    return throttled
+
+def _cache_key(item_id, partition_key):
+    return (json.dumps(partition_key), item_id)
+
+def _batch_cache_keys(plan):
+    """Claves de caché de los documentos que toca un plan de batch."""
+    for pk, chunk in plan:
+        for _, operation in chunk:
+            target = operation[1][0]
+            yield _cache_key(target.get("id") if isinstance(target, dict) else target, pk)
+
+def _record_ru(container_name, operation, capture, result, sql):
+    """Registra el cargo de RU de la llamada y ajusta el bucket con el cargo real."""
+    if not capture.responses:
+        return
+    if isinstance(result, tuple):
+        # query_page retorna (items, continuation)
+        result = result[0]
+    item_count = len(result) if isinstance(result, list) else (1 if result else 0)
+    ru_accumulator.record(container_name, operation, capture, item_count=item_count, sql=sql)
+    settle_charge(container_name, operation, capture.request_charge)
+
+def tracked_call(container_name, operation, fn, *args, sql=None, **kwargs):
+    """
+    Ejecuta fn contra Cosmos con throttling y contabilidad de RU.
+    fn debe aceptar el keyword response_hook (como los métodos del SDK).
+    """
+    capture = RUCapture()
+    result = None
+    try:
+        result = call_with_throttle(container_name, operation, fn, *args, response_hook=capture, **kwargs)
+        return result
+    finally:
+        _record_ru(container_name, operation, capture, result, sql)
+
+async def atracked_call(container_name, operation, fn, *args, sql=None, **kwargs):
+    """Versión async de tracked_call (fn debe ser async)."""
+    capture = RUCapture()
+    result = None
+    try:
+        result = await acall_with_throttle(container_name, operation, fn, *args, response_hook=capture, **kwargs)
+        return result
+    finally:
+        _record_ru(container_name, operation, capture, result, sql)
+
+class _CosmosHelperBase:
+    """
+    Parte común de CosmosDBHelper y AsyncCosmosDBHelper: arma los argumentos
+    de cada request (condiciones, queries, change feed, batches) y procesa los
+    resultados (caché de point reads, resultados de batch). Las subclases solo
+    hacen la llamada al SDK, sync o aio.
+    """
+    def __init__(self, container_name, partition_key, cache, client, database, container):
+        self.client = client
+        self.database = database
+        self.container = container
+        self.container_name = container_name
         self.partition_key = partition_key
+        # TTLCache opcional de point reads (ver _revalidation)
+        self.cache = cache if cache is not None and cache.enabled else None
+
+    def _invalidate(self, item_id, partition_key):
+        if self.cache is not None:
+            self.cache.pop(_cache_key(item_id, partition_key))
+
+    def _revalidation(self, item_id, partition_key):
+        """
+        Point read con caché read-through: retorna (entrada, kwargs de read_item).
+        Con una entrada vigente kwargs es None y no se toca Cosmos; una vencida se
+        revalida con If-None-Match sobre su _etag (un 304 no trae el documento y
+        cuesta menos RU).
+        """
+        entry = self.cache.get_entry(_cache_key(item_id, partition_key))
+        if entry is not None and not entry.expired:
+            return entry, None
+        request = {"item": item_id, "partition_key": partition_key}
+        etag = entry.value.get("_etag") if entry is not None else None
+        if etag:
+            request.update(etag=etag, match_condition=MatchConditions.IfModified)
+        return entry, request
+
+    def _revalidated(self, item_id, partition_key, entry, doc):
+        """Aplica la respuesta del point read a la caché y retorna el documento."""
+        key = _cache_key(item_id, partition_key)
+        if not doc and entry is not None:
+            # 304 Not Modified: el documento en caché sigue vigente
+            self.cache.touch(key)
+            return deepcopy(entry.value)
+        self.cache.set(key, deepcopy(dict(doc)))
+        return doc
+
+    @staticmethod
+    def _conditions(etag=None, filter_predicate=None):
+        """Kwargs de escritura condicional: If-Match sobre etag y/o filter_predicate."""
+        conditions = {"etag": etag, "match_condition": MatchConditions.IfNotModified} if etag else {}
+        if filter_predicate:
+            conditions["filter_predicate"] = filter_predicate
+        return conditions
+
+    def _query_kwargs(self, sql, params, partition_key, **extra):
+        """
+        Kwargs de query_items. Con partition_key (o si se detecta una igualdad
+        sobre la partition key en el WHERE) la query se enruta a una sola partición.
+        """
+        return dict(
+            query=sql,
+            parameters=params or [],
+            populate_query_metrics=COSMOS_QUERY_METRICS,
+            **partition_query_kwargs(sql, params, self.partition_key, partition_key),
+            **extra
+        )
+
+    @staticmethod
+    def _change_feed_kwargs(continuation, page_size, start_time):
+        """Sin continuation el change feed arranca en start_time."""
+        start = {"continuation": continuation} if continuation else {"start_time": start_time}
+        return dict(max_item_count=page_size, **start)
+
+    @staticmethod
+    def _batch_kwargs(pk, chunk):
+        return {"batch_operations": [operation for _, operation in chunk], "partition_key": pk}
+
+    @staticmethod
+    def _batch_failure(error):
+        """Un batch con una operación en 429 se reintenta entero; otro fallo es un resultado."""
+        if error.status_code == 429:
+            raise _throttled_batch(error)
+        return error
+
+    @staticmethod
+    def _batch_done(operations, chunks):
+        """Resultados por operación, en el orden de entrada (ver plan_batches)."""
+        results = [None] * len(operations)
+        for chunk_results in chunks:
+            for result in chunk_results:
+                results[result["index"]] = result
+        return results
+
+    def _invalidate_batch(self, plan):
+        if self.cache is not None:
+            for key in _batch_cache_keys(plan):
+                self.cache.pop(key)
+
+
+class CosmosDBHelper(_CosmosHelperBase):
+    def __init__(self, container_name, partition_key, cache=None):
+        local = is_local_backend()
+        super().__init__(
+            container_name, partition_key, cache,
+            client=None if local else get_cosmos_client(),
+            database=None if local else get_database(),
+            container=get_container(container_name, partition_key),
+        )
+
+    def _call(self, operation, fn, *args, **kwargs):
+        """Ejecuta una llamada a Cosmos con throttling (429) y contabilidad de RU."""
+        return tracked_call(self.container_name, operation, fn, *args, **kwargs)
+
+    def _read(self, item_id, partition_key):
+        """Point read, con la caché y revalidación por _etag de _revalidation."""
+        if self.cache is None:
+            return self._call("read", self.container.read_item, item=item_id, partition_key=partition_key)
+        entry, request = self._revalidation(item_id, partition_key)
+        if request is None:
+            return deepcopy(entry.value)
+        try:
+            doc = self._call("read", self.container.read_item, **request)
+        except CosmosHttpResponseError:
+            self._invalidate(item_id, partition_key)
+            raise
+        return self._revalidated(item_id, partition_key, entry, doc)
 
     def get_by_id(self, id_value):
         try:
-            return self.container.read_item(item=id_value, partition_key=id_value)
+            return self._read(id_value, id_value)
         except CosmosHttpResponseError as e:
             raise CosmosHttpResponseError(status_code=e.status_code, message=e.message)
     
     def read_item(self, item_id, partition_key):
         """Lee un item por ID y partition key."""
         try:
-            return self.container.read_item(item=item_id, partition_key=partition_key)
+            return self._read(item_id, partition_key)
         except CosmosHttpResponseError as e:
             raise CosmosHttpResponseError(status_code=e.status_code, message=e.message)
     
     def create_item(self, item):
         """Crea un nuevo item en el contenedor."""
         try:
-            return self.container.create_item(body=item)
+            return self._call("create", self.container.create_item, body=item)
         except CosmosHttpResponseError as e:
             raise CosmosHttpResponseError(status_code=e.status_code, message=e.message)
+        finally:
+            self._invalidate(item.get("id"), _document_pk(item, self.partition_key))
 
-    def query_items(self, sql, params=None):
+    def replace_item(self, item_id, item, etag=None):
+        """
+        Reemplaza un item existente en un solo round trip (404 si no existe).
+        Con etag la escritura es condicional (If-Match): 412 si el documento
+        cambió desde que el cliente lo leyó.
+        """
         try:
-            return list(self.container.query_items(
-                query=sql,
-                parameters=params or [],
-                enable_cross_partition_query=True
-            ))
+            return self._call("replace", self.container.replace_item, item=item_id, body=item,
+                              **self._conditions(etag))
         except CosmosHttpResponseError as e:
             raise CosmosHttpResponseError(status_code=e.status_code, message=e.message)
+        finally:
+            self._invalidate(item_id, _document_pk(item, self.partition_key))
 
-    def upsert_item(self, item, partition_value):
+    def patch_item(self, item_id, partition_key, operations, filter_predicate=None, etag=None):
+        """
+        Actualización parcial (patch de Cosmos) en un solo round trip y sin leer
+        el documento. operations: [{"op": "set"|"incr"|"remove"|"add"|"replace",
+        "path": "/campo", "value": ...}] (máximo 10 por llamada). incr es atómico
+        en el servidor. filter_predicate ("FROM c WHERE ...") y etag hacen la
+        escritura condicional (412 si no se cumple). Retorna el documento actualizado.
+        """
+        try:
+            return self._call("patch", self.container.patch_item, item=item_id, partition_key=partition_key,
+                              patch_operations=operations, **self._conditions(etag, filter_predicate))
+        except CosmosHttpResponseError as e:
+            raise CosmosHttpResponseError(status_code=e.status_code, message=e.message)
+        finally:
+            self._invalidate(item_id, partition_key)
+
+    def query_items(self, sql, params=None, partition_key=None):
+        """Ejecuta la query y retorna todos los resultados (ver _query_kwargs)."""
+        query = self._query_kwargs(sql, params, partition_key)
+        def run(response_hook):
+            # Materializar dentro de la capa de throttling: las páginas también pueden dar 429
+            return list(self.container.query_items(response_hook=response_hook, **query))
         try:
-            # Probar diferentes métodos según la versión del SDK
+            return self._call("query", run, sql=sql)
+        except CosmosHttpResponseError as e:
+            raise CosmosHttpResponseError(status_code=e.status_code, message=e.message)
+
+    def query_page(self, sql, params=None, page_size=100, continuation=None, partition_key=None):
+        """
+        Ejecuta la query y retorna una sola página: (items, continuation).
+        continuation es el token de Cosmos para pedir la siguiente página
+        (None cuando ya no hay más resultados).
+        """
+        query = self._query_kwargs(sql, params, partition_key, max_item_count=page_size)
+        def run(response_hook):
+            pager = self.container.query_items(response_hook=response_hook, **query).by_page(continuation)
+            items = list(next(pager, []))
+            return items, pager.continuation_token
+        try:
+            return self._call("query", run, sql=sql)
+        except CosmosHttpResponseError as e:
+            raise CosmosHttpResponseError(status_code=e.status_code, message=e.message)
+
+    def query_pages(self, sql, params=None, page_size=100, continuation=None, partition_key=None):
+        """Genera páginas (items, continuation) sin materializar todo el resultado."""
+        while True:
+            items, continuation = self.query_page(sql, params, page_size, continuation, partition_key)
+            yield items, continuation
+            if not continuation:
+                return
+
+    def read_change_feed(self, continuation=None, page_size=100, start_time="Beginning"):
+        """
+        Lee una página del change feed (última versión de cada documento, en orden
+        de modificación): (items, continuation). Sin continuation arranca en
+        start_time; sin cambios nuevos retorna ([], continuation) para volver a
+        sondear más tarde con el mismo token.
+        """
+        feed = self._change_feed_kwargs(continuation, page_size, start_time)
+        def run(response_hook):
+            pager = self.container.query_items_change_feed(response_hook=response_hook, **feed).by_page()
+            items = list(next(pager, []))
+            return items, pager.continuation_token or continuation
+        try:
+            return self._call("change_feed", run)
+        except CosmosHttpResponseError as e:
+            raise CosmosHttpResponseError(status_code=e.status_code, message=e.message)
+
+    def _execute_chunk(self, pk, chunk):
+        def run(response_hook):
             try:
-                # Método nuevo (azure-cosmos >= 4.0)
-                result = self.container.upsert_item(body=item, partition_key=partition_value)
-            except TypeError as te:
-                if "partition_key" in str(te):
-                    # Método viejo (azure-cosmos < 4.0) - pasar partition key en el item
-                    pk_field = self.partition_key.lstrip('/')  # Remover '/' inicial
-                    item[pk_field] = partition_value
-                    result = self.container.upsert_item(item)
-                else:
-                    raise
-            
-            return result
+                return self.container.execute_item_batch(response_hook=response_hook, **self._batch_kwargs(pk, chunk))
+            except CosmosBatchOperationError as e:
+                return self._batch_failure(e)
+        try:
+            outcome = self._call("batch", run)
+        except CosmosHttpResponseError as e:
+            outcome = e
+        return _batch_results(pk, chunk, outcome)
+
+    def execute_batch(self, operations, partition_key=None):
+        """
+        Ejecuta create/upsert/replace/delete/read/patch como batches transaccionales de
+        Cosmos: un round trip por partition key (y por cada 100 operaciones).
+        Cada lote es atómico; si una operación falla, el resto de su lote vuelve
+        con 424 y los demás lotes se aplican igual. Retorna un resultado por
+        operación, en el orden de entrada (ver plan_batches para el formato).
+        """
+        plan = plan_batches(operations, self.partition_key, partition_key)
+        chunks = []
+        try:
+            for pk, chunk in plan:
+                chunks.append(self._execute_chunk(pk, chunk))
+        finally:
+            self._invalidate_batch(plan)
+        return self._batch_done(operations, chunks)
+
+    def _upsert(self, item, partition_value, response_hook=None):
+        # Probar diferentes métodos según la versión del SDK
+        try:
+            # Método nuevo (azure-cosmos >= 4.0)
+            return self.container.upsert_item(body=item, partition_key=partition_value, response_hook=response_hook)
+        except TypeError as te:
+            if "partition_key" in str(te):
+                # Método viejo (azure-cosmos < 4.0) - pasar partition key en el item
+                pk_field = self.partition_key.lstrip('/')  # Remover '/' inicial
+                item[pk_field] = partition_value
+                return self.container.upsert_item(item)
+            raise
+
+    def upsert_item(self, item, partition_value):
+        try:
+            # Los 429 se reintentan con backoff en call_with_throttle
+            return self._call("upsert", self._upsert, item, partition_value)
         except CosmosHttpResponseError as e:
-            # Retry para 429 (throttling)
-            if e.status_code == 429:
-                time.sleep(0.2)  # 200ms
-                try:
-                    # Retry una vez
-                    try:
-                        result = self.container.upsert_item(body=item, partition_key=partition_value)
-                    except TypeError:
-                        pk_field = self.partition_key.lstrip('/')
-                        item[pk_field] = partition_value
-                        result = self.container.upsert_item(item)
-                    return result
-                except CosmosHttpResponseError as retry_e:
-                    raise CosmosHttpResponseError(status_code=retry_e.status_code, message=retry_e.message)
-            
             # Idempotencia para 409 (conflict)
             if e.status_code == 409:
                 # Devolver el documento actual
@@ -88,16 +605,188 @@ class CosmosDBHelper:
                     raise CosmosHttpResponseError(status_code=e.status_code, message=e.message)
             
             raise CosmosHttpResponseError(status_code=e.status_code, message=e.message)
+        finally:
+            self._invalidate(item.get("id"), partition_value)
+
+
+class AsyncCosmosDBHelper(_CosmosHelperBase):
+    """
+    Contraparte asíncrona de CosmosDBHelper (azure.cosmos.aio).
+    Misma superficie (get_by_id, read_item, create_item, query_items, upsert_item)
+    pero sin bloquear el event loop ni ocupar el threadpool de Starlette.
+    """
+    def __init__(self, container_name, partition_key, cache=None):
+        local = is_local_backend()
+        super().__init__(
+            container_name, partition_key, cache,
+            client=None if local else get_async_cosmos_client(),
+            database=None if local else get_async_database(),
+            container=get_async_container(container_name, partition_key),
+        )
+
+    async def _call(self, operation, fn, *args, **kwargs):
+        """Ejecuta una llamada a Cosmos con throttling (429) y contabilidad de RU."""
+        return await atracked_call(self.container_name, operation, fn, *args, **kwargs)
+
+    async def _read(self, item_id, partition_key):
+        """Point read, con la caché y revalidación por _etag de _revalidation."""
+        if self.cache is None:
+            return await self._call("read", self.container.read_item, item=item_id, partition_key=partition_key)
+        entry, request = self._revalidation(item_id, partition_key)
+        if request is None:
+            return deepcopy(entry.value)
+        try:
+            doc = await self._call("read", self.container.read_item, **request)
+        except CosmosHttpResponseError:
+            self._invalidate(item_id, partition_key)
+            raise
+        return self._revalidated(item_id, partition_key, entry, doc)
+
+    async def get_by_id(self, id_value):
+        try:
+            return await self._read(id_value, id_value)
+        except CosmosHttpResponseError as e:
+            raise CosmosHttpResponseError(status_code=e.status_code, message=e.message)
+
+    async def read_item(self, item_id, partition_key):
+        """Lee un item por ID y partition key."""
+        try:
+            return await self._read(item_id, partition_key)
+        except CosmosHttpResponseError as e:
+            raise CosmosHttpResponseError(status_code=e.status_code, message=e.message)
+
+    async def create_item(self, item):
+        """Crea un nuevo item en el contenedor."""
+        try:
+            return await self._call("create", self.container.create_item, body=item)
+        except CosmosHttpResponseError as e:
+            raise CosmosHttpResponseError(status_code=e.status_code, message=e.message)
+        finally:
+            self._invalidate(item.get("id"), _document_pk(item, self.partition_key))
+
+    async def replace_item(self, item_id, item, etag=None):
+        """Reemplazo en un round trip, condicional con etag (ver CosmosDBHelper.replace_item)."""
+        try:
+            return await self._call("replace", self.container.replace_item, item=item_id, body=item,
+                                    **self._conditions(etag))
+        except CosmosHttpResponseError as e:
+            raise CosmosHttpResponseError(status_code=e.status_code, message=e.message)
+        finally:
+            self._invalidate(item_id, _document_pk(item, self.partition_key))
+
+    async def patch_item(self, item_id, partition_key, operations, filter_predicate=None, etag=None):
+        """Actualización parcial sin leer el documento (ver CosmosDBHelper.patch_item)."""
+        try:
+            return await self._call("patch", self.container.patch_item, item=item_id, partition_key=partition_key,
+                                    patch_operations=operations, **self._conditions(etag, filter_predicate))
+        except CosmosHttpResponseError as e:
+            raise CosmosHttpResponseError(status_code=e.status_code, message=e.message)
+        finally:
+            self._invalidate(item_id, partition_key)
+
+    async def query_items(self, sql, params=None, partition_key=None):
+        """Ejecuta la query y retorna todos los resultados (ver _query_kwargs)."""
+        query = self._query_kwargs(sql, params, partition_key)
+        async def run(response_hook):
+            return [item async for item in self.container.query_items(response_hook=response_hook, **query)]
+        try:
+            return await self._call("query", run, sql=sql)
+        except CosmosHttpResponseError as e:
+            raise CosmosHttpResponseError(status_code=e.status_code, message=e.message)
+
+    async def query_page(self, sql, params=None, page_size=100, continuation=None, partition_key=None):
+        """Una sola página de la query: (items, continuation) (ver CosmosDBHelper.query_page)."""
+        query = self._query_kwargs(sql, params, partition_key, max_item_count=page_size)
+        async def run(response_hook):
+            pager = self.container.query_items(response_hook=response_hook, **query).by_page(continuation)
+            try:
+                page = await pager.__anext__()
+            except StopAsyncIteration:
+                return [], None
+            items = [item async for item in page]
+            return items, pager.continuation_token
+        try:
+            return await self._call("query", run, sql=sql)
+        except CosmosHttpResponseError as e:
+            raise CosmosHttpResponseError(status_code=e.status_code, message=e.message)
+
+    async def query_pages(self, sql, params=None, page_size=100, continuation=None, partition_key=None):
+        """Genera páginas (items, continuation) sin materializar todo el resultado."""
+        while True:
+            items, continuation = await self.query_page(sql, params, page_size, continuation, partition_key)
+            yield items, continuation
+            if not continuation:
+                return
+
+    async def read_change_feed(self, continuation=None, page_size=100, start_time="Beginning"):
+        """Lee una página del change feed: (items, continuation) (ver CosmosDBHelper.read_change_feed)."""
+        feed = self._change_feed_kwargs(continuation, page_size, start_time)
+        async def run(response_hook):
+            pager = self.container.query_items_change_feed(response_hook=response_hook, **feed).by_page()
+            try:
+                items = [item async for item in await pager.__anext__()]
+            except StopAsyncIteration:
+                items = []
+            return items, pager.continuation_token or continuation
+        try:
+            return await self._call("change_feed", run)
+        except CosmosHttpResponseError as e:
+            raise CosmosHttpResponseError(status_code=e.status_code, message=e.message)
+
+    async def _execute_chunk(self, pk, chunk):
+        async def run(response_hook):
+            try:
+                return await self.container.execute_item_batch(response_hook=response_hook,
+                                                               **self._batch_kwargs(pk, chunk))
+            except CosmosBatchOperationError as e:
+                return self._batch_failure(e)
+        try:
+            outcome = await self._call("batch", run)
+        except CosmosHttpResponseError as e:
+            outcome = e
+        return _batch_results(pk, chunk, outcome)
+
+    async def execute_batch(self, operations, partition_key=None):
+        """
+        Ejecuta create/upsert/replace/delete/read/patch como batches transaccionales de
+        Cosmos, con los lotes de distintas particiones en paralelo. Cada lote es
+        atómico; si una operación falla, el resto de su lote vuelve con 424.
+        Retorna un resultado por operación, en el orden de entrada.
+        """
+        plan = plan_batches(operations, self.partition_key, partition_key)
+        try:
+            chunks = await asyncio.gather(*(self._execute_chunk(pk, chunk) for pk, chunk in plan))
+        finally:
+            self._invalidate_batch(plan)
+        return self._batch_done(operations, chunks)
+
+    async def upsert_item(self, item, partition_value):
+        # El SDK async (>= 4.0) toma la partition key del propio documento
+        pk_field = self.partition_key.lstrip('/')
+        if pk_field not in item:
+            item[pk_field] = partition_value
+        try:
+            # Los 429 se reintentan con backoff en acall_with_throttle
+            return await self._call("upsert", self.container.upsert_item, body=item)
+        except CosmosHttpResponseError as e:
+            # Idempotencia para 409 (conflict)
+            if e.status_code == 409:
+                try:
+                    return await self.get_by_id(item.get('id'))
+                except:
+                    raise CosmosHttpResponseError(status_code=e.status_code, message=e.message)
+
+            raise CosmosHttpResponseError(status_code=e.status_code, message=e.message)
+        finally:
+            self._invalidate(item.get("id"), partition_value)
 
 
 # Helpers específicos para citas (contenedor citas_ida)
 def get_citas_container():
-    """Retorna el contenedor de citas con inicialización perezosa"""
+    """Retorna el contenedor de citas (proxy cacheado del cliente compartido)"""
     try:
-        client = CosmosClient(COSMOS_URL, credential=COSMOS_KEY)
-        database = client.get_database_client(DB_NAME)
         container_name = os.environ.get("COSMOS_CONTAINER_CITAS", "cita_id")
-        return database.get_container_client(container_name)
+        return get_container(container_name, os.environ.get("COSMOS_PK_CITAS", "/id"))
     except Exception as e:
         raise Exception(f"Error connecting to citas container: {str(e)}")
 
@@ -142,26 +831,30 @@ def upsert_cita(doc):
     if debug_enabled:
         print(f"[DRY-RUN] Justo antes de upsert - container_target = cita_id")
     
+    def _upsert_con_pk(partition_key, response_hook=None):
+        try:
+            return container.upsert_item(body=doc, partition_key=partition_key, response_hook=response_hook)
+        except TypeError:
+            # SDK antiguo
+            pk_field = pk_path.lstrip('/')
+            doc[pk_field] = partition_key
+            return container.upsert_item(doc)
+    
     try:
+        # Los 429 se reintentan con backoff en tracked_call
         if pk_path == "/id":
             partition_key = doc["id"]
         elif pk_path == "/cita":
             partition_key = doc["cita"]
         else:
             # Sin PK
-            result = container.upsert_item(doc)
+            result = tracked_call(container.id, "upsert", container.upsert_item, doc)
             if debug_enabled:
                 print(f"[DRY-RUN] Upsert OK (sin PK): {result.get('id')}, _etag: {result.get('_etag')}")
             return result
         
         # Con PK
-        try:
-            result = container.upsert_item(body=doc, partition_key=partition_key)
-        except TypeError:
-            # SDK antiguo
-            pk_field = pk_path.lstrip('/')
-            doc[pk_field] = partition_key
-            result = container.upsert_item(doc)
+        result = tracked_call(container.id, "upsert", _upsert_con_pk, partition_key)
         
         if debug_enabled:
             print(f"[DRY-RUN] Upsert OK: status=created, id={result.get('id')}, _etag={result.get('_etag')}")
@@ -177,8 +870,62 @@ def upsert_cita(doc):
     except CosmosHttpResponseError as e:
         if debug_enabled:
             print(f"[DRY-RUN] Error upsert: {e.status_code}")
-        # Retry para 429 (throttling)
-        if e.status_code == 429:
-            time.sleep(0.2)
-            return upsert_cita(doc)  # Retry una vez
-        raise
\ No newline at end of file
+        raise
+
+
+# Versión async de los helpers de citas (usa el cliente aio compartido)
+_async_citas_helper = None
+
+def get_citas_helper_async():
+    """Retorna el AsyncCosmosDBHelper del contenedor de citas (lazy init)."""
+    global _async_citas_helper
+    if _async_citas_helper is None:
+        try:
+            container_name = os.environ.get("COSMOS_CONTAINER_CITAS", "cita_id")
+            _async_citas_helper = AsyncCosmosDBHelper(container_name, get_citas_pk_path())
+        except Exception as e:
+            raise Exception(f"Error connecting to citas container: {str(e)}")
+    return _async_citas_helper
+
+async def upsert_cita_async(doc):
+    """Versión async de upsert_cita (mismo autocompletado de id/cita y timestamps)."""
+    import uuid
+    from datetime import datetime
+
+    citas = get_citas_helper_async()
+    pk_path = get_citas_pk_path()
+    debug_enabled = os.environ.get("DEBUG_CITAS", "false").lower() == "true"
+
+    if pk_path == "/id":
+        if not doc.get("id"):
+            doc["id"] = f"cita:{uuid.uuid4()}"
+    elif pk_path == "/cita":
+        if not doc.get("cita"):
+            doc["cita"] = doc.get("matricula", "")
+
+    if not doc.get("createdAt"):
+        doc["createdAt"] = datetime.utcnow().isoformat() + "Z"
+    doc["updatedAt"] = datetime.utcnow().isoformat() + "Z"
+
+    try:
+        # Los 429 se reintentan con backoff en acall_with_throttle
+        result = await citas._call("upsert", citas.container.upsert_item, body=doc)
+        if debug_enabled:
+            print(f"[DRY-RUN] Upsert async OK: id={result.get('id')}, _etag={result.get('_etag')}")
+        return result
+    except CosmosHttpResponseError as e:
+        if debug_enabled:
+            print(f"[DRY-RUN] Error upsert async: {e.status_code}")
+        raise
+
+async def close_async_clients():
+    """Cierra el cliente aio compartido (llamar en el shutdown de la app)."""
+    global _async_client, _async_database, _async_citas_helper
+    with _registry_lock:
+        client = _async_client
+        _async_client = None
+        _async_database = None
+        _async_containers.clear()
+        _async_citas_helper = None
+    if client is not None:
+        await client.close()
@@ -0,0 +1,238 @@
+# temp_backend/cosmos_throttle.py
+"""
+Capa única de manejo de throttling (429) para todas las llamadas a Cosmos DB.
+
+- Token bucket por contenedor dimensionado a las RU/s aprovisionadas: suaviza
+  las ráfagas del lado del cliente antes de que Cosmos responda 429.
+- Backoff exponencial con jitter que respeta x-ms-retry-after-ms del servidor.
+- Presupuesto configurable de reintentos y de tiempo total de espera.
+
+Configuración (variables de entorno):
+    COSMOS_RU_PER_SECOND        RU/s por contenedor (default 400, igual que ensure_auth_containers)
+    COSMOS_RU_BUDGETS           overrides por contenedor: "carnets_id=1000,notas=400"
+    THROTTLE_BURST_SECONDS      segundos de RU acumulables en el bucket (default 1)
+    THROTTLE_MAX_RETRIES        reintentos máximos ante 429 (default 6)
+    THROTTLE_BASE_DELAY_MS      base del backoff exponencial (default 100)
+    THROTTLE_MAX_DELAY_MS       tope de un solo backoff (default 5000)
+    THROTTLE_MAX_WAIT_MS        tope de espera total por llamada (default 30000)
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Dict, Optional
+
+from azure.cosmos.exceptions import CosmosHttpResponseError
+
+COSMOS_RU_PER_SECOND = float(os.environ.get("COSMOS_RU_PER_SECOND", "400"))
+THROTTLE_BURST_SECONDS = float(os.environ.get("THROTTLE_BURST_SECONDS", "1"))
+THROTTLE_MAX_RETRIES = int(os.environ.get("THROTTLE_MAX_RETRIES", "6"))
+THROTTLE_BASE_DELAY_MS = float(os.environ.get("THROTTLE_BASE_DELAY_MS", "100"))
+THROTTLE_MAX_DELAY_MS = float(os.environ.get("THROTTLE_MAX_DELAY_MS", "5000"))
+THROTTLE_MAX_WAIT_MS = float(os.environ.get("THROTTLE_MAX_WAIT_MS", "30000"))
+
+RETRY_AFTER_HEADER = "x-ms-retry-after-ms"
+
+# Costo estimado (RU) que se reserva del bucket antes de cada operación.
+# Un point read de 1 KB cuesta 1 RU; una escritura de 1 KB ~5-6 RU.
+ESTIMATED_RU = {
+    "read": 1.0,
+    "query": 3.0,
+    "create": 6.0,
+    "upsert": 6.0,
+    "replace": 6.0,
+    "patch": 6.0,
+    "change_feed": 3.0,  # por página del change feed
+    "batch": 30.0,   # por batch transaccional; settle_charge ajusta con el cargo real
+}
+
+
+def _parse_budgets(raw: str) -> Dict[str, float]:
+    budgets = {}
+    for entry in raw.split(","):
+        if "=" in entry:
+            name, ru = entry.split("=", 1)
+            budgets[name.strip()] = float(ru)
+    return budgets
+
+
+COSMOS_RU_BUDGETS = _parse_budgets(os.environ.get("COSMOS_RU_BUDGETS", ""))
+
+
+class RUTokenBucket:
+    """
+    Token bucket en RU. reserve() descuenta el costo aunque el saldo quede
+    negativo y retorna cuánto debe esperar el llamador para que el saldo
+    vuelva a ser >= 0; así las llamadas concurrentes se encolan en orden.
+    """
+
+    def __init__(self, ru_per_second: float, burst_seconds: float = THROTTLE_BURST_SECONDS):
+        self.rate = ru_per_second
+        self.capacity = ru_per_second * burst_seconds
+        self.tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def reserve(self, cost: float) -> float:
+        """Reserva cost RU y retorna los segundos a esperar antes de usarlas."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= cost
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def refund(self, amount: float):
+        """Devuelve RU reservadas que no se consumieron (o descuenta si amount < 0)."""
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+    def penalize(self, retry_after: float):
+        """Tras un 429, vacía el bucket para que el resto de llamadas también esperen retry_after."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, -retry_after * self.rate)
+
+
+_buckets: Dict[str, RUTokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_stats = {
+    "throttled": 0,       # respuestas 429 recibidas
+    "retries": 0,         # reintentos realizados
+    "exhausted": 0,       # llamadas que agotaron el presupuesto de reintentos
+    "shed": 0,            # llamadas rechazadas localmente por exceso de cola en el bucket
+    "wait_ms": 0.0,       # tiempo total esperado en el bucket (suavizado + backoff)
+}
+
+
+def _count(key: str, amount=1):
+    with _stats_lock:
+        _stats[key] += amount
+
+
+def get_throttle_stats() -> dict:
+    """Copia de los contadores de throttling del proceso."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def get_bucket(container_name: str) -> RUTokenBucket:
+    """Retorna el token bucket del contenedor (RU/s de COSMOS_RU_BUDGETS o COSMOS_RU_PER_SECOND)."""
+    bucket = _buckets.get(container_name)
+    if bucket is None:
+        with _buckets_lock:
+            bucket = _buckets.get(container_name)
+            if bucket is None:
+                bucket = RUTokenBucket(COSMOS_RU_BUDGETS.get(container_name, COSMOS_RU_PER_SECOND))
+                _buckets[container_name] = bucket
+    return bucket
+
+
+def retry_after_seconds(error: CosmosHttpResponseError) -> Optional[float]:
+    """Lee x-ms-retry-after-ms de la respuesta 429, si viene."""
+    headers = getattr(error, "headers", None) or {}
+    value = headers.get(RETRY_AFTER_HEADER)
+    try:
+        return float(value) / 1000.0 if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, error: CosmosHttpResponseError) -> float:
+    """
+    Segundos a esperar antes del reintento `attempt` (0-based).
+    Si el servidor indica retry-after se respeta (más un jitter pequeño);
+    si no, backoff exponencial con full jitter.
+    """
+    base = THROTTLE_BASE_DELAY_MS / 1000.0
+    retry_after = retry_after_seconds(error)
+    if retry_after is not None:
+        return retry_after + random.uniform(0, base)
+    ceiling = min(THROTTLE_MAX_DELAY_MS / 1000.0, base * (2 ** attempt))
+    return random.uniform(base / 2, ceiling)
+
+
+def settle_charge(container_name: str, operation: str, actual_ru: float):
+    """Ajusta el bucket con el cargo real reportado por Cosmos (x-ms-request-charge)."""
+    get_bucket(container_name).refund(ESTIMATED_RU.get(operation, 1.0) - actual_ru)
+
+
+def _reserve(bucket: RUTokenBucket, cost: float) -> float:
+    delay = bucket.reserve(cost)
+    if delay * 1000.0 > THROTTLE_MAX_WAIT_MS:
+        # La cola local ya excede el presupuesto de espera: rechazar sin llamar a Cosmos
+        bucket.refund(cost)
+        _count("shed")
+        raise CosmosHttpResponseError(
+            status_code=429,
+            message=f"Presupuesto de RU local excedido (espera estimada {delay:.1f}s)"
+        )
+    if delay > 0:
+        _count("wait_ms", delay * 1000.0)
+    return delay
+
+
+def _on_throttled(bucket: RUTokenBucket, cost: float, attempt: int, started: float,
+                  error: CosmosHttpResponseError):
+    """
+    Registra un 429: devuelve al bucket lo reservado para el intento (un 429
+    no consume RU), relanza el error si se agotó el presupuesto de reintentos
+    y si no, penaliza el bucket con el backoff calculado. La espera en sí la
+    hace el siguiente reserve(), así el reintento y las demás llamadas al
+    mismo contenedor esperan juntos en lugar de seguir golpeando a Cosmos.
+    """
+    _count("throttled")
+    bucket.refund(cost)
+    delay = backoff_delay(attempt, error)
+    elapsed = time.monotonic() - started
+    if attempt >= THROTTLE_MAX_RETRIES or (elapsed + delay) * 1000.0 > THROTTLE_MAX_WAIT_MS:
+        _count("exhausted")
+        raise error
+    bucket.penalize(delay)
+    _count("retries")
+
+
+def call_with_throttle(container_name: str, operation: str, fn, *args, **kwargs):
+    """Ejecuta fn(*args, **kwargs) contra Cosmos aplicando bucket de RU y reintentos ante 429."""
+    bucket = get_bucket(container_name)
+    cost = ESTIMATED_RU.get(operation, 1.0)
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        delay = _reserve(bucket, cost)
+        if delay > 0:
+            time.sleep(delay)
+        try:
+            return fn(*args, **kwargs)
+        except CosmosHttpResponseError as e:
+            if e.status_code != 429:
+                raise
+            _on_throttled(bucket, cost, attempt, started, e)
+            attempt += 1
+
+
+async def acall_with_throttle(container_name: str, operation: str, fn, *args, **kwargs):
+    """Versión async de call_with_throttle: fn debe ser una función async; espera con asyncio.sleep."""
+    bucket = get_bucket(container_name)
+    cost = ESTIMATED_RU.get(operation, 1.0)
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        delay = _reserve(bucket, cost)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        try:
+            return await fn(*args, **kwargs)
+        except CosmosHttpResponseError as e:
+            if e.status_code != 429:
+                raise
+            _on_throttled(bucket, cost, attempt, started, e)
+            attempt += 1
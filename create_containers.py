@@ -10,6 +10,8 @@ from azure.cosmos import CosmosClient, PartitionKey
 # Cargar variables de entorno
 load_dotenv()
 
+from audit_store import AUDIT_INDEXING_POLICY, AUDIT_PARTITION_KEY
+
 def create_auth_containers():
     """Crea los contenedores necesarios para autenticación"""
     
@@ -71,6 +73,26 @@ def create_auth_containers():
                 print(f"❌ Error al crear 'auditoria': {e}")
                 return False
         
+        # Crear contenedor de auditoría particionado por día (el que usa main.py)
+        auditoria_dia = os.getenv("COSMOS_CONTAINER_AUDITORIA_DIA", "auditoria_dia")
+        print(f"\n📦 Creando contenedor '{auditoria_dia}'...")
+        try:
+            database.create_container(
+                id=auditoria_dia,
+                partition_key=PartitionKey(path=AUDIT_PARTITION_KEY),
+                indexing_policy=AUDIT_INDEXING_POLICY,
+                # TTL por documento: la retención marca las entradas ya archivadas
+                default_ttl=-1,
+                offer_throughput=400  # RU/s mínimo
+            )
+            print(f"✅ Contenedor '{auditoria_dia}' creado")
+        except Exception as e:
+            if "Conflict" in str(e):
+                print(f"ℹ️  Contenedor '{auditoria_dia}' ya existe")
+            else:
+                print(f"❌ Error al crear '{auditoria_dia}': {e}")
+                return False
+        
         # Verificar contenedores existentes
         print("\n📋 Verificando todos los contenedores:")
         containers = list(database.list_containers())
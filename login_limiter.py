@@ -0,0 +1,216 @@
+# temp_backend/login_limiter.py
+"""
+Límite de intentos de /auth/login por IP y por usuario, antes de tocar Cosmos
+o bcrypt.
+
+Un token bucket por clave ("ip:<ip>" y "user:<usuario>"): cada intento
+consume un token y se recuperan a razón de N por ventana. Sin tokens el
+login responde 429 con Retry-After, y el intento cuesta solo una búsqueda
+en memoria (sin read_item, bcrypt, upsert ni auditoría). Un login exitoso
+devuelve el bucket del usuario a lleno y el token que tomó de la IP: solo los
+intentos fallidos gastan el bucket de la IP, así un campus entero detrás de
+una misma IP (NAT) puede iniciar sesión al cambio de turno.
+
+Detrás de un proxy (Render) request.client.host es la IP del proxy y todos
+los clientes compartirían un bucket; con LOGIN_LIMIT_TRUST_FORWARDED la IP
+se toma de X-Forwarded-For, contando LOGIN_LIMIT_PROXY_HOPS entradas desde
+la derecha (las que agregan los proxies de confianza; las de la izquierda las
+puede inventar el cliente). main.py registra esa misma IP en la auditoría.
+
+Backends:
+    memory   un diccionario por proceso (default); con N workers de gunicorn
+             el límite efectivo es N veces el configurado
+    sqlite   archivo SQLite compartido por todos los workers del host
+
+Configuración (variables de entorno):
+    LOGIN_LIMIT_ENABLED          aplicar el límite (default true)
+    LOGIN_LIMIT_IP               intentos por ventana por IP: "intentos/segundos" (default 20/60)
+    LOGIN_LIMIT_USER             intentos por ventana por usuario (default 10/300)
+    LOGIN_LIMIT_BACKEND          memory | sqlite (default memory)
+    LOGIN_LIMIT_SQLITE_PATH      archivo del backend sqlite (default ./login_limits.db)
+    LOGIN_LIMIT_MAX_KEYS         claves en memoria antes de descartar las más viejas (default 100000)
+    LOGIN_LIMIT_TRUST_FORWARDED  tomar la IP de X-Forwarded-For (detrás de un proxy) (default false)
+    LOGIN_LIMIT_PROXY_HOPS       proxies de confianza delante de la app (default 1)
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+LOGIN_LIMIT_ENABLED = os.environ.get("LOGIN_LIMIT_ENABLED", "true").lower() == "true"
+LOGIN_LIMIT_IP = os.environ.get("LOGIN_LIMIT_IP", "20/60")
+LOGIN_LIMIT_USER = os.environ.get("LOGIN_LIMIT_USER", "10/300")
+LOGIN_LIMIT_BACKEND = os.environ.get("LOGIN_LIMIT_BACKEND", "memory").lower()
+LOGIN_LIMIT_SQLITE_PATH = os.environ.get("LOGIN_LIMIT_SQLITE_PATH", "login_limits.db")
+LOGIN_LIMIT_MAX_KEYS = int(os.environ.get("LOGIN_LIMIT_MAX_KEYS", "100000"))
+LOGIN_LIMIT_TRUST_FORWARDED = os.environ.get("LOGIN_LIMIT_TRUST_FORWARDED", "false").lower() == "true"
+LOGIN_LIMIT_PROXY_HOPS = int(os.environ.get("LOGIN_LIMIT_PROXY_HOPS", "1"))
+
+
+def parse_rate(spec: str) -> Tuple[float, float]:
+    """"20/60" → (capacidad 20, 20/60 tokens por segundo)."""
+    attempts, _, seconds = spec.partition("/")
+    capacity = float(attempts)
+    return capacity, capacity / float(seconds or "60")
+
+
+def _take(tokens: float, updated: float, now: float, capacity: float, rate: float) -> Tuple[float, float]:
+    """Consume un token; retorna (saldo nuevo, segundos de espera si no alcanzó)."""
+    tokens = min(capacity, tokens + (now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+
+def _refund(tokens: float, updated: float, now: float, capacity: float, rate: float) -> float:
+    """Devuelve un token consumido (sin pasar de la capacidad)."""
+    return min(capacity, tokens + (now - updated) * rate + 1)
+
+
+class MemoryBuckets:
+    """Buckets en un OrderedDict acotado (LRU por último intento)."""
+
+    def __init__(self, max_keys: int = LOGIN_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: float, rate: float) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens, wait = _take(tokens, updated, now, capacity, rate)
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                # Una clave descartada vuelve con el bucket lleno
+                self._buckets.popitem(last=False)
+        return wait
+
+    def refund(self, key: str, capacity: float, rate: float):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                self._buckets[key] = (_refund(*bucket, now, capacity, rate), now)
+
+    def reset(self, key: str):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+
+class SQLiteBuckets:
+    """Buckets en una tabla SQLite compartida entre procesos (una transacción por intento)."""
+
+    def __init__(self, path: str = LOGIN_LIMIT_SQLITE_PATH):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS login_buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: float, rate: float) -> float:
+        # time.time(): el reloj tiene que ser comparable entre procesos
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT tokens, updated FROM login_buckets WHERE key = ?", (key,)).fetchone()
+                tokens, wait = _take(*(row or (capacity, now)), now, capacity, rate)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO login_buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                    (key, tokens, now),
+                )
+                # Limpieza ocasional de buckets que ya se llenaron de nuevo
+                if hash(key) % 100 == 0:
+                    self._conn.execute("DELETE FROM login_buckets WHERE updated < ?", (now - 86400,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return wait
+
+    def refund(self, key: str, capacity: float, rate: float):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT tokens, updated FROM login_buckets WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE login_buckets SET tokens = ?, updated = ? WHERE key = ?",
+                        (_refund(*row, now, capacity, rate), now, key),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def reset(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM login_buckets WHERE key = ?", (key,))
+
+
+class LoginLimiter:
+    """Límite por IP y por usuario; check() retorna los segundos de Retry-After (0 = permitido)."""
+
+    def __init__(self, buckets=None, ip_rate: str = LOGIN_LIMIT_IP, user_rate: str = LOGIN_LIMIT_USER,
+                 enabled: bool = LOGIN_LIMIT_ENABLED):
+        self.buckets = buckets if buckets is not None else default_buckets()
+        self.ip_rate = parse_rate(ip_rate)
+        self.user_rate = parse_rate(user_rate)
+        self.enabled = enabled
+        self._stats = {"allowed": 0, "limited_ip": 0, "limited_user": 0}
+
+    @staticmethod
+    def user_key(username: str) -> str:
+        return f"user:{username.strip().lower()}"
+
+    @staticmethod
+    def ip_key(ip: Optional[str]) -> str:
+        return f"ip:{ip or 'desconocida'}"
+
+    def check(self, ip: Optional[str], username: str) -> float:
+        if not self.enabled:
+            return 0.0
+        wait = self.buckets.take(self.ip_key(ip), *self.ip_rate)
+        if wait:
+            # No se consume el bucket del usuario: una IP abusiva no bloquea a la víctima más rápido
+            self._stats["limited_ip"] += 1
+            return wait
+        wait = self.buckets.take(self.user_key(username), *self.user_rate)
+        if wait:
+            self._stats["limited_user"] += 1
+            return wait
+        self._stats["allowed"] += 1
+        return 0.0
+
+    def succeeded(self, ip: Optional[str], username: str):
+        """Login correcto: el usuario recupera todos sus intentos y la IP el suyo."""
+        if self.enabled:
+            self.buckets.reset(self.user_key(username))
+            self.buckets.refund(self.ip_key(ip), *self.ip_rate)
+
+    def stats(self) -> dict:
+        return dict(self._stats, backend=type(self.buckets).__name__, enabled=self.enabled)
+
+
+def default_buckets():
+    if LOGIN_LIMIT_BACKEND == "sqlite":
+        return SQLiteBuckets()
+    return MemoryBuckets()
+
+
+def client_ip(request) -> Optional[str]:
+    """
+    IP del cliente; con LOGIN_LIMIT_TRUST_FORWARDED, la que agregó el primer proxy
+    de confianza en X-Forwarded-For (LOGIN_LIMIT_PROXY_HOPS desde la derecha).
+    """
+    if LOGIN_LIMIT_TRUST_FORWARDED:
+        forwarded = [a.strip() for a in request.headers.get("x-forwarded-for", "").split(",") if a.strip()]
+        if forwarded:
+            return forwarded[-min(max(1, LOGIN_LIMIT_PROXY_HOPS), len(forwarded))]
+    return request.client.host if request.client else None
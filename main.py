@@ -1,18 +1,40 @@
 # Sistema de Autenticación CRES - v1.1
-from fastapi import FastAPI, HTTPException, Body, Depends, Request
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Body, Depends, Request, Response, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.security import OAuth2PasswordRequestForm
 from pydantic import BaseModel
-from cosmos_helper import CosmosDBHelper
+from cosmos_helper import AsyncCosmosDBHelper, close_async_clients
+from cosmos_throttle import get_throttle_stats
+from password_pool import password_pool
+from login_limiter import LoginLimiter, client_ip
+from ru_metrics import RUContextMiddleware, ru_accumulator
+from bulk_import import NDJSONImportResponse, decompress_stream, iter_lines, run_import
+from starlette.background import BackgroundTask
+from ttl_cache import TTLCache
+from change_feed import CHANGE_FEED_ENABLED, ChangeFeedProcessor, default_lease_store, load_views
+from vaccination_stats import VACUNACION_STATS_FEED, VaccinationStats, VaccinationStatsView
+from audit_logger import AuditLogger
+from audit_store import (
+    AUDIT_INDEXING_POLICY, AUDIT_PARTITION_KEY, audit_day, count_audit, decode_cursor, encode_cursor,
+    parse_range, query_audit_page
+)
+from audit_export import EXPORT_FORMATS, export_audit
+from audit_retention import (
+    AUDIT_RETENTION_ENABLED, ROLLUP_TIPO, AuditArchive, default_archive_store, retention_loop
+)
 from azure.cosmos.exceptions import CosmosHttpResponseError
 import os
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 from typing import Optional
+from contextlib import asynccontextmanager
 import uuid
 import json
+import hashlib
+import asyncio
+import math
 
 # Importar router de actualizaciones
 from update_routes import router as updates_router
@@ -25,12 +47,42 @@ from auth_models import (
 from auth_service import (
     AuthService, get_current_user, require_role, require_permission,
     is_user_locked, should_lock_user, calculate_lockout_time,
-    ACCESS_TOKEN_EXPIRE_MINUTES
+    ACCESS_TOKEN_EXPIRE_MINUTES, jwt_claims_cache
 )
 
 load_dotenv()
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # El contenedor de auditoría (particionado por día, TTL por documento) tiene que
+    # existir antes de que audit_logger escriba; si no, todo va al archivo de respaldo
+    try:
+        await ensure_auth_containers()
+    except Exception as e:
+        print(f"⚠️  No se pudieron verificar los contenedores de autenticación: {e}")
+    # Vistas materializadas alimentadas por el change feed (ver change_feed.py); las
+    # estadísticas de vacunación lo siguen aunque CHANGE_FEED_ENABLED sea false
+    if change_feed.views:
+        change_feed.start()
+    # Sin change feed, las estadísticas de vacunación se cargan con un recorrido al arrancar
+    warmup = None if vacunacion_stats.feed_managed else asyncio.create_task(_warm_vacunacion_stats())
+    audit_logger.start()
+    # Retención de auditoría (resumen diario + archivo + ttl), ver audit_retention.py;
+    # la corre un solo worker, el que tiene el lease "audit_retention"
+    retention = (asyncio.create_task(retention_loop(auditoria, audit_archive, leases=change_feed.leases))
+                 if AUDIT_RETENTION_ENABLED else None)
+    yield
+    if warmup is not None and not warmup.done():
+        warmup.cancel()
+    if retention is not None:
+        retention.cancel()
+    await change_feed.stop()
+    # Escribir (o respaldar en archivo) la auditoría pendiente antes de cerrar el cliente
+    await audit_logger.stop()
+    # Cerrar la sesión HTTP del cliente async compartido de Cosmos
+    await close_async_clients()
+
+app = FastAPI(lifespan=lifespan)
 
 # Startup configuration check (only for DEBUG_CITAS)
 if os.environ.get("DEBUG_CITAS", "false").lower() == "true":
@@ -52,25 +104,36 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Continuation-Token", "ETag", "Retry-After"],
 )
 
+# Etiquetar el consumo de RU de Cosmos con la ruta que lo originó
+app.add_middleware(RUContextMiddleware)
+
 # Montar router de actualizaciones
 app.include_router(updates_router)
 
-carnets = CosmosDBHelper(
-    os.environ["COSMOS_CONTAINER_CARNETS"], "/id"
+# Caché de point reads (carnets reabiertos en clínica). No se usa para usuarios:
+# login y lockout necesitan activo, bloqueado_hasta y password_hash al día.
+# Las entradas vencidas se revalidan con el _etag; POINT_CACHE_SIZE=0 lo deshabilita.
+POINT_CACHE_SIZE = int(os.environ.get("POINT_CACHE_SIZE", "1024"))
+POINT_CACHE_TTL_SECONDS = float(os.environ.get("POINT_CACHE_TTL_SECONDS", "30"))
+
+carnets = AsyncCosmosDBHelper(
+    os.environ["COSMOS_CONTAINER_CARNETS"], "/id",
+    cache=TTLCache(POINT_CACHE_SIZE, POINT_CACHE_TTL_SECONDS)
 )
-notas = CosmosDBHelper(
+notas = AsyncCosmosDBHelper(
     os.environ["COSMOS_CONTAINER_NOTAS"], "/matricula"
 )
-promociones_salud = CosmosDBHelper(
+promociones_salud = AsyncCosmosDBHelper(
     os.environ.get("COSMOS_CONTAINER_PROMOCIONES_SALUD", "promociones_salud"), "/id"
 )
 
 # Helper para tarjeta de vacunación individual (aplicaciones por estudiante)
 # Contenedor: Tarjeta_vacunacion, Partition Key: /matricula
 # Solo se guardan aplicaciones individuales, NO campañas (campañas son solo locales)
-tarjeta_vacunacion = CosmosDBHelper(
+tarjeta_vacunacion = AsyncCosmosDBHelper(
     os.environ.get("COSMOS_CONTAINER_VACUNACION", "Tarjeta_vacunacion"), "/matricula"
 )
 
@@ -78,7 +141,144 @@ tarjeta_vacunacion = CosmosDBHelper(
 # Se manejan localmente en el frontend y solo se genera PDF
 
 # Handlers directos para citas (contenedor citas_ida exclusivamente)
-from cosmos_helper import get_citas_container, get_citas_pk_path, upsert_cita
+from cosmos_helper import get_citas_helper_async, get_citas_pk_path, upsert_cita_async
+
+# Change feed de los contenedores clínicos; las vistas se registran con
+# change_feed.register(...) o con CHANGE_FEED_VIEWS="modulo:Clase,..."
+change_feed = ChangeFeedProcessor(leases=default_lease_store())
+change_feed.add_source("carnets", carnets)
+change_feed.add_source("notas", notas)
+change_feed.add_source("citas", get_citas_helper_async)
+change_feed.add_source("vacunacion", tarjeta_vacunacion)
+if CHANGE_FEED_ENABLED:
+    for _view in load_views(os.environ.get("CHANGE_FEED_VIEWS", "")):
+        change_feed.register(_view)
+
+# Estadísticas de vacunación incrementales (ver vaccination_stats.py). Con el
+# change feed las calcula el worker dueño del lease y los demás cargan su estado.
+vacunacion_stats = VaccinationStats()
+if CHANGE_FEED_ENABLED or VACUNACION_STATS_FEED:
+    change_feed.register(VaccinationStatsView(vacunacion_stats))
+
+async def _warm_vacunacion_stats():
+    try:
+        await vacunacion_stats.ensure_loaded(tarjeta_vacunacion)
+    except Exception as e:
+        # Se reintenta en el primer GET /vacunacion/estadisticas
+        print(f"⚠️  Estadísticas de vacunación no precargadas: {e}")
+
+# Paginación de listados por continuation token de Cosmos
+CONTINUATION_HEADER = "X-Continuation-Token"
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+async def query_list(helper, sql, params, response: Response, page_size=None, continuation=None):
+    """
+    Ejecuta una query de listado. Sin page_size ni continuation retorna todo el
+    resultado (compatibilidad con el cliente Flutter); con ellos retorna una sola
+    página y deja el token de la siguiente en el header X-Continuation-Token.
+    """
+    if page_size is None and continuation is None:
+        return await helper.query_items(sql, params)
+    items, next_token = await helper.query_page(
+        sql, params, page_size=page_size or DEFAULT_PAGE_SIZE, continuation=continuation
+    )
+    if next_token:
+        response.headers[CONTINUATION_HEADER] = next_token
+    return items
+
+# Proyección: ?fields=a,b,c → SELECT c.id, c._etag, c.a, c.b, c.c
+def parse_fields(fields: Optional[str], model, always=("id", "_etag")):
+    """
+    Valida fields contra los campos del modelo Pydantic y retorna la lista a
+    proyectar (None = documento completo). `always` se agrega siempre: id
+    identifica el registro y _etag mantiene los GET condicionales.
+    """
+    if fields is None:
+        return None
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in model.model_fields]
+    if unknown or not requested:
+        raise HTTPException(status_code=400, detail={
+            "code": 400,
+            "message": f"Campos desconocidos en fields: {', '.join(unknown)}" if unknown else "fields vacío",
+            "permitidos": list(model.model_fields),
+        })
+    return list(dict.fromkeys([*always, *requested]))
+
+def select_clause(fields, alias="c", top=None):
+    """SELECT [TOP n] con la proyección de parse_fields (o * sin fields)."""
+    head = f"SELECT TOP {int(top)}" if top else "SELECT"
+    if not fields:
+        return f"{head} *"
+    return f"{head} " + ", ".join(f"{alias}.{f}" for f in fields)
+
+def project(doc, fields):
+    """Aplica la proyección a un documento ya leído (point reads)."""
+    if not fields:
+        return doc
+    return {f: doc[f] for f in fields if f in doc}
+
+# GET condicionales: ETag fuerte + If-None-Match → 304 sin cuerpo
+def _fields_etag(etag, fields):
+    # Cada proyección es otra representación: su ETag también debe ser otro.
+    # Solo sirve para If-None-Match; If-Match de un PUT compara contra el _etag
+    # del documento (que toda proyección incluye en el cuerpo), así que el ETag
+    # de una proyección enviado como If-Match siempre da 412.
+    if not etag or not fields:
+        return etag
+    digest = hashlib.sha256(f"{etag}\x1d{','.join(fields)}".encode("utf-8"))
+    return f'"{digest.hexdigest()[:32]}"'
+
+def document_etag(doc, fields=None):
+    """ETag de un documento: su _etag de Cosmos (ya viene entre comillas)."""
+    etag = doc.get("_etag") if isinstance(doc, dict) else None
+    if not etag:
+        return None
+    return _fields_etag(etag if etag.startswith('"') else f'"{etag}"', fields)
+
+def list_etag(docs, continuation=None, fields=None):
+    """ETag de un listado: hash de los (id, _etag) de sus miembros en orden (y del token de página)."""
+    digest = hashlib.sha256()
+    for doc in docs:
+        digest.update(f"{doc.get('id')}\x1f{doc.get('_etag')}\x1e".encode("utf-8"))
+    if continuation:
+        digest.update(continuation.encode("utf-8"))
+    if fields:
+        digest.update(",".join(fields).encode("utf-8"))
+    return f'"{digest.hexdigest()[:32]}"'
+
+def etag_matches(request: Request, etag):
+    """If-None-Match usa comparación débil: se ignora el prefijo W/."""
+    header = request.headers.get("if-none-match")
+    if not header or not etag:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag in candidates
+
+def conditional_response(request: Request, response: Response, etag, content):
+    """Retorna 304 si el cliente ya tiene esta versión; si no, el contenido con su ETag."""
+    if not etag:
+        return content
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return content
+
+def ndjson_import_response(request: Request, model, write, on_finish):
+    """
+    Respuesta en streaming de una importación NDJSON (ver bulk_import.py).
+    on_finish(summary) corre al terminar de enviar el reporte (auditoría).
+    """
+    summary = {}
+    lines = iter_lines(decompress_stream(request.stream(), request.headers.get("content-encoding")))
+    return NDJSONImportResponse(
+        run_import(lines, model, write, summary=summary),
+        background=BackgroundTask(on_finish, summary)
+    )
 
 # Modelo para las notas (campos opcionales con alias)
 class NotaModel(BaseModel):
@@ -175,20 +375,22 @@ class VaccinationRecordModel(BaseModel):
         populate_by_name = True
 
 @app.get("/carnet/{id}")
-def get_carnet(id: str):
+async def get_carnet(id: str, request: Request, response: Response, fields: Optional[str] = None):
+    cols = parse_fields(fields, CarnetModel)
     # Normalizar id: si no empieza con carnet:, agregar prefijo
     normalized_id = id if id.startswith("carnet:") else f"carnet:{id}"
     
-    # Intento A: lectura directa por id normalizado
+    # Intento A: lectura directa por id normalizado (el point read trae el documento
+    # completo y pasa por el caché; la proyección se aplica aquí)
     try:
-        data = carnets.get_by_id(normalized_id)
-        return data
+        data = await carnets.get_by_id(normalized_id)
+        return conditional_response(request, response, document_etag(data, cols), project(data, cols))
     except CosmosHttpResponseError as e:
         # Intento B: Si NotFound → query por matricula excluyendo citas
         if e.status_code == 404:
             try:
-                results = carnets.query_items(
-                    """SELECT TOP 1 * FROM c 
+                results = await carnets.query_items(
+                    f"""{select_clause(cols, top=1)} FROM c 
                        WHERE c.matricula = @m 
                          AND NOT STARTSWITH(c.id, 'cita:')
                          AND NOT IS_DEFINED(c.inicio)
@@ -198,7 +400,7 @@ def get_carnet(id: str):
                 )
                 
                 if results:
-                    return results[0]
+                    return conditional_response(request, response, document_etag(results[0], cols), results[0])
                 else:
                     raise HTTPException(status_code=404, detail={"code": 404, "message": "Carnet no encontrado"})
                     
@@ -210,13 +412,24 @@ def get_carnet(id: str):
         raise HTTPException(status_code=500, detail={"code": 500, "message": str(e)})
 
 @app.get("/notas/{matricula}")
-def get_notas(matricula: str):
+async def get_notas(
+    matricula: str,
+    request: Request,
+    response: Response,
+    page_size: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    continuation: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    cols = parse_fields(fields, NotaModel)
     try:
-        result = notas.query_items(
-            "SELECT * FROM c WHERE c.matricula=@m ORDER BY c.createdAt DESC",
-            params=[{"name": "@m", "value": matricula}]
+        result = await query_list(
+            notas,
+            f"{select_clause(cols)} FROM c WHERE c.matricula=@m ORDER BY c.createdAt DESC",
+            [{"name": "@m", "value": matricula}],
+            response, page_size, continuation
         )
-        return result
+        etag = list_etag(result, response.headers.get(CONTINUATION_HEADER), cols)
+        return conditional_response(request, response, etag, result)
     except CosmosHttpResponseError as e:
         raise HTTPException(status_code=e.status_code, detail={"code": e.status_code, "message": e.message})
     except Exception as e:
@@ -224,7 +437,7 @@ def get_notas(matricula: str):
 
 @app.post("/notas/")
 @app.post("/notas")  # Alias sin slash final
-def create_nota(nota: NotaModel = Body(...)):
+async def create_nota(nota: NotaModel = Body(...)):
     try:
         # Auto-generar campos si no se proporcionan
         nota_dict = nota.dict()
@@ -234,7 +447,7 @@ def create_nota(nota: NotaModel = Body(...)):
             nota_dict["createdAt"] = datetime.utcnow().isoformat() + "Z"
         
         # Cosmos: PK = /matricula
-        res = notas.upsert_item(nota_dict, partition_value=nota.matricula)
+        res = await notas.upsert_item(nota_dict, partition_value=nota.matricula)
         
         return {"status": "created", "data": res, "id": nota_dict["id"]}
     except CosmosHttpResponseError as e:
@@ -242,6 +455,77 @@ def create_nota(nota: NotaModel = Body(...)):
     except Exception as e:
         raise HTTPException(status_code=500, detail={"code": 500, "message": str(e)})
 
+@app.post("/notas/batch")
+async def create_notas_batch(lista: list[NotaModel] = Body(...)):
+    """
+    Guarda varias notas en un solo request. Las notas se agrupan por matrícula
+    (PK = /matricula) y cada grupo va en un batch transaccional de Cosmos.
+    Retorna el resultado de cada nota en el mismo orden del request.
+    """
+    try:
+        operaciones = []
+        for nota in lista:
+            nota_dict = nota.dict()
+            if not nota_dict.get("id"):
+                nota_dict["id"] = f"nota:{uuid.uuid4()}"
+            if not nota_dict.get("createdAt"):
+                nota_dict["createdAt"] = datetime.utcnow().isoformat() + "Z"
+            operaciones.append(("upsert", (nota_dict,)))
+
+        resultados = await notas.execute_batch(operaciones)
+
+        items = [
+            {
+                "id": op[1][0]["id"],
+                "matricula": r["partition_key"],
+                "status": r["status_code"],
+                "error": r.get("error"),
+            }
+            for op, r in zip(operaciones, resultados)
+        ]
+        fallidas = sum(1 for i in items if i["status"] >= 400)
+        return {
+            "status": "created" if fallidas == 0 else "partial",
+            "total": len(items),
+            "fallidas": fallidas,
+            "items": items,
+        }
+    except CosmosHttpResponseError as e:
+        raise HTTPException(status_code=e.status_code, detail={"code": e.status_code, "message": e.message})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail={"code": 500, "message": str(e)})
+
+async def _import_nota(nota: NotaModel):
+    nota_dict = nota.dict()
+    if not nota_dict.get("id"):
+        nota_dict["id"] = f"nota:{uuid.uuid4()}"
+    if not nota_dict.get("createdAt"):
+        nota_dict["createdAt"] = datetime.utcnow().isoformat() + "Z"
+    # Cosmos: PK = /matricula
+    await notas.upsert_item(nota_dict, partition_value=nota.matricula)
+    return {"id": nota_dict["id"], "matricula": nota.matricula}
+
+@app.post("/notas/import")
+async def import_notas(
+    request: Request,
+    current_user = Depends(require_permission("notas:create"))
+):
+    """
+    Importación masiva de notas históricas en NDJSON (un NotaModel por línea),
+    con Content-Encoding: gzip opcional. Reporte NDJSON por línea y resumen final.
+    """
+    async def on_finish(summary):
+        await log_audit(
+            current_user.username,
+            AuditAction.CREATE_NOTA,
+            campus=current_user.campus.value,
+            recurso="import",
+            detalles=f"Importación masiva de notas: {summary}",
+            ip=client_ip(request)
+        )
+
+    return ndjson_import_response(request, NotaModel, _import_nota, on_finish)
+
 # Endpoint para crear carnets (con rutas alternativas) - TODOS LOS USUARIOS AUTENTICADOS
 @app.post("/carnet/")
 @app.post("/carnet")  # Alias sin slash final
@@ -266,12 +550,13 @@ async def create_carnet(
         carnet_dict["id"] = f"carnet:{uuid.uuid4()}"
         
         # Cosmos: PK = /id
-        res = carnets.upsert_item(carnet_dict, partition_value=carnet_dict["id"])
+        res = await carnets.upsert_item(carnet_dict, partition_value=carnet_dict["id"])
         
         # Auditoría
-        log_audit(
+        await log_audit(
             current_user.username if hasattr(current_user, 'username') else "unknown",
             AuditAction.CREATE_CARNET,
+            campus=current_user.campus.value if hasattr(current_user, 'campus') else None,
             recurso=carnet_dict["id"],
             detalles=f"Carnet creado para matrícula: {carnet.matricula}"
         )
@@ -282,55 +567,98 @@ async def create_carnet(
     except Exception as e:
         raise HTTPException(status_code=500, detail={"code": 500, "message": str(e)})
 
+async def _import_carnet(carnet: CarnetModel):
+    carnet_dict = carnet.dict()
+    # En la importación el id es opcional: si viene se respeta (reimportar es idempotente)
+    if not carnet_dict.get("id"):
+        carnet_dict["id"] = f"carnet:{uuid.uuid4()}"
+    await carnets.upsert_item(carnet_dict, partition_value=carnet_dict["id"])
+    return {"id": carnet_dict["id"], "matricula": carnet.matricula}
+
+@app.post("/carnet/import")
+async def import_carnets(
+    request: Request,
+    current_user = Depends(require_permission("carnets:create"))
+):
+    """
+    Importación masiva de carnets en NDJSON (un CarnetModel por línea), con
+    Content-Encoding: gzip opcional. Retorna un reporte NDJSON por línea
+    ({"line", "status", "id" | "error"}) y un resumen final.
+    """
+    async def on_finish(summary):
+        await log_audit(
+            current_user.username,
+            AuditAction.CREATE_CARNET,
+            campus=current_user.campus.value,
+            recurso="import",
+            detalles=f"Importación masiva de carnets: {summary}",
+            ip=client_ip(request)
+        )
+
+    return ndjson_import_response(request, CarnetModel, _import_carnet, on_finish)
+
 # Endpoint para editar carnets existentes - TODOS LOS USUARIOS AUTENTICADOS
 @app.put("/carnet/{carnet_id}")
 async def update_carnet(
     carnet_id: str,
+    request: Request,
+    response: Response,
     carnet: CarnetModel = Body(...),
     current_user: dict = Depends(get_current_user)
 ):
     """
     Editar carnet de salud existente.
     PERMITIDO: Todos los usuarios autenticados pueden editar carnets.
+    Con el header If-Match (ETag de GET /carnet/{id}) la edición solo se aplica
+    si nadie más modificó el carnet; si no, responde 412. Debe ser el ETag del
+    documento completo: tras un GET con fields se usa el campo _etag del cuerpo,
+    no el header ETag de la proyección (ese siempre responde 412).
     """
     try:
-        # Verificar que el carnet existe
-        try:
-            existing = carnets.read_item(carnet_id, carnet_id)
-        except:
-            raise HTTPException(status_code=404, detail="Carnet no encontrado")
-        
         # Preparar datos actualizados manteniendo el ID original
         carnet_dict = carnet.dict()
         carnet_dict["id"] = carnet_id  # Forzar ID original
         
-        # Actualizar en Cosmos
-        res = carnets.upsert_item(carnet_dict, partition_value=carnet_id)
+        # Replace condicional en un solo round trip: 404 si no existe, 412 si cambió
+        if_match = (request.headers.get("if-match") or "").strip()
+        res = await carnets.replace_item(
+            carnet_id, carnet_dict, etag=if_match if if_match and if_match != "*" else None
+        )
+        if document_etag(res):
+            response.headers["ETag"] = document_etag(res)
         
         # Auditoría
-        log_audit(
+        await log_audit(
             current_user.username if hasattr(current_user, 'username') else "unknown",
             AuditAction.UPDATE_CARNET,
+            campus=current_user.campus.value if hasattr(current_user, 'campus') else None,
             recurso=carnet_id,
             detalles=f"Carnet editado para matrícula: {carnet.matricula}"
         )
         
         return {"status": "updated", "data": res, "id": carnet_id}
     except CosmosHttpResponseError as e:
+        if e.status_code == 404:
+            raise HTTPException(status_code=404, detail="Carnet no encontrado")
+        if e.status_code == 412:
+            raise HTTPException(
+                status_code=412,
+                detail={"code": 412, "message": "El carnet fue modificado por otro usuario; vuelva a cargarlo antes de guardar"}
+            )
         raise HTTPException(status_code=e.status_code, detail={"code": e.status_code, "message": e.message})
     except Exception as e:
         raise HTTPException(status_code=500, detail={"code": 500, "message": str(e)})
 
 # Alias de expediente para compatibilidad con Flutter
 @app.get("/expediente/matricula/{matricula}")
-def get_expediente_by_matricula(matricula: str):
+async def get_expediente_by_matricula(matricula: str, request: Request, response: Response):
     """Alias para búsqueda de carnet por matrícula"""
-    return get_carnet(matricula)
+    return await get_carnet(matricula, request, response)
 
 @app.get("/expediente/{id}")
-def get_expediente_by_id(id: str):
+async def get_expediente_by_id(id: str, request: Request, response: Response):
     """Alias para búsqueda de carnet por ID"""
-    return get_carnet(id)
+    return await get_carnet(id, request, response)
 
 # Endpoint adicional para compatibilidad con Flutter (rutas originales)
 @app.options("/notas")
@@ -342,10 +670,10 @@ def handle_options():
 
 # Health check para verificar conectividad
 @app.get("/health")
-def health_check():
+async def health_check():
     try:
         # Test básico de conectividad a Cosmos
-        test_query = notas.query_items("SELECT TOP 1 * FROM c")
+        test_query = await notas.query_items("SELECT TOP 1 * FROM c")
         return {
             "status": "healthy",
             "cosmos_connected": True,
@@ -363,14 +691,14 @@ def health_check():
 
 
 @app.get("/_diag/citas")
-def diagnose_citas():
+async def diagnose_citas():
     """Endpoint de diagnóstico para verificar configuración de citas (solo con DEBUG_CITAS)"""
     # Solo permitir acceso si DEBUG_CITAS está activado
     if os.environ.get("DEBUG_CITAS", "false").lower() != "true":
         raise HTTPException(status_code=404, detail={"code": 404, "message": "Endpoint no encontrado"})
     
     try:
-        from cosmos_helper import get_citas_container, get_citas_pk_path
+        from cosmos_helper import get_citas_helper_async, get_citas_pk_path
         
         # Obtener configuración
         db_name = os.environ.get("COSMOS_DB", "NOT_SET")
@@ -380,9 +708,9 @@ def diagnose_citas():
         # Probar conectividad
         can_read = False
         try:
-            container = get_citas_container()
+            citas = get_citas_helper_async()
             # Test con query simple
-            list(container.query_items("SELECT TOP 1 * FROM c", enable_cross_partition_query=True))
+            await citas.query_items("SELECT TOP 1 * FROM c")
             can_read = True
         except Exception as e:
             if os.environ.get("DEBUG_CITAS", "false").lower() == "true":
@@ -418,10 +746,10 @@ class CitaModel(BaseModel):
     updatedAt: Optional[str] = None
 
 @app.post("/citas")
-def create_cita(cita: CitaModel):
+async def create_cita(cita: CitaModel):
     try:
         # Lazy init: obtener contenedor dentro del handler
-        container = get_citas_container()
+        get_citas_helper_async()
         
         cita_dict = cita.dict()
         
@@ -431,7 +759,7 @@ def create_cita(cita: CitaModel):
             raise HTTPException(status_code=400, detail="Campos requeridos: matricula, inicio, fin, motivo")
         
         # Usar helper exclusivo para citas
-        result = upsert_cita(cita_dict)
+        result = await upsert_cita_async(cita_dict)
         
         return {"status": "created", "data": result}
         
@@ -446,24 +774,20 @@ def create_cita(cita: CitaModel):
         raise HTTPException(status_code=500, detail={"code": 500, "message": str(cosmos_error)})
 
 @app.get("/citas/{cita_id}")
-def get_cita_by_id(cita_id: str):
+async def get_cita_by_id(cita_id: str):
     try:
         # Lazy init: obtener contenedor dentro del handler
-        container = get_citas_container()
+        citas = get_citas_helper_async()
         pk_path = get_citas_pk_path()
         
         if pk_path == "/id":
             # Leer directo por partition key
-            result = container.read_item(item=cita_id, partition_key=cita_id)
+            result = await citas.read_item(cita_id, cita_id)
         else:
             # Query cross-partition
             query = "SELECT * FROM c WHERE c.id = @id"
             params = [{"name": "@id", "value": cita_id}]
-            results = list(container.query_items(
-                query=query, 
-                parameters=params, 
-                enable_cross_partition_query=True
-            ))
+            results = await citas.query_items(query, params)
             if not results:
                 raise HTTPException(status_code=404, detail={"code": 404, "message": "Cita no encontrada"})
             result = results[0]
@@ -483,20 +807,23 @@ def get_cita_by_id(cita_id: str):
         raise HTTPException(status_code=500, detail={"code": 500, "message": str(cosmos_error)})
 
 @app.get("/citas/por-matricula/{matricula}")
-def get_citas_by_matricula(matricula: str):
+async def get_citas_by_matricula(
+    matricula: str,
+    response: Response,
+    page_size: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    continuation: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    cols = parse_fields(fields, CitaModel, always=("id",))
     try:
         # Lazy init: obtener contenedor dentro del handler
-        container = get_citas_container()
+        citas = get_citas_helper_async()
         
         # Query siempre en cita_id
-        query = "SELECT * FROM c WHERE c.matricula = @m ORDER BY c._ts DESC"
+        query = f"{select_clause(cols)} FROM c WHERE c.matricula = @m ORDER BY c._ts DESC"
         params = [{"name": "@m", "value": matricula}]
         
-        results = list(container.query_items(
-            query=query,
-            parameters=params,
-            enable_cross_partition_query=True
-        ))
+        results = await query_list(citas, query, params, response, page_size, continuation)
         
         return results
         
@@ -513,7 +840,7 @@ def get_citas_by_matricula(matricula: str):
 # Endpoints para promociones de salud
 @app.post("/promociones-salud/")
 @app.post("/promociones-salud")
-def create_promocion_salud(promocion: PromocionSaludModel = Body(...)):
+async def create_promocion_salud(promocion: PromocionSaludModel = Body(...)):
     """Crear una nueva promoción de salud"""
     try:
         # Auto-generar campos si no se proporcionan
@@ -524,7 +851,7 @@ def create_promocion_salud(promocion: PromocionSaludModel = Body(...)):
             promocion_dict["createdAt"] = datetime.utcnow().isoformat() + "Z"
         
         # Cosmos: PK = /id
-        res = promociones_salud.upsert_item(promocion_dict, partition_value=promocion_dict["id"])
+        res = await promociones_salud.upsert_item(promocion_dict, partition_value=promocion_dict["id"])
         return res
     except CosmosHttpResponseError as e:
         raise HTTPException(status_code=e.status_code or 500, detail={"code": e.status_code or 500, "message": e.message or "Error en cosmos"})
@@ -532,11 +859,19 @@ def create_promocion_salud(promocion: PromocionSaludModel = Body(...)):
         raise HTTPException(status_code=500, detail={"code": 500, "message": str(e)})
 
 @app.get("/promociones-salud/")
-def get_promociones_salud():
-    """Obtener todas las promociones de salud"""
+async def get_promociones_salud(
+    response: Response,
+    page_size: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    continuation: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    """Obtener todas las promociones de salud (paginable con page_size/continuation; proyectable con fields)"""
+    cols = parse_fields(fields, PromocionSaludModel, always=("id",))
     try:
-        result = promociones_salud.query_items(
-            "SELECT * FROM c ORDER BY c.createdAt DESC"
+        result = await query_list(
+            promociones_salud,
+            f"{select_clause(cols)} FROM c ORDER BY c.createdAt DESC",
+            None, response, page_size, continuation
         )
         return result
     except CosmosHttpResponseError as e:
@@ -600,56 +935,93 @@ def validate_supervisor_key(key_data: dict = Body(...)):
 # ============================================================================
 
 # Helper para contenedor de usuarios
-usuarios = CosmosDBHelper(
+# Sin caché de point reads: login, lockout y cambios de contraseña leen siempre
+# de Cosmos (un usuario desactivado o bloqueado en otro worker no puede entrar).
+# /auth/me se cachea aparte en user_profiles.
+usuarios = AsyncCosmosDBHelper(
     os.environ.get("COSMOS_CONTAINER_USUARIOS", "usuarios"), "/id"
 )
 
-# Helper para auditoría
-auditoria = CosmosDBHelper(
-    os.environ.get("COSMOS_CONTAINER_AUDITORIA", "auditoria"), "/id"
-)
-
-def log_audit(usuario: str, accion: AuditAction, recurso: Optional[str] = None, detalles: Optional[str] = None, ip: Optional[str] = None):
-    """Registra una acción en el log de auditoría."""
+# Perfiles ya validados (UserResponse, sin password_hash) para /auth/me: sin
+# round trip a Cosmos ni reconstrucción del modelo. Login, lockout y
+# update_user los actualizan o invalidan en este worker; en los demás vencen
+# a los PROFILE_CACHE_TTL_SECONDS.
+PROFILE_CACHE_TTL_SECONDS = float(os.environ.get("PROFILE_CACHE_TTL_SECONDS", "15"))
+user_profiles = TTLCache(POINT_CACHE_SIZE, PROFILE_CACHE_TTL_SECONDS)
+
+def cache_user_profile(user_dict: dict) -> UserResponse:
+    """Construye el perfil público de un documento de usuario y lo deja en caché."""
+    profile = UserResponse(**{k: v for k, v in user_dict.items() if k != "password_hash"})
+    user_profiles.set(profile.id, profile)
+    return profile
+
+async def get_user_profile(user_id: str) -> UserResponse:
+    """Perfil del usuario desde el caché o, si venció, desde Cosmos."""
+    profile = user_profiles.get(user_id)
+    if profile is None:
+        profile = cache_user_profile(await usuarios.read_item(user_id, user_id))
+    return profile
+
+# Helper para auditoría: particionada por día (ver audit_store.py)
+AUDITORIA_CONTAINER = os.environ.get("COSMOS_CONTAINER_AUDITORIA_DIA", "auditoria_dia")
+auditoria = AsyncCosmosDBHelper(AUDITORIA_CONTAINER, AUDIT_PARTITION_KEY)
+
+# Límite de intentos de login por IP y usuario (ver login_limiter.py)
+login_limiter = LoginLimiter()
+
+# Escritura write-behind por lotes (ver audit_logger.py)
+audit_logger = AuditLogger(auditoria)
+
+# Días ya retirados de Cosmos: las lecturas los toman del archivo (ver audit_retention.py)
+audit_archive = AuditArchive(default_archive_store())
+
+async def log_audit(usuario: str, accion: AuditAction, recurso: Optional[str] = None, detalles: Optional[str] = None, ip: Optional[str] = None, campus: Optional[str] = None):
+    """Registra una acción en el log de auditoría (se encola; no espera a Cosmos)."""
     try:
-        audit_id = f"audit:{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        now = datetime.utcnow()
+        audit_id = f"audit:{now.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        timestamp = now.isoformat()
         log_entry = {
             "id": audit_id,
+            "dia": audit_day(timestamp),
             "usuario": usuario,
+            "campus": campus,
             "accion": accion.value,
             "recurso": recurso,
             "detalles": detalles,
-            "timestamp": datetime.utcnow().isoformat(),
+            "timestamp": timestamp,
             "ip": ip
         }
-        auditoria.create_item(log_entry)
+        audit_logger.log(log_entry)
         print(f"📝 Auditoría: {usuario} → {accion.value}")
     except Exception as e:
         print(f"⚠️ Error al registrar auditoría: {e}")
 
-def ensure_auth_containers():
+async def ensure_auth_containers():
     """
     Verifica y crea los contenedores de autenticación si no existen.
     Esto permite el bootstrap automático del sistema.
     """
-    from azure.cosmos import CosmosClient, PartitionKey
+    from azure.cosmos import PartitionKey
+    from cosmos_helper import get_async_database
+    from storage_backends import is_local_backend
+    
+    # Los backends locales crean sus contenedores bajo demanda
+    if is_local_backend():
+        return
     
     try:
-        cosmos_url = os.environ["COSMOS_URL"]
-        cosmos_key = os.environ["COSMOS_KEY"]
-        db_name = os.environ["COSMOS_DB"]
-        
-        client = CosmosClient(cosmos_url, credential=cosmos_key)
-        database = client.get_database_client(db_name)
+        # Reutilizar el cliente compartido del proceso
+        database = get_async_database()
         
         # Obtener lista de contenedores existentes
-        existing_containers = {c['id'] for c in database.list_containers()}
+        existing_containers = {c['id'] async for c in database.list_containers()}
         print(f"📦 Contenedores existentes: {existing_containers}")
         
         # Crear contenedor 'usuarios' si no existe
         if "usuarios" not in existing_containers:
             try:
-                database.create_container(
+                await database.create_container(
                     id="usuarios",
                     partition_key=PartitionKey(path="/id"),
                     offer_throughput=400
@@ -665,25 +1037,28 @@ def ensure_auth_containers():
         else:
             print("ℹ️  Contenedor 'usuarios' ya existe")
         
-        # Crear contenedor 'auditoria' si no existe
-        if "auditoria" not in existing_containers:
+        # Crear contenedor de auditoría (particionado por día) si no existe
+        if AUDITORIA_CONTAINER not in existing_containers:
             try:
-                database.create_container(
-                    id="auditoria",
-                    partition_key=PartitionKey(path="/id"),
+                await database.create_container(
+                    id=AUDITORIA_CONTAINER,
+                    partition_key=PartitionKey(path=AUDIT_PARTITION_KEY),
+                    indexing_policy=AUDIT_INDEXING_POLICY,
+                    # TTL por documento: la retención marca las entradas ya archivadas
+                    default_ttl=-1,
                     offer_throughput=400
                 )
-                print("✅ Contenedor 'auditoria' creado")
+                print(f"✅ Contenedor '{AUDITORIA_CONTAINER}' creado")
             except Exception as e:
                 error_msg = str(e)
                 if "Conflict" in error_msg or "409" in error_msg:
-                    print("ℹ️  Contenedor 'auditoria' ya existe (conflict)")
+                    print(f"ℹ️  Contenedor '{AUDITORIA_CONTAINER}' ya existe (conflict)")
                 else:
-                    print(f"⚠️ Error creando 'auditoria': {error_msg}")
+                    print(f"⚠️ Error creando '{AUDITORIA_CONTAINER}': {error_msg}")
                     raise
         else:
-            print("ℹ️  Contenedor 'auditoria' ya existe")
-            
+            print(f"ℹ️  Contenedor '{AUDITORIA_CONTAINER}' ya existe")
+        
     except Exception as e:
         print(f"❌ Error en ensure_auth_containers: {e}")
         import traceback
@@ -702,11 +1077,11 @@ async def initialize_first_admin(user: UserCreate):
     """
     try:
         # Asegurar que existan los contenedores de autenticación
-        ensure_auth_containers()
+        await ensure_auth_containers()
         
         # Verificar si ya existe algún admin
         query = "SELECT * FROM c WHERE c.rol = 'admin' AND STARTSWITH(c.id, 'user:')"
-        existing_admins = usuarios.query_items(query, None)
+        existing_admins = await usuarios.query_items(query, None)
         
         if existing_admins and len(existing_admins) > 0:
             raise HTTPException(
@@ -734,7 +1109,7 @@ async def initialize_first_admin(user: UserCreate):
             "id": user_id,
             "username": user.username,
             "email": user.email,
-            "password_hash": AuthService.hash_password(user.password),
+            "password_hash": await AuthService.hash_password_async(user.password),
             "nombre_completo": user.nombre_completo,
             "rol": user.rol.value,
             "campus": user.campus.value,
@@ -746,12 +1121,13 @@ async def initialize_first_admin(user: UserCreate):
             "bloqueado_hasta": None
         }
         
-        usuarios.create_item(user_dict)
+        await usuarios.create_item(user_dict)
         
         # Auditoría
-        log_audit(
+        await log_audit(
             user.username,
             AuditAction.CREATE_USER,
+            campus=user.campus.value,
             recurso=user_id,
             detalles="Primer administrador del sistema creado",
             ip="system-init"
@@ -784,7 +1160,7 @@ async def register_user(user: UserCreate, current_user: UserResponse = Depends(r
         
         # Verificar si ya existe
         try:
-            existing = usuarios.read_item(user_id, user_id)
+            existing = await usuarios.read_item(user_id, user_id)
             if existing:
                 raise HTTPException(status_code=400, detail="El usuario ya existe")
         except:
@@ -795,7 +1171,7 @@ async def register_user(user: UserCreate, current_user: UserResponse = Depends(r
             "id": user_id,
             "username": user.username,
             "email": user.email,
-            "password_hash": AuthService.hash_password(user.password),
+            "password_hash": await AuthService.hash_password_async(user.password),
             "nombre_completo": user.nombre_completo,
             "rol": user.rol.value,
             "campus": user.campus.value,
@@ -808,14 +1184,15 @@ async def register_user(user: UserCreate, current_user: UserResponse = Depends(r
             "type": "user"
         }
         
-        usuarios.create_item(user_dict)
+        await usuarios.create_item(user_dict)
         
         # Auditoría
-        log_audit(
+        await log_audit(
             current_user.username,
             AuditAction.CREATE_USER,
             user_id,
-            f"Creó usuario {user.username} con rol {user.rol.value}"
+            f"Creó usuario {user.username} con rol {user.rol.value}",
+            campus=current_user.campus.value
         )
         
         # Retornar sin contraseña
@@ -830,21 +1207,33 @@ async def register_user(user: UserCreate, current_user: UserResponse = Depends(r
 async def login(request: Request, login_data: LoginRequest):
     """
     Iniciar sesión y obtener token JWT.
+    Los intentos se limitan por IP y por usuario (ver login_limiter.py):
+    excedido el límite responde 429 con Retry-After, sin consultar Cosmos.
     """
+    ip = client_ip(request)
+    # En un hilo: el backend sqlite puede esperar el lock de otro worker (hasta 5 s)
+    retry_after = await asyncio.to_thread(login_limiter.check, ip, login_data.username)
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail="Demasiados intentos de inicio de sesión, intenta más tarde",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
     try:
         # Buscar usuario
         user_id = AuthService.generate_user_id(login_data.username, login_data.campus or Campus.LLANO_LARGO)
         
         try:
-            user_dict = usuarios.read_item(user_id, user_id)
+            user_dict = await usuarios.read_item(user_id, user_id)
             user = UserInDB(**user_dict)
         except:
             # Log intento fallido
-            log_audit(
+            await log_audit(
                 login_data.username,
                 AuditAction.LOGIN_FAILED,
+                campus=login_data.campus.value if login_data.campus else None,
                 detalles="Usuario no encontrado",
-                ip=request.client.host if request.client else None
+                ip=ip
             )
             raise HTTPException(
                 status_code=401,
@@ -866,30 +1255,37 @@ async def login(request: Request, login_data: LoginRequest):
             )
         
         # Verificar contraseña
-        if not AuthService.verify_password(login_data.password, user.password_hash):
-            # Incrementar intentos fallidos
-            user_dict["intentos_fallidos"] = user.intentos_fallidos + 1
+        if not await AuthService.verify_password_async(login_data.password, user.password_hash):
+            # Incrementar intentos fallidos (incr atómico: no se pierden intentos concurrentes)
+            updated = await usuarios.patch_item(user_id, user_id, [
+                {"op": "incr", "path": "/intentos_fallidos", "value": 1}
+            ])
+            user.intentos_fallidos = updated.get("intentos_fallidos", 1) - 1  # Valor previo a este intento
+            user_profiles.pop(user_id)
             
             if should_lock_user(user):
-                user_dict["bloqueado_hasta"] = calculate_lockout_time()
-                usuarios.upsert_item(user_dict, user_id)
-                log_audit(
+                await usuarios.patch_item(user_id, user_id, [
+                    {"op": "set", "path": "/bloqueado_hasta", "value": calculate_lockout_time()}
+                ])
+                user_profiles.pop(user_id)
+                await log_audit(
                     user.username,
                     AuditAction.LOGIN_FAILED,
+                    campus=user.campus.value,
                     detalles=f"Usuario bloqueado por {user.intentos_fallidos + 1} intentos fallidos",
-                    ip=request.client.host if request.client else None
+                    ip=ip
                 )
                 raise HTTPException(
                     status_code=403,
                     detail=f"Demasiados intentos fallidos. Usuario bloqueado por 30 minutos."
                 )
             
-            usuarios.upsert_item(user_dict, user_id)
-            log_audit(
+            await log_audit(
                 user.username,
                 AuditAction.LOGIN_FAILED,
+                campus=user.campus.value,
                 detalles=f"Contraseña incorrecta (intento {user.intentos_fallidos + 1})",
-                ip=request.client.host if request.client else None
+                ip=ip
             )
             raise HTTPException(
                 status_code=401,
@@ -897,10 +1293,11 @@ async def login(request: Request, login_data: LoginRequest):
             )
         
         # Login exitoso - resetear intentos fallidos y actualizar último acceso
-        user_dict["intentos_fallidos"] = 0
-        user_dict["bloqueado_hasta"] = None
-        user_dict["ultimo_acceso"] = datetime.utcnow().isoformat()
-        usuarios.upsert_item(user_dict, user_id)
+        user_dict = await usuarios.patch_item(user_id, user_id, [
+            {"op": "set", "path": "/intentos_fallidos", "value": 0},
+            {"op": "set", "path": "/bloqueado_hasta", "value": None},
+            {"op": "set", "path": "/ultimo_acceso", "value": datetime.utcnow().isoformat()}
+        ])
         
         # Crear token
         access_token = AuthService.create_access_token(
@@ -913,15 +1310,18 @@ async def login(request: Request, login_data: LoginRequest):
         )
         
         # Auditoría
-        log_audit(
+        await log_audit(
             user.username,
             AuditAction.LOGIN,
-            detalles=f"Login exitoso desde {request.client.host if request.client else 'unknown'}",
-            ip=request.client.host if request.client else None
+            campus=user.campus.value,
+            detalles=f"Login exitoso desde {ip or 'unknown'}",
+            ip=ip
         )
         
-        # Retornar token y datos del usuario
-        user_response = UserResponse(**{k: v for k, v in user_dict.items() if k != "password_hash"})
+        await asyncio.to_thread(login_limiter.succeeded, ip, login_data.username)
+        
+        # Retornar token y datos del usuario (el perfil queda en caché para /auth/me)
+        user_response = cache_user_profile(user_dict)
         return Token(access_token=access_token, user=user_response)
     
     except HTTPException:
@@ -933,23 +1333,34 @@ async def login(request: Request, login_data: LoginRequest):
 async def get_current_user_info(current_user = Depends(get_current_user)):
     """
     Obtener información del usuario actual desde el token.
+    Se sirve del caché de perfiles (ver cache_user_profile) cuando está vigente.
     """
     user_id = AuthService.generate_user_id(current_user.username, current_user.campus)
-    user_dict = usuarios.read_item(user_id, user_id)
-    return UserResponse(**{k: v for k, v in user_dict.items() if k != "password_hash"})
+    try:
+        return await get_user_profile(user_id)
+    except CosmosHttpResponseError as e:
+        if e.status_code == 404:
+            raise HTTPException(status_code=404, detail="Usuario no encontrado")
+        raise
 
 @app.get("/auth/users", response_model=list[UserResponse], tags=["Gestión de Usuarios"])
 async def list_users(
+    response: Response,
     campus: Optional[str] = None,
     rol: Optional[str] = None,
+    page_size: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    continuation: Optional[str] = None,
+    fields: Optional[str] = None,
     current_user = Depends(require_role(UserRole.ADMIN))
 ):
     """
     Listar todos los usuarios del sistema.
-    Solo accesible para administradores.
+    Solo accesible para administradores. Con fields=a,b solo se retornan esos
+    campos de UserResponse (password_hash nunca es proyectable).
     """
+    cols = parse_fields(fields, UserResponse, always=("id",))
     try:
-        query = "SELECT * FROM c WHERE STARTSWITH(c.id, 'user:')"
+        query = f"{select_clause(cols)} FROM c WHERE STARTSWITH(c.id, 'user:')"
         params = []
         
         if campus:
@@ -960,7 +1371,11 @@ async def list_users(
             query += " AND c.rol = @rol"
             params.append({"name": "@rol", "value": rol})
         
-        users = usuarios.query_items(query, params if params else None)
+        users = await query_list(usuarios, query, params if params else None, response, page_size, continuation)
+        if cols:
+            # Respuesta parcial: no pasa por la validación de response_model
+            token = response.headers.get(CONTINUATION_HEADER)
+            return JSONResponse(content=users, headers={CONTINUATION_HEADER: token} if token else None)
         return [UserResponse(**{k: v for k, v in u.items() if k != "password_hash"}) for u in users]
     
     except Exception as e:
@@ -977,63 +1392,209 @@ async def update_user(
     Solo accesible para administradores.
     """
     try:
-        user_dict = usuarios.read_item(user_id, user_id)
-        
-        # Aplicar actualizaciones
+        # Aplicar actualizaciones como patch parcial (sin leer ni reescribir el documento)
         update_data = updates.dict(exclude_unset=True)
+        operations = []
         for key, value in update_data.items():
             if value is not None:
                 if key in ["rol", "campus"]:
-                    user_dict[key] = value.value if hasattr(value, "value") else value
-                else:
-                    user_dict[key] = value
+                    value = value.value if hasattr(value, "value") else value
+                operations.append({"op": "set", "path": f"/{key}", "value": value})
         
-        usuarios.upsert_item(user_dict, user_id)
+        if operations:
+            user_dict = await usuarios.patch_item(user_id, user_id, operations)
+        else:
+            user_dict = await usuarios.read_item(user_id, user_id)
         
         # Auditoría
-        log_audit(
+        await log_audit(
             current_user.username,
             AuditAction.UPDATE_USER,
             user_id,
-            f"Actualizó usuario: {update_data}"
+            f"Actualizó usuario: {update_data}",
+            campus=current_user.campus.value
         )
         
-        return UserResponse(**{k: v for k, v in user_dict.items() if k != "password_hash"})
+        # Reemplaza el perfil en caché (rol, campus o activo pudieron cambiar)
+        return cache_user_profile(user_dict)
     
+    except CosmosHttpResponseError as e:
+        if e.status_code == 404:
+            raise HTTPException(status_code=404, detail="Usuario no encontrado")
+        raise HTTPException(status_code=500, detail=f"Error al actualizar usuario: {e.message}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al actualizar usuario: {str(e)}")
 
 @app.get("/auth/audit-logs", tags=["Auditoría"])
 async def get_audit_logs(
+    response: Response,
     usuario: Optional[str] = None,
-    accion: Optional[str] = None,
-    limit: int = 100,
+    accion: Optional[AuditAction] = None,
+    recurso: Optional[str] = None,
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    continuation: Optional[str] = None,
     current_user = Depends(require_role(UserRole.ADMIN))
 ):
     """
-    Obtener logs de auditoría del sistema.
+    Obtener logs de auditoría del sistema, del más reciente al más antiguo.
+    desde/hasta acotan la ventana (fecha YYYY-MM-DD o fecha-hora ISO; por
+    defecto los últimos AUDIT_QUERY_DEFAULT_DAYS días) y solo se consultan las
+    particiones (días) de esa ventana. Si hay más resultados, el header
+    X-Continuation-Token trae el cursor para pedir la siguiente página con
+    continuation= (mismos filtros).
     Solo accesible para administradores.
     """
     try:
-        query = "SELECT * FROM c WHERE STARTSWITH(c.id, 'audit:') ORDER BY c.timestamp DESC"
-        params = []
-        
-        if usuario:
-            query = query.replace("WHERE", f"WHERE c.usuario = @usuario AND")
-            params.append({"name": "@usuario", "value": usuario})
-        
-        if accion:
-            if params:
-                query = query.replace("ORDER BY", f"AND c.accion = @accion ORDER BY")
-            else:
-                query = query.replace("WHERE", f"WHERE c.accion = @accion AND")
-            params.append({"name": "@accion", "value": accion})
-        
-        logs = auditoria.query_items(query, params if params else None, max_items=limit)
-        return logs
-    
+        start, end = parse_range(desde, hasta)
+        logs, cursor = await query_audit_page(
+            auditoria, start, end, limit,
+            usuario=usuario, accion=accion.value if accion else None,
+            recurso=recurso, cursor=continuation, archive=audit_archive,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al obtener logs: {str(e)}")
+    if cursor:
+        response.headers[CONTINUATION_HEADER] = cursor
+    return logs
+
+@app.get("/auth/audit-logs/resumen", tags=["Auditoría"])
+async def get_audit_summary(
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None,
+    current_user = Depends(require_role(UserRole.ADMIN))
+):
+    """
+    Total de entradas de auditoría en la ventana [desde, hasta] (mismo formato
+    que /auth/audit-logs), sin transferir los documentos.
+    Solo accesible para administradores.
+    """
+    try:
+        start, end = parse_range(desde, hasta)
+        total = await count_audit(auditoria, start, end, archive=audit_archive)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al obtener resumen de auditoría: {str(e)}")
+    return {"total": total, "desde": start, "hasta": end}
+
+@app.get("/auth/audit-logs/rollups", tags=["Auditoría"])
+async def get_audit_rollups(
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None,
+    current_user = Depends(require_role(UserRole.ADMIN))
+):
+    """
+    Resúmenes diarios de los días ya archivados por la retención (conteos por
+    usuario, acción y campus), del más reciente al más antiguo.
+    Solo accesible para administradores.
+    """
+    try:
+        start, end = parse_range(desde, hasta)
+        return await auditoria.query_items(
+            "SELECT * FROM c WHERE c.tipo = @tipo AND c.dia >= @d1 AND c.dia <= @d2 ORDER BY c.dia DESC",
+            [{"name": "@tipo", "value": ROLLUP_TIPO},
+             {"name": "@d1", "value": audit_day(start)}, {"name": "@d2", "value": audit_day(end)}],
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al obtener resúmenes de auditoría: {str(e)}")
+
+@app.get("/auth/audit-logs/export", tags=["Auditoría"])
+async def export_audit_logs(
+    request: Request,
+    desde: str,
+    hasta: Optional[str] = None,
+    formato: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    gzip: bool = True,
+    usuario: Optional[str] = None,
+    accion: Optional[AuditAction] = None,
+    recurso: Optional[str] = None,
+    continuation: Optional[str] = None,
+    ultimo_timestamp: Optional[str] = None,
+    ultimo_id: Optional[str] = None,
+    current_user = Depends(require_role(UserRole.ADMIN))
+):
+    """
+    Exporta las entradas de auditoría de [desde, hasta] como archivo NDJSON o
+    CSV (gzip por defecto), en streaming y del más reciente al más antiguo.
+    Para reanudar una descarga cortada se repite el request con los mismos
+    parámetros más ultimo_timestamp y ultimo_id de la última entrada recibida
+    (o continuation con un cursor de /auth/audit-logs).
+    Solo accesible para administradores.
+    """
+    try:
+        start, end = parse_range(desde, hasta)
+        if ultimo_timestamp or ultimo_id:
+            if not (ultimo_timestamp and ultimo_id):
+                raise ValueError("Para reanudar se requieren ultimo_timestamp y ultimo_id")
+            continuation = encode_cursor({"timestamp": ultimo_timestamp, "id": ultimo_id})
+        if continuation:
+            decode_cursor(continuation)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    summary = {}
+    filename = f"auditoria_{start[:10]}_{end[:10]}.{formato}" + (".gz" if gzip else "")
+    stream = export_audit(
+        auditoria, start, end, fmt=formato, compress=gzip, cursor=continuation, summary=summary,
+        usuario=usuario, accion=accion.value if accion else None, recurso=recurso, archive=audit_archive,
+    )
+    ip = client_ip(request)
+
+    async def on_finish():
+        await log_audit(
+            current_user.username, AuditAction.EXPORT_AUDIT, recurso=filename, campus=current_user.campus.value,
+            detalles=f"{summary.get('total', 0)} entradas, {start} a {end}" + (" (reanudada)" if continuation else ""),
+            ip=ip,
+        )
+
+    return StreamingResponse(
+        stream,
+        media_type="application/gzip" if gzip else EXPORT_FORMATS[formato],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        background=BackgroundTask(on_finish),
+    )
+
+# ============================================
+# MÉTRICAS DE CONSUMO DE RU (COSMOS DB)
+# ============================================
+
+@app.get("/metrics/ru", tags=["Métricas"])
+async def get_ru_metrics(
+    reset: bool = False,
+    current_user = Depends(require_role(UserRole.ADMIN))
+):
+    """
+    Consumo de Request Units por endpoint y por query desde el arranque del worker.
+    Incluye cargo total/promedio/máximo, items devueltos, duración en servidor,
+    query metrics de Cosmos, los contadores de throttling (429), los del
+    caché de point reads, el avance del change feed por vista, la cola de
+    auditoría (escritas, descartadas, fallidas, respaldadas en archivo) y el
+    pool de bcrypt (en cola, espera promedio/máxima, rechazados con 503) y los
+    intentos de login rechazados por el límite por IP/usuario.
+    Con reset=true se reinician los agregados después de leerlos.
+    Solo accesible para administradores.
+    """
+    snapshot = ru_accumulator.snapshot()
+    snapshot["throttling"] = get_throttle_stats()
+    snapshot["point_cache"] = {
+        helper.container_name: helper.cache.stats()
+        for helper in (carnets, usuarios) if helper.cache is not None
+    }
+    snapshot["point_cache"]["user_profiles"] = user_profiles.stats()
+    snapshot["point_cache"]["jwt_claims"] = jwt_claims_cache.stats()
+    snapshot["change_feed"] = change_feed.stats()
+    snapshot["audit"] = audit_logger.stats()
+    snapshot["bcrypt"] = password_pool.stats()
+    snapshot["login_limiter"] = login_limiter.stats()
+    if reset:
+        ru_accumulator.reset()
+    return snapshot
 
 # ============================================
 # ENDPOINTS DE VACUNACIÓN - TARJETA DE VACUNACIÓN
@@ -1086,11 +1647,15 @@ async def guardar_aplicacion_vacuna(
             "fechaAplicacion": aplicacion.fechaAplicacion,
             "observaciones": aplicacion.observaciones or "",
             "timestamp": aplicacion.timestamp,
+            "campus": current_user.campus.value,  # Desglose por campus en las estadísticas
             "tipo": "aplicacion_vacuna"  # Para filtrar después
         }
         
         # Guardar en Cosmos DB
-        result = tarjeta_vacunacion.create_item(documento)
+        result = await tarjeta_vacunacion.create_item(documento)
+        if not vacunacion_stats.feed_managed:
+            # Con change feed la aplicación se cuenta al leerla del feed (una sola vez)
+            vacunacion_stats.apply(result)
         
         print(f"✅ Vacunación guardada: {aplicacion.id} - {matricula} - {aplicacion.vacuna}")
         
@@ -1113,6 +1678,8 @@ async def guardar_aplicacion_vacuna(
 @app.get("/carnet/{matricula}/vacunacion")
 async def obtener_historial_vacunacion(
     matricula: str,
+    page_size: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    continuation: Optional[str] = None,
     current_user: dict = Depends(get_current_user)
 ):
     """
@@ -1125,16 +1692,15 @@ async def obtener_historial_vacunacion(
         query = "SELECT * FROM c WHERE c.matricula = @matricula AND c.tipo = 'aplicacion_vacuna' ORDER BY c.fechaAplicacion DESC"
         params = [{"name": "@matricula", "value": matricula}]
         
-        items = tarjeta_vacunacion.query_items(query, params)
-        
-        # Convertir a lista
-        historial = list(items)
+        page = Response()
+        historial = await query_list(tarjeta_vacunacion, query, params, page, page_size, continuation)
         
         print(f"📋 Historial de vacunación: {matricula} - {len(historial)} registros")
         
         return JSONResponse(
             status_code=200,
-            content=historial
+            content=historial,
+            headers={k: v for k, v in page.headers.items() if k.lower() == CONTINUATION_HEADER.lower()}
         )
     
     except CosmosHttpResponseError as e:
@@ -1145,48 +1711,29 @@ async def obtener_historial_vacunacion(
         raise HTTPException(status_code=500, detail=f"Error al obtener historial: {str(e)}")
 
 @app.get("/vacunacion/estadisticas")
-async def obtener_estadisticas_vacunacion():
+async def obtener_estadisticas_vacunacion(
+    campus: Optional[str] = None,
+    desde: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}-\d{2}$"),
+    hasta: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}-\d{2}$")
+):
     """
     Obtiene estadísticas globales de vacunación.
     - Total de aplicaciones
-    - Por vacuna
-    - Por campaña
+    - Estudiantes vacunados (únicos)
+    - Por vacuna, por campaña y por campus
+    Filtros opcionales: campus y ventana de fechaAplicacion desde/hasta (YYYY-MM-DD, inclusivas).
+    Los contadores se mantienen en memoria (ver vaccination_stats.py); "actualizacion"
+    indica si incluyen las escrituras de todos los workers ("change_feed") o solo
+    las del worker que responde ("por_worker", con VACUNACION_STATS_FEED=false).
     """
     try:
-        # Obtener todas las aplicaciones
-        query = "SELECT * FROM c WHERE c.tipo = 'aplicacion_vacuna'"
-        items = list(tarjeta_vacunacion.query_items(query, []))
-        
-        # Calcular estadísticas
-        total_aplicaciones = len(items)
-        
-        # Por vacuna
-        vacunas = {}
-        campanas = {}
-        estudiantes = set()
-        
-        for item in items:
-            # Contar por vacuna
-            vacuna = item.get("vacuna", "Desconocida")
-            vacunas[vacuna] = vacunas.get(vacuna, 0) + 1
-            
-            # Contar por campaña
-            campana = item.get("campana", "Sin campaña")
-            campanas[campana] = campanas.get(campana, 0) + 1
-            
-            # Estudiantes únicos
-            estudiantes.add(item.get("matricula"))
-        
-        return JSONResponse(
-            status_code=200,
-            content={
-                "totalAplicaciones": total_aplicaciones,
-                "estudiantesVacunados": len(estudiantes),
-                "porVacuna": vacunas,
-                "porCampana": campanas
-            }
-        )
+        await vacunacion_stats.ensure_loaded(tarjeta_vacunacion)
+        content = vacunacion_stats.snapshot(campus, desde, hasta)
+        content["actualizacion"] = "change_feed" if vacunacion_stats.feed_managed else "por_worker"
+        return JSONResponse(status_code=200, content=content)
     
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Estadísticas de vacunación en construcción, intente de nuevo")
     except Exception as e:
         print(f"❌ Error al obtener estadísticas: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error al obtener estadísticas: {str(e)}")
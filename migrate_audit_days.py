@@ -0,0 +1,78 @@
+"""
+Script de migración del log de auditoría al contenedor particionado por día.
+
+Copia las entradas del contenedor anterior (COSMOS_CONTAINER_AUDITORIA,
+partition key /id) a COSMOS_CONTAINER_AUDITORIA_DIA (partition key /dia),
+agregando el campo dia. Si el destino no existe se crea con el índice
+compuesto y default TTL -1 (igual que ensure_auth_containers). Usa upserts
+en batch por día, así que se puede volver a correr sin duplicar entradas.
+El contenedor anterior no se modifica.
+
+Uso:
+    python migrate_audit_days.py
+"""
+
+import asyncio
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from audit_store import AUDIT_INDEXING_POLICY, AUDIT_PARTITION_KEY, audit_day
+from cosmos_helper import AsyncCosmosDBHelper, close_async_clients, get_async_database
+from storage_backends import is_local_backend
+
+PAGE_SIZE = 500
+
+
+async def ensure_destination(container_id: str):
+    """Crea el contenedor destino si no existe (los backends locales lo crean solos)."""
+    if is_local_backend():
+        return
+    from azure.cosmos import PartitionKey
+    await get_async_database().create_container_if_not_exists(
+        id=container_id,
+        partition_key=PartitionKey(path=AUDIT_PARTITION_KEY),
+        indexing_policy=AUDIT_INDEXING_POLICY,
+        default_ttl=-1,
+        offer_throughput=400
+    )
+    print(f"📦 Contenedor destino '{container_id}' listo")
+
+
+async def migrate():
+    destino_id = os.environ.get("COSMOS_CONTAINER_AUDITORIA_DIA", "auditoria_dia")
+    await ensure_destination(destino_id)
+    origen = AsyncCosmosDBHelper(os.environ.get("COSMOS_CONTAINER_AUDITORIA", "auditoria"), "/id")
+    destino = AsyncCosmosDBHelper(destino_id, AUDIT_PARTITION_KEY)
+    copiadas = fallidas = 0
+    query = "SELECT * FROM c WHERE STARTSWITH(c.id, 'audit:')"
+    async for items, _ in origen.query_pages(query, [], page_size=PAGE_SIZE):
+        operations = []
+        for item in items:
+            entry = {k: v for k, v in item.items() if not k.startswith("_")}
+            if not entry.get("timestamp"):
+                fallidas += 1
+                continue
+            entry["dia"] = audit_day(entry["timestamp"])
+            operations.append(("upsert", (entry,)))
+        if not operations:
+            continue
+        results = await destino.execute_batch(operations)
+        ok = sum(1 for r in results if r["status_code"] < 400)
+        copiadas += ok
+        fallidas += len(results) - ok
+        print(f"📦 {copiadas} entradas copiadas ({fallidas} fallidas)")
+    print(f"✅ Migración terminada: {copiadas} copiadas, {fallidas} fallidas")
+
+
+async def main():
+    try:
+        await migrate()
+    finally:
+        await close_async_clients()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
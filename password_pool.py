@@ -0,0 +1,107 @@
+# temp_backend/password_pool.py
+"""
+Pool acotado de hilos para bcrypt (hash y verificación de contraseñas).
+
+bcrypt cuesta 100-300 ms de CPU por llamada; ejecutado dentro de un
+endpoint async bloquea el event loop y todos los demás requests del worker
+esperan detrás de él. Aquí corre en un ThreadPoolExecutor (bcrypt libera el
+GIL mientras calcula), con a lo sumo PASSWORD_POOL_WORKERS cálculos en
+paralelo por proceso y una cola de espera acotada: si hay más de
+PASSWORD_POOL_MAX_QUEUE pendientes el request recibe 503 con Retry-After en
+lugar de acumular latencia sin límite.
+
+Configuración (variables de entorno):
+    PASSWORD_POOL_WORKERS     hilos de bcrypt por proceso (default min(4, CPUs))
+    PASSWORD_POOL_MAX_QUEUE   cálculos en espera antes de responder 503 (default 64)
+"""
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from fastapi import HTTPException, status
+
+PASSWORD_POOL_WORKERS = int(os.environ.get("PASSWORD_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_POOL_MAX_QUEUE = int(os.environ.get("PASSWORD_POOL_MAX_QUEUE", "64"))
+
+
+class PasswordPool:
+    """Ejecuta funciones de bcrypt en hilos, con cola acotada y métricas de espera."""
+
+    def __init__(self, workers: int = PASSWORD_POOL_WORKERS, max_queue: int = PASSWORD_POOL_MAX_QUEUE):
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._stats = {
+            "calls": 0, "rejected": 0, "max_queued": 0,
+            "wait_ms_total": 0.0, "wait_ms_max": 0.0, "run_ms_total": 0.0,
+        }
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # Se crea al primer uso: cada worker de gunicorn (fork) tiene sus propios hilos
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    def _timed(self, fn: Callable, args: tuple, submitted: float):
+        started = time.perf_counter()
+        wait_ms = (started - submitted) * 1000
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._stats["wait_ms_total"] += wait_ms
+            self._stats["wait_ms_max"] = max(self._stats["wait_ms_max"], wait_ms)
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._stats["calls"] += 1
+                self._stats["run_ms_total"] += (time.perf_counter() - started) * 1000
+
+    async def run(self, fn: Callable, *args):
+        """Ejecuta fn(*args) en el pool; 503 si la cola de espera está llena."""
+        with self._lock:
+            if self._queued >= self.max_queue:
+                self._stats["rejected"] += 1
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Servidor ocupado verificando credenciales, intenta de nuevo",
+                    headers={"Retry-After": "1"},
+                )
+            self._queued += 1
+            self._stats["max_queued"] = max(self._stats["max_queued"], self._queued)
+        future = self._get_executor().submit(self._timed, fn, args, time.perf_counter())
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # Cliente desconectado: si aún no empezó, sale de la cola sin calcular
+            if future.cancel():
+                with self._lock:
+                    self._queued -= 1
+            raise
+
+    def stats(self) -> dict:
+        with self._lock:
+            calls = self._stats["calls"]
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "queued": self._queued,
+                "running": self._running,
+                "calls": calls,
+                "rejected": self._stats["rejected"],
+                "max_queued": self._stats["max_queued"],
+                "avg_wait_ms": round(self._stats["wait_ms_total"] / calls, 2) if calls else 0.0,
+                "max_wait_ms": round(self._stats["wait_ms_max"], 2),
+                "avg_run_ms": round(self._stats["run_ms_total"] / calls, 2) if calls else 0.0,
+            }
+
+
+password_pool = PasswordPool()
@@ -0,0 +1,171 @@
+# temp_backend/ru_metrics.py
+"""
+Contabilidad de Request Units (RU) por endpoint y por query.
+
+Cada llamada de CosmosDBHelper / AsyncCosmosDBHelper registra el cargo
+(x-ms-request-charge), el número de items, la duración en servidor
+(x-ms-request-duration-ms) y, para queries, las query metrics de Cosmos.
+Los registros se etiquetan con la ruta de FastAPI que originó la llamada
+(RUContextMiddleware) y se agregan en memoria del proceso.
+"""
+
+import contextvars
+import os
+import re
+import threading
+from typing import Dict, Optional
+
+REQUEST_CHARGE_HEADER = "x-ms-request-charge"
+REQUEST_DURATION_HEADER = "x-ms-request-duration-ms"
+QUERY_METRICS_HEADER = "x-ms-documentdb-query-metrics"
+ITEM_COUNT_HEADER = "x-ms-item-count"
+
+# populate_query_metrics=True en las queries (solo agrega un header a la respuesta)
+COSMOS_QUERY_METRICS = os.environ.get("COSMOS_QUERY_METRICS", "true").lower() == "true"
+
+# Scope ASGI del request en curso; la ruta resuelta (scope["route"]) se lee al registrar
+_request_scope: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("ru_request_scope", default=None)
+
+_WS_RE = re.compile(r"\s+")
+
+
+def current_route() -> str:
+    """Ruta de FastAPI que originó la llamada actual ("GET /carnet/{id}") o "background"."""
+    scope = _request_scope.get()
+    if scope is None:
+        return "background"
+    route = scope.get("route")
+    path = getattr(route, "path", None) or scope.get("path", "")
+    return f"{scope.get('method', '')} {path}".strip()
+
+
+class RUContextMiddleware:
+    """Middleware ASGI que expone el scope del request a la contabilidad de RU."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = _request_scope.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_scope.reset(token)
+
+
+def parse_query_metrics(raw: Optional[str]) -> Dict[str, float]:
+    """Parsea "totalExecutionTimeInMs=1.2;retrievedDocumentCount=10;..." a dict."""
+    metrics = {}
+    if not raw:
+        return metrics
+    for part in raw.split(";"):
+        if "=" in part:
+            key, value = part.split("=", 1)
+            try:
+                metrics[key.strip()] = float(value)
+            except ValueError:
+                continue
+    return metrics
+
+
+class RUCapture:
+    """
+    response_hook para el SDK de Cosmos: acumula cargo y duración de todas las
+    respuestas de una operación (una query puede traer varias páginas).
+    """
+
+    def __init__(self):
+        self.request_charge = 0.0
+        self.server_duration_ms = 0.0
+        self.responses = 0
+        self.query_metrics: Dict[str, float] = {}
+
+    def __call__(self, headers, result=None):
+        headers = headers or {}
+        self.responses += 1
+        try:
+            self.request_charge += float(headers.get(REQUEST_CHARGE_HEADER, 0) or 0)
+        except (TypeError, ValueError):
+            pass
+        try:
+            self.server_duration_ms += float(headers.get(REQUEST_DURATION_HEADER, 0) or 0)
+        except (TypeError, ValueError):
+            pass
+        for key, value in parse_query_metrics(headers.get(QUERY_METRICS_HEADER)).items():
+            self.query_metrics[key] = self.query_metrics.get(key, 0.0) + value
+
+
+def query_signature(sql: Optional[str]) -> str:
+    """Normaliza el texto de la query para agrupar (los valores van en parámetros)."""
+    return _WS_RE.sub(" ", sql).strip() if sql else ""
+
+
+class RUAccumulator:
+    """Agregado en proceso de RU por (ruta, contenedor, operación, query)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[tuple, dict] = {}
+
+    def record(self, container: str, operation: str, capture: RUCapture,
+               item_count: int = 0, sql: Optional[str] = None, route: Optional[str] = None):
+        key = (route or current_route(), container, operation, query_signature(sql))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = {
+                    "calls": 0,
+                    "total_ru": 0.0,
+                    "max_ru": 0.0,
+                    "items": 0,
+                    "server_duration_ms": 0.0,
+                    "query_metrics": {},
+                }
+                self._entries[key] = entry
+            entry["calls"] += 1
+            entry["total_ru"] += capture.request_charge
+            entry["max_ru"] = max(entry["max_ru"], capture.request_charge)
+            entry["items"] += item_count
+            entry["server_duration_ms"] += capture.server_duration_ms
+            for metric, value in capture.query_metrics.items():
+                entry["query_metrics"][metric] = entry["query_metrics"].get(metric, 0.0) + value
+
+    def snapshot(self) -> dict:
+        """Resumen por endpoint (ordenado por RU total) con el detalle por query."""
+        with self._lock:
+            items = [(k, dict(v, query_metrics=dict(v["query_metrics"]))) for k, v in self._entries.items()]
+        endpoints: Dict[str, dict] = {}
+        for (route, container, operation, sql), entry in items:
+            endpoint = endpoints.setdefault(route, {"route": route, "calls": 0, "total_ru": 0.0, "operations": []})
+            endpoint["calls"] += entry["calls"]
+            endpoint["total_ru"] += entry["total_ru"]
+            endpoint["operations"].append({
+                "container": container,
+                "operation": operation,
+                "query": sql or None,
+                "calls": entry["calls"],
+                "total_ru": round(entry["total_ru"], 2),
+                "avg_ru": round(entry["total_ru"] / entry["calls"], 2),
+                "max_ru": round(entry["max_ru"], 2),
+                "avg_items": round(entry["items"] / entry["calls"], 2),
+                "avg_server_duration_ms": round(entry["server_duration_ms"] / entry["calls"], 2),
+                "query_metrics": entry["query_metrics"],
+            })
+        result = sorted(endpoints.values(), key=lambda e: e["total_ru"], reverse=True)
+        for endpoint in result:
+            endpoint["total_ru"] = round(endpoint["total_ru"], 2)
+            endpoint["operations"].sort(key=lambda o: o["total_ru"], reverse=True)
+        return {
+            "total_ru": round(sum(e["total_ru"] for e in result), 2),
+            "endpoints": result,
+        }
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+
+
+ru_accumulator = RUAccumulator()
@@ -0,0 +1,1330 @@
+# temp_backend/storage_backends.py
+"""
+Backends de almacenamiento locales que implementan el contrato de contenedor
+que usan CosmosDBHelper / AsyncCosmosDBHelper (read_item, create_item,
+upsert_item, replace_item, patch_item, query_items, execute_item_batch,
+query_items_change_feed).
+
+Permiten correr main.py sin una cuenta de Cosmos (benchmarks, pruebas de carga):
+    STORAGE_BACKEND=cosmos   (default) Azure Cosmos DB
+    STORAGE_BACKEND=memory   diccionarios en memoria del proceso
+    STORAGE_BACKEND=sqlite   archivo SQLite (STORAGE_SQLITE_PATH, default ./local_storage.db)
+
+Las queries se evalúan con un intérprete del subconjunto de SQL de Cosmos que
+usa main.py: SELECT [TOP n] * | c.campo [AS alias], ... | VALUE COUNT(1) FROM c
+[WHERE ...] [ORDER BY c.campo [ASC|DESC], ...] [OFFSET n LIMIT m]
+con =, !=, <>, <, >, <=, >=, AND, OR, NOT, IN, STARTSWITH, ENDSWITH, CONTAINS,
+IS_DEFINED, LOWER, UPPER y parámetros @nombre.
+
+Cada escritura recibe un _lsn creciente por contenedor; el change feed local
+entrega la última versión de cada documento en orden de _lsn (modo
+LatestVersion de Cosmos: sin borrados ni versiones intermedias).
+
+Un documento con "ttl" (segundos) deja de ser visible cuando vence _ts + ttl,
+como en un contenedor de Cosmos con default TTL -1.
+"""
+
+import base64
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from copy import deepcopy
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Optional, Protocol
+
+from azure.core import MatchConditions
+from azure.cosmos.exceptions import (
+    CosmosAccessConditionFailedError,
+    CosmosBatchOperationError,
+    CosmosHttpResponseError,
+    CosmosResourceExistsError,
+    CosmosResourceNotFoundError,
+)
+
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "cosmos").lower()
+STORAGE_SQLITE_PATH = os.environ.get("STORAGE_SQLITE_PATH", "local_storage.db")
+
+
+class StorageContainer(Protocol):
+    """Contrato mínimo de contenedor que consumen los helpers de cosmos_helper.py."""
+
+    def read_item(self, item: str, partition_key: Any, **kwargs) -> dict: ...
+
+    def create_item(self, body: dict, **kwargs) -> dict: ...
+
+    def upsert_item(self, body: dict, **kwargs) -> dict: ...
+
+    def replace_item(self, item: str, body: dict, **kwargs) -> dict: ...
+
+    def patch_item(self, item: str, partition_key: Any, patch_operations: list, **kwargs) -> dict: ...
+
+    def query_items(self, query: str, parameters: Optional[list] = None, **kwargs) -> Iterable[dict]: ...
+
+    def execute_item_batch(self, batch_operations: list, partition_key: Any, **kwargs) -> List[dict]: ...
+
+    def query_items_change_feed(self, **kwargs) -> Iterable[dict]: ...
+
+
+# ============================================
+# INTÉRPRETE DEL SUBCONJUNTO SQL DE COSMOS
+# ============================================
+
+class _Undefined:
+    """Valor 'undefined' de Cosmos (propiedad inexistente)."""
+    def __repr__(self):
+        return "undefined"
+
+UNDEFINED = _Undefined()
+
+_TOKEN_RE = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<number>-?\d+(?:\.\d+)?)
+  | (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+  | (?P<param>@[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<ident>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<op><>|!=|<=|>=|=|<|>|\(|\)|,|\.|\*|\[|\])
+""", re.VERBOSE)
+
+_KEYWORDS = {
+    "SELECT", "TOP", "FROM", "WHERE", "AND", "OR", "NOT", "ORDER", "BY",
+    "ASC", "DESC", "TRUE", "FALSE", "NULL", "IN", "VALUE", "AS",
+}
+
+
+def _tokenize(sql: str) -> List[tuple]:
+    tokens = []
+    pos = 0
+    while pos < len(sql):
+        m = _TOKEN_RE.match(sql, pos)
+        if not m:
+            raise CosmosHttpResponseError(status_code=400, message=f"Sintaxis no soportada cerca de: {sql[pos:pos + 20]!r}")
+        pos = m.end()
+        kind = m.lastgroup
+        text = m.group(kind)
+        if kind == "ws":
+            continue
+        if kind == "ident" and text.upper() in _KEYWORDS:
+            tokens.append(("kw", text.upper()))
+        elif kind == "string":
+            tokens.append(("string", re.sub(r"\\(.)", r"\1", text[1:-1])))
+        elif kind == "number":
+            tokens.append(("number", float(text) if "." in text else int(text)))
+        else:
+            tokens.append((kind, text))
+    tokens.append(("eof", None))
+    return tokens
+
+
+def _type_rank(value):
+    """Orden de tipos de Cosmos para ORDER BY mixto."""
+    if value is UNDEFINED:
+        return 0
+    if value is None:
+        return 1
+    if isinstance(value, bool):
+        return 2
+    if isinstance(value, (int, float)):
+        return 3
+    if isinstance(value, str):
+        return 4
+    return 5
+
+
+def _comparable(a, b):
+    return _type_rank(a) == _type_rank(b) and _type_rank(a) in (2, 3, 4)
+
+
+def _compare(op, a, b):
+    if a is UNDEFINED or b is UNDEFINED:
+        return UNDEFINED
+    if op == "=":
+        return _type_rank(a) == _type_rank(b) and a == b
+    if op in ("!=", "<>"):
+        return not (_type_rank(a) == _type_rank(b) and a == b)
+    if not _comparable(a, b):
+        return UNDEFINED
+    if op == "<":
+        return a < b
+    if op == ">":
+        return a > b
+    if op == "<=":
+        return a <= b
+    return a >= b
+
+
+def _string_fn(fn):
+    def wrapper(*args):
+        if any(not isinstance(a, str) for a in args[:2]):
+            return UNDEFINED
+        return fn(*args)
+    return wrapper
+
+
+def _fn_startswith(s, prefix, ignore_case=False):
+    return s.lower().startswith(prefix.lower()) if ignore_case is True else s.startswith(prefix)
+
+
+def _fn_endswith(s, suffix, ignore_case=False):
+    return s.lower().endswith(suffix.lower()) if ignore_case is True else s.endswith(suffix)
+
+
+def _fn_contains(s, sub, ignore_case=False):
+    return sub.lower() in s.lower() if ignore_case is True else sub in s
+
+
+_FUNCTIONS: Dict[str, Callable] = {
+    "STARTSWITH": _string_fn(_fn_startswith),
+    "ENDSWITH": _string_fn(_fn_endswith),
+    "CONTAINS": _string_fn(_fn_contains),
+    "IS_DEFINED": lambda v: v is not UNDEFINED,
+    "LOWER": lambda v: v.lower() if isinstance(v, str) else UNDEFINED,
+    "UPPER": lambda v: v.upper() if isinstance(v, str) else UNDEFINED,
+}
+
+
+class _Parser:
+    """Parser recursivo que compila la query a closures (doc, params) -> valor."""
+
+    def __init__(self, sql: str):
+        self.tokens = _tokenize(sql)
+        self.pos = 0
+        self.alias = "c"
+
+    # --- utilidades de tokens ---
+    def peek(self, kind=None, value=None):
+        tok = self.tokens[self.pos]
+        if kind and tok[0] != kind:
+            return False
+        if value is not None and tok[1] != value:
+            return False
+        return True
+
+    def take(self, kind=None, value=None):
+        tok = self.tokens[self.pos]
+        if not self.peek(kind, value):
+            raise CosmosHttpResponseError(status_code=400, message=f"Token inesperado {tok[1]!r}, se esperaba {value or kind}")
+        self.pos += 1
+        return tok
+
+    def accept(self, kind, value=None):
+        if self.peek(kind, value):
+            return self.take(kind, value)
+        return None
+
+    # --- gramática ---
+    def parse_query(self):
+        self.take("kw", "SELECT")
+        top = None
+        if self.accept("kw", "TOP"):
+            top = self.take("number")[1]
+        projection = None
+        count = False
+        if self.accept("kw", "VALUE"):
+            # Único agregado soportado: SELECT VALUE COUNT(1)
+            if self.take("ident")[1].upper() != "COUNT":
+                raise CosmosHttpResponseError(status_code=400, message="Solo se soporta SELECT VALUE COUNT(1)")
+            self.take("op", "(")
+            self.take("number")
+            self.take("op", ")")
+            count = True
+        elif not self.accept("op", "*"):
+            projection = self._select_list()
+        self.take("kw", "FROM")
+        self.alias = self.take("ident")[1]
+        if projection is not None:
+            if any(root != self.alias for root, _, _ in projection):
+                raise CosmosHttpResponseError(status_code=400, message="La proyección debe usar el alias del FROM")
+            projection = [(name, segments) for _, segments, name in projection]
+        where = None
+        if self.accept("kw", "WHERE"):
+            where = self.parse_or()
+        order_by = []
+        if self.accept("kw", "ORDER"):
+            self.take("kw", "BY")
+            while True:
+                expr = self.parse_operand()
+                descending = False
+                if self.accept("kw", "DESC"):
+                    descending = True
+                else:
+                    self.accept("kw", "ASC")
+                order_by.append((expr, descending))
+                if not self.accept("op", ","):
+                    break
+        offset = limit = None
+        # OFFSET/LIMIT no son palabras reservadas aquí: c.limit sigue siendo un campo
+        if self._accept_word("OFFSET"):
+            offset = self._count_operand()
+            if not self._accept_word("LIMIT"):
+                raise CosmosHttpResponseError(status_code=400, message="OFFSET requiere LIMIT")
+            limit = self._count_operand()
+        self.take("eof")
+        return CompiledQuery(top=top, where=where, order_by=order_by, projection=projection, count=count,
+                             offset=offset, limit=limit)
+
+    def _accept_word(self, word):
+        kind, value = self.tokens[self.pos]
+        if kind == "ident" and value.upper() == word:
+            self.pos += 1
+            return True
+        return False
+
+    def _count_operand(self):
+        """Entero literal o @parámetro (OFFSET/LIMIT)."""
+        kind, value = self.tokens[self.pos]
+        if kind == "number" and isinstance(value, int) and value >= 0:
+            self.take()
+            return lambda params, v=value: v
+        if kind == "param":
+            self.take()
+            return lambda params, name=value: params.get(name)
+        raise CosmosHttpResponseError(status_code=400, message=f"OFFSET/LIMIT requiere un entero, no {value!r}")
+
+    def _select_list(self):
+        """c.a, c.b.c [AS x], ...: cada propiedad sale con el nombre de su último segmento o del alias."""
+        items = []
+        while True:
+            root = self.take("ident")[1]
+            segments = []
+            while True:
+                if self.accept("op", "."):
+                    segments.append(self.take("ident")[1])
+                elif self.accept("op", "["):
+                    segments.append(self.take("string")[1])
+                    self.take("op", "]")
+                else:
+                    break
+            if not segments:
+                raise CosmosHttpResponseError(status_code=400, message="Proyección no soportada: use c.campo")
+            name = self.take("ident")[1] if self.accept("kw", "AS") else segments[-1]
+            items.append((root, tuple(segments), name))
+            if not self.accept("op", ","):
+                return items
+
+    def parse_or(self):
+        left = self.parse_and()
+        while self.accept("kw", "OR"):
+            right = self.parse_and()
+            left = self._or(left, right)
+        return left
+
+    def parse_and(self):
+        left = self.parse_not()
+        while self.accept("kw", "AND"):
+            right = self.parse_not()
+            left = self._and(left, right)
+        return left
+
+    def parse_not(self):
+        if self.accept("kw", "NOT"):
+            inner = self.parse_not()
+            def not_(doc, params):
+                v = inner(doc, params)
+                return (not v) if isinstance(v, bool) else UNDEFINED
+            return not_
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        left = self.parse_operand()
+        if self.peek("op") and self.tokens[self.pos][1] in ("=", "!=", "<>", "<", ">", "<=", ">="):
+            op = self.take("op")[1]
+            right = self.parse_operand()
+            return lambda doc, params: _compare(op, left(doc, params), right(doc, params))
+        negate = False
+        if self.peek("kw", "NOT") and self.tokens[self.pos + 1] == ("kw", "IN"):
+            self.take("kw", "NOT")
+            negate = True
+        if self.accept("kw", "IN"):
+            self.take("op", "(")
+            options = [self.parse_operand()]
+            while self.accept("op", ","):
+                options.append(self.parse_operand())
+            self.take("op", ")")
+            def in_(doc, params):
+                v = left(doc, params)
+                if v is UNDEFINED:
+                    return UNDEFINED
+                found = any(_compare("=", v, o(doc, params)) is True for o in options)
+                return (not found) if negate else found
+            return in_
+        return left
+
+    def parse_operand(self):
+        kind, value = self.tokens[self.pos]
+        if kind == "op" and value == "(":
+            self.take()
+            inner = self.parse_or()
+            self.take("op", ")")
+            return inner
+        if kind in ("string", "number"):
+            self.take()
+            return lambda doc, params, v=value: v
+        if kind == "kw" and value in ("TRUE", "FALSE", "NULL"):
+            self.take()
+            literal = {"TRUE": True, "FALSE": False, "NULL": None}[value]
+            return lambda doc, params: literal
+        if kind == "param":
+            self.take()
+            return lambda doc, params, name=value: params.get(name, UNDEFINED)
+        if kind == "ident":
+            self.take()
+            if self.peek("op", "("):
+                return self._function(value)
+            if value != self.alias:
+                raise CosmosHttpResponseError(status_code=400, message=f"Identificador desconocido: {value}")
+            return self._path()
+        raise CosmosHttpResponseError(status_code=400, message=f"Token inesperado {value!r}")
+
+    def _function(self, name):
+        fn = _FUNCTIONS.get(name.upper())
+        if fn is None:
+            raise CosmosHttpResponseError(status_code=400, message=f"Función no soportada: {name}")
+        self.take("op", "(")
+        args = []
+        if not self.peek("op", ")"):
+            args.append(self.parse_or())
+            while self.accept("op", ","):
+                args.append(self.parse_or())
+        self.take("op", ")")
+        return lambda doc, params: fn(*[a(doc, params) for a in args])
+
+    def _path(self):
+        segments = []
+        while True:
+            if self.accept("op", "."):
+                segments.append(self.take("ident")[1])
+            elif self.accept("op", "["):
+                kind, value = self.take()
+                if kind not in ("string", "number"):
+                    raise CosmosHttpResponseError(status_code=400, message="Índice de propiedad inválido")
+                self.take("op", "]")
+                segments.append(value)
+            else:
+                break
+        segments = tuple(segments)
+        return lambda doc, params: resolve_path(doc, segments)
+
+    @staticmethod
+    def _and(left, right):
+        def and_(doc, params):
+            a = left(doc, params)
+            if a is False:
+                return False
+            b = right(doc, params)
+            if b is False:
+                return False
+            if a is True and b is True:
+                return True
+            return UNDEFINED
+        return and_
+
+    @staticmethod
+    def _or(left, right):
+        def or_(doc, params):
+            a = left(doc, params)
+            if a is True:
+                return True
+            b = right(doc, params)
+            if b is True:
+                return True
+            if a is False and b is False:
+                return False
+            return UNDEFINED
+        return or_
+
+
+def resolve_path(doc, segments):
+    """Resuelve c.a.b / c["a"][0] sobre un documento; UNDEFINED si no existe."""
+    value = doc
+    for seg in segments:
+        if isinstance(value, dict) and isinstance(seg, str) and seg in value:
+            value = value[seg]
+        elif isinstance(value, list) and isinstance(seg, int) and 0 <= seg < len(value):
+            value = value[seg]
+        else:
+            return UNDEFINED
+    return value
+
+
+class _SortKey:
+    """Clave de orden con el orden de tipos de Cosmos."""
+    __slots__ = ("rank", "value")
+
+    def __init__(self, value):
+        self.rank = _type_rank(value)
+        self.value = value if self.rank in (2, 3, 4) else None
+
+    def __lt__(self, other):
+        if self.rank != other.rank:
+            return self.rank < other.rank
+        if self.value is None:
+            return False
+        return self.value < other.value
+
+
+class CompiledQuery:
+    """Query compilada: filtro, orden y TOP aplicables a una secuencia de documentos."""
+
+    def __init__(self, top=None, where=None, order_by=None, projection=None, count=False, offset=None, limit=None):
+        self.top = top
+        self.where = where
+        self.order_by = order_by or []
+        self.projection = projection  # [(nombre de salida, segmentos)] o None para SELECT *
+        self.count = count
+        self.offset = offset  # params -> int (OFFSET n LIMIT m)
+        self.limit = limit
+
+    def execute(self, documents: Iterable[dict], parameters: Optional[list] = None) -> List[dict]:
+        params = {p["name"]: p["value"] for p in (parameters or [])}
+        if self.where is not None:
+            rows = [d for d in documents if self.where(d, params) is True]
+        else:
+            rows = list(documents)
+        if self.count:
+            return [len(rows)]
+        # Ordenamiento estable: aplicar las claves de la última a la primera
+        for expr, descending in reversed(self.order_by):
+            rows.sort(key=lambda d: _SortKey(expr(d, params)), reverse=descending)
+        if self.top is not None:
+            rows = rows[:self.top]
+        if self.offset is not None:
+            offset, limit = self.offset(params), self.limit(params)
+            if not all(isinstance(v, int) and not isinstance(v, bool) and v >= 0 for v in (offset, limit)):
+                raise CosmosHttpResponseError(status_code=400, message="OFFSET y LIMIT deben ser enteros no negativos")
+            rows = rows[offset:offset + limit]
+        if self.projection is not None:
+            # Como en Cosmos, las propiedades inexistentes (undefined) se omiten
+            return [
+                {name: deepcopy(value) for name, segments in self.projection
+                 for value in (resolve_path(d, segments),) if value is not UNDEFINED}
+                for d in rows
+            ]
+        return [deepcopy(d) for d in rows]
+
+
+class LocalItemPaged(list):
+    """
+    Resultados de una query local. Se comporta como lista y, como el ItemPaged
+    del SDK, by_page(continuation_token) los entrega en páginas de
+    max_item_count con un continuation token opaco.
+    """
+
+    def __init__(self, items, page_size=None):
+        super().__init__(items)
+        self.page_size = page_size
+
+    def by_page(self, continuation_token=None):
+        return LocalPageIterator(self, self.page_size, continuation_token)
+
+
+def _encode_continuation(offset: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"offset": offset}).encode()).decode()
+
+
+def _decode_continuation(token: Optional[str]) -> int:
+    if not token:
+        return 0
+    try:
+        offset = json.loads(base64.urlsafe_b64decode(token.encode()))["offset"]
+        if not isinstance(offset, int) or offset < 0:
+            raise ValueError(offset)
+        return offset
+    except Exception:
+        raise CosmosHttpResponseError(status_code=400, message="Continuation token inválido")
+
+
+class LocalPageIterator:
+    """Iterador de páginas (sync y async) con el atributo continuation_token del SDK."""
+
+    def __init__(self, items: list, page_size: Optional[int], continuation_token: Optional[str]):
+        self._items = items
+        self._size = page_size or max(len(items), 1)
+        self._offset = _decode_continuation(continuation_token)
+        self._done = False
+        self.continuation_token = continuation_token
+
+    def _next_page(self) -> list:
+        if self._done:
+            return None
+        page = self._items[self._offset:self._offset + self._size]
+        self._offset += self._size
+        if self._offset >= len(self._items):
+            self._done = True
+            self.continuation_token = None
+        else:
+            self.continuation_token = _encode_continuation(self._offset)
+        return page
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        page = self._next_page()
+        if page is None:
+            raise StopIteration
+        return iter(page)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        page = self._next_page()
+        if page is None:
+            raise StopAsyncIteration
+        return _AsyncItemIterator(page)
+
+
+def _encode_feed_continuation(lsn: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"lsn": lsn}).encode()).decode()
+
+
+def _decode_feed_continuation(token: str) -> int:
+    try:
+        lsn = json.loads(base64.urlsafe_b64decode(token.encode()))["lsn"]
+        if not isinstance(lsn, int):
+            raise ValueError(lsn)
+        return lsn
+    except Exception:
+        raise CosmosHttpResponseError(status_code=400, message="Continuation token de change feed inválido")
+
+
+def _feed_start(kwargs: dict, current_lsn: int):
+    """
+    Punto de partida de una lectura del change feed: (último _lsn ya visto,
+    _ts mínimo). Como en el SDK, la continuation manda sobre start_time y sin
+    ninguno de los dos se arranca en "Now".
+    """
+    if kwargs.get("continuation"):
+        return _decode_feed_continuation(kwargs["continuation"]), None
+    start_time = kwargs.get("start_time") or "Now"
+    if isinstance(start_time, datetime):
+        return -1, start_time.timestamp()
+    if start_time == "Beginning":
+        return -1, None
+    if start_time == "Now":
+        return current_lsn, None
+    raise CosmosHttpResponseError(status_code=400, message=f"start_time no soportado: {start_time}")
+
+
+class LocalChangeFeed:
+    """
+    Resultado de query_items_change_feed local. Iterarlo recorre todos los
+    cambios pendientes; by_page() entrega páginas de max_item_count y deja en
+    continuation_token el punto desde el que seguir (igual que el SDK, la
+    iteración termina cuando no hay cambios nuevos).
+    """
+
+    def __init__(self, fetch: Callable[[int, int, Optional[float]], List[dict]],
+                 after: int, since_ts: Optional[float], page_size: Optional[int]):
+        self._fetch = fetch
+        self._after = after
+        self._since_ts = since_ts
+        self._size = page_size or 100
+
+    def by_page(self, continuation_token=None):
+        after = _decode_feed_continuation(continuation_token) if continuation_token else self._after
+        return LocalChangeFeedPages(self._fetch, after, self._since_ts, self._size)
+
+    def __iter__(self):
+        for page in self.by_page():
+            yield from page
+
+
+class LocalChangeFeedPages:
+    """Iterador de páginas del change feed local (sync y async)."""
+
+    def __init__(self, fetch, after: int, since_ts: Optional[float], page_size: int):
+        self._fetch = fetch
+        self._after = after
+        self._since_ts = since_ts
+        self._size = page_size
+        self._done = False
+        self.continuation_token = _encode_feed_continuation(after)
+
+    def _next_page(self) -> Optional[list]:
+        if self._done:
+            return None
+        page = self._fetch(self._after, self._size, self._since_ts)
+        if page:
+            self._after = page[-1].get("_lsn", 0)
+            self._since_ts = None
+            self.continuation_token = _encode_feed_continuation(self._after)
+        if len(page) < self._size:
+            self._done = True
+        return page or None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        page = self._next_page()
+        if page is None:
+            raise StopIteration
+        return iter(page)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        page = self._next_page()
+        if page is None:
+            raise StopAsyncIteration
+        return _AsyncItemIterator(page)
+
+
+@lru_cache(maxsize=256)
+def compile_query(sql: str) -> CompiledQuery:
+    """Compila (y cachea) una query del subconjunto SQL soportado."""
+    return _Parser(sql).parse_query()
+
+
+# ============================================
+# MOTORES DE ALMACENAMIENTO
+# ============================================
+
+def _pk_value(body: dict, partition_key_path: str):
+    segments = tuple(s for s in partition_key_path.split("/") if s)
+    value = resolve_path(body, segments)
+    return None if value is UNDEFINED else value
+
+
+def _stamp(body: dict) -> dict:
+    """Agrega las propiedades de sistema que main.py lee (_etag, _ts, _rid)."""
+    doc = deepcopy(body)
+    doc["_rid"] = doc.get("_rid") or uuid.uuid4().hex[:16]
+    doc["_etag"] = f'"{uuid.uuid4()}"'
+    doc["_ts"] = int(time.time())
+    return doc
+
+
+def _expired(doc: dict, now: Optional[float] = None) -> bool:
+    """TTL por documento (segundos desde _ts), como en Cosmos con default TTL -1."""
+    ttl = doc.get("ttl")
+    if isinstance(ttl, bool) or not isinstance(ttl, (int, float)) or ttl <= 0:
+        return False
+    return doc.get("_ts", 0) + ttl <= (now if now is not None else time.time())
+
+
+def _respond(kwargs: dict, operation: str, documents: List[dict], scanned: int = 0):
+    """
+    Invoca el response_hook (si lo hay) con headers al estilo de Cosmos. El cargo
+    es una estimación con el modelo de costos de Cosmos (1 RU por KB leído,
+    ~5.5 RU por KB escrito, ~2.3 RU base por query), útil para comparar rutas.
+    """
+    hook = kwargs.get("response_hook")
+    if hook is None:
+        return
+    kb = max(1.0, sum(len(json.dumps(d)) for d in documents) / 1024.0)
+    if operation == "read":
+        charge = kb
+    elif operation == "write":
+        charge = 5.5 * kb
+    else:
+        charge = 2.3 + 0.02 * scanned + 0.1 * kb
+    hook({
+        "x-ms-request-charge": f"{charge:.2f}",
+        "x-ms-item-count": str(len(documents)),
+        "x-ms-request-duration-ms": "0",
+    }, None)
+
+
+def _not_modified(doc: dict, kwargs: dict) -> bool:
+    """If-None-Match (etag + MatchConditions.IfModified) sobre el _etag actual."""
+    return (kwargs.get("match_condition") == MatchConditions.IfModified
+            and kwargs.get("etag") is not None and kwargs.get("etag") == doc.get("_etag"))
+
+
+def _check_precondition(existing: Optional[dict], item, kwargs: dict):
+    """Existencia (404) e If-Match (etag + MatchConditions.IfNotModified → 412)."""
+    if existing is None:
+        raise _not_found(item)
+    if (kwargs.get("match_condition") == MatchConditions.IfNotModified
+            and kwargs.get("etag") != existing.get("_etag")):
+        raise CosmosAccessConditionFailedError(status_code=412, message=f"Precondition failed: {item}")
+
+
+def _check_replace(existing: Optional[dict], item, body: dict, kwargs: dict):
+    """Validaciones de replace_item: existencia, id del cuerpo e If-Match."""
+    _check_precondition(existing, item, kwargs)
+    if body.get("id") != item:
+        raise CosmosHttpResponseError(status_code=400, message="The id in the body does not match the item id")
+
+
+def _bad_patch(message: str):
+    return CosmosHttpResponseError(status_code=400, message=f"Invalid patch operation: {message}")
+
+
+def _pointer(path: str) -> list:
+    """JSON pointer ("/a/b/0") a segmentos."""
+    if not isinstance(path, str) or not path.startswith("/") or path == "/":
+        raise _bad_patch(f"path inválido {path!r}")
+    return [seg.replace("~1", "/").replace("~0", "~") for seg in path[1:].split("/")]
+
+
+def _patch_parent(doc: dict, segments: list):
+    parent = doc
+    for seg in segments[:-1]:
+        if isinstance(parent, list) and seg.isdigit() and int(seg) < len(parent):
+            parent = parent[int(seg)]
+        elif isinstance(parent, dict) and seg in parent:
+            parent = parent[seg]
+        else:
+            raise _bad_patch(f"no existe el padre de /{'/'.join(segments)}")
+    return parent, segments[-1]
+
+
+def _patch_get(doc: dict, segments: list):
+    parent, leaf = _patch_parent(doc, segments)
+    if isinstance(parent, dict):
+        return parent.get(leaf, UNDEFINED)
+    if isinstance(parent, list) and leaf.isdigit() and int(leaf) < len(parent):
+        return parent[int(leaf)]
+    return UNDEFINED
+
+
+def _patch_put(doc: dict, segments: list, value, insert: bool):
+    parent, leaf = _patch_parent(doc, segments)
+    if isinstance(parent, dict):
+        parent[leaf] = value
+    elif isinstance(parent, list):
+        if leaf == "-":
+            parent.append(value)
+        elif leaf.isdigit() and int(leaf) <= len(parent):
+            if insert or int(leaf) == len(parent):
+                parent.insert(int(leaf), value)
+            else:
+                parent[int(leaf)] = value
+        else:
+            raise _bad_patch(f"índice fuera de rango en /{'/'.join(segments)}")
+    else:
+        raise _bad_patch(f"el padre de /{'/'.join(segments)} no es objeto ni arreglo")
+
+
+def _patch_remove(doc: dict, segments: list):
+    parent, leaf = _patch_parent(doc, segments)
+    if isinstance(parent, dict) and leaf in parent:
+        return parent.pop(leaf)
+    if isinstance(parent, list) and leaf.isdigit() and int(leaf) < len(parent):
+        return parent.pop(int(leaf))
+    raise _bad_patch(f"no existe /{'/'.join(segments)}")
+
+
+def _apply_patch(existing: dict, item, patch_operations: list, filter_predicate: Optional[str]) -> dict:
+    """
+    Aplica operaciones de patch de Cosmos (add, set, replace, remove, incr, move)
+    sobre una copia del documento. filter_predicate ("FROM c WHERE ...") se
+    evalúa antes con el intérprete de queries: si no se cumple, 412.
+    """
+    if filter_predicate and not compile_query(f"SELECT * {filter_predicate}").execute([existing]):
+        raise CosmosAccessConditionFailedError(status_code=412, message=f"Precondition failed: {item}")
+    doc = deepcopy(existing)
+    for operation in patch_operations:
+        op = str(operation.get("op", "")).lower()
+        segments = _pointer(operation.get("path"))
+        if op == "add":
+            _patch_put(doc, segments, deepcopy(operation.get("value")), insert=True)
+        elif op == "set":
+            _patch_put(doc, segments, deepcopy(operation.get("value")), insert=False)
+        elif op == "replace":
+            if _patch_get(doc, segments) is UNDEFINED:
+                raise _bad_patch(f"no existe {operation['path']}")
+            _patch_put(doc, segments, deepcopy(operation.get("value")), insert=False)
+        elif op == "remove":
+            _patch_remove(doc, segments)
+        elif op == "incr":
+            delta = operation.get("value")
+            current = _patch_get(doc, segments)
+            if isinstance(delta, bool) or not isinstance(delta, (int, float)):
+                raise _bad_patch("incr requiere un valor numérico")
+            if current is UNDEFINED:
+                current = 0
+            elif isinstance(current, bool) or not isinstance(current, (int, float)):
+                raise _bad_patch(f"{operation['path']} no es numérico")
+            _patch_put(doc, segments, current + delta, insert=False)
+        elif op == "move":
+            value = _patch_remove(doc, _pointer(operation.get("from")))
+            _patch_put(doc, segments, value, insert=False)
+        else:
+            raise _bad_patch(f"operación {op!r} no soportada")
+    if doc.get("id") != existing.get("id"):
+        raise _bad_patch("no se puede modificar el id")
+    return doc
+
+
+def _not_found(item_id):
+    return CosmosResourceNotFoundError(status_code=404, message=f"Entity with the specified id does not exist: {item_id}")
+
+
+def _conflict(item_id):
+    return CosmosResourceExistsError(status_code=409, message=f"Entity with the specified id already exists: {item_id}")
+
+
+def _batch_error(index: int, status: int, message: str, total: int):
+    """Error de batch como el del SDK: la operación fallida con su status, el resto 424."""
+    responses = [{"statusCode": 424} for _ in range(total)]
+    responses[index] = {"statusCode": status, "message": message}
+    return CosmosBatchOperationError(
+        error_index=index,
+        headers={},
+        status_code=status,
+        message=f"There was an error in the transactional batch on index {index}. {message}",
+        operation_responses=responses,
+    )
+
+
+def _run_batch(load: Callable[[str], Optional[dict]], batch_operations: list,
+               partition_key: Any, partition_key_path: str):
+    """
+    Evalúa un batch transaccional sobre un overlay de cambios sin tocar el
+    almacenamiento. Retorna (responses, staged) donde staged es {id: doc | None}
+    (None = borrado); si una operación falla lanza CosmosBatchOperationError y
+    nada se aplica (atomicidad por batch, igual que Cosmos).
+    """
+    staged: Dict[str, Optional[dict]] = {}
+    responses = []
+    total = len(batch_operations)
+
+    def current(item_id):
+        return staged[item_id] if item_id in staged else load(item_id)
+
+    for index, operation in enumerate(batch_operations):
+        op = operation[0].lower()
+        args = operation[1]
+        options = operation[2] if len(operation) > 2 else {}
+        if op in ("create", "upsert"):
+            item_id, body = args[0].get("id"), args[0]
+        elif op == "replace":
+            item_id, body = args[0], args[1]
+        elif op in ("read", "delete", "patch"):
+            item_id, body = args[0], None
+        else:
+            raise _batch_error(index, 400, f"Operación de batch no soportada: {operation[0]}", total)
+        if body is not None and _pk_value(body, partition_key_path) != partition_key:
+            raise _batch_error(index, 400, "La partition key del documento no coincide con la del batch", total)
+
+        existing = current(item_id)
+        if_match = options.get("if_match_etag")
+        if if_match is not None and (existing is None or existing.get("_etag") != if_match):
+            raise _batch_error(index, 412, f"Precondition failed: {item_id}", total)
+        if op == "create" and existing is not None:
+            raise _batch_error(index, 409, f"Entity with the specified id already exists: {item_id}", total)
+        if op in ("replace", "read", "delete", "patch") and existing is None:
+            raise _batch_error(index, 404, f"Entity with the specified id does not exist: {item_id}", total)
+
+        if op == "read":
+            responses.append({"statusCode": 200, "eTag": existing["_etag"], "resourceBody": deepcopy(existing)})
+        elif op == "delete":
+            staged[item_id] = None
+            responses.append({"statusCode": 204})
+        elif op == "patch":
+            try:
+                doc = _apply_patch(existing, item_id, args[1], options.get("filter_predicate"))
+            except CosmosHttpResponseError as e:
+                raise _batch_error(index, e.status_code, e.http_error_message, total)
+            doc = _stamp(doc)
+            staged[item_id] = doc
+            responses.append({"statusCode": 200, "eTag": doc["_etag"], "resourceBody": deepcopy(doc)})
+        else:
+            if body.get("id") != item_id:
+                raise _batch_error(index, 400, "El id del documento no coincide con el de la operación", total)
+            doc = _stamp(body)
+            staged[item_id] = doc
+            status = 201 if op == "create" or (op == "upsert" and existing is None) else 200
+            responses.append({"statusCode": status, "eTag": doc["_etag"], "resourceBody": deepcopy(doc)})
+    return responses, staged
+
+
+class MemoryContainer:
+    """Contenedor en memoria: documentos indexados por (partition key, id)."""
+
+    def __init__(self, name: str, partition_key_path: str = "/id"):
+        self.id = name
+        self.partition_key_path = partition_key_path
+        self._docs: Dict[tuple, dict] = {}
+        self._lock = threading.RLock()
+        self._lsn = 0
+
+    def _key(self, item_id, partition_key):
+        return (json.dumps(partition_key), item_id)
+
+    def _store(self, key, doc):
+        self._lsn += 1
+        doc["_lsn"] = self._lsn
+        self._docs[key] = doc
+
+    def read_item(self, item, partition_key, **kwargs):
+        with self._lock:
+            doc = self._docs.get(self._key(item, partition_key))
+            if doc is None or _expired(doc):
+                raise _not_found(item)
+            if _not_modified(doc, kwargs):
+                # 304: el SDK retorna sin cuerpo
+                _respond(kwargs, "read", [])
+                return {}
+            _respond(kwargs, "read", [doc])
+            return deepcopy(doc)
+
+    def create_item(self, body, **kwargs):
+        key = self._key(body["id"], _pk_value(body, self.partition_key_path))
+        with self._lock:
+            if key in self._docs:
+                raise _conflict(body["id"])
+            doc = _stamp(body)
+            self._store(key, doc)
+            _respond(kwargs, "write", [doc])
+            return deepcopy(doc)
+
+    def upsert_item(self, body, **kwargs):
+        key = self._key(body["id"], _pk_value(body, self.partition_key_path))
+        with self._lock:
+            doc = _stamp(body)
+            self._store(key, doc)
+            _respond(kwargs, "write", [doc])
+            return deepcopy(doc)
+
+    def replace_item(self, item, body, **kwargs):
+        key = self._key(item, _pk_value(body, self.partition_key_path))
+        with self._lock:
+            _check_replace(self._docs.get(key), item, body, kwargs)
+            doc = _stamp(body)
+            self._store(key, doc)
+            _respond(kwargs, "write", [doc])
+            return deepcopy(doc)
+
+    def patch_item(self, item, partition_key, patch_operations, filter_predicate=None, **kwargs):
+        key = self._key(item, partition_key)
+        with self._lock:
+            existing = self._docs.get(key)
+            _check_precondition(existing, item, kwargs)
+            doc = _apply_patch(existing, item, patch_operations, filter_predicate)
+            if _pk_value(doc, self.partition_key_path) != partition_key:
+                raise _bad_patch("no se puede modificar la partition key")
+            doc = _stamp(doc)
+            self._store(key, doc)
+            _respond(kwargs, "write", [doc])
+            return deepcopy(doc)
+
+    def query_items(self, query, parameters=None, partition_key=None, **kwargs):
+        compiled = compile_query(query)
+        with self._lock:
+            # Documentos con TTL vencido: se borran al encontrarlos
+            now = time.time()
+            for key in [k for k, d in self._docs.items() if _expired(d, now)]:
+                del self._docs[key]
+            if partition_key is not None:
+                pk = json.dumps(partition_key)
+                documents = [d for (p, _), d in self._docs.items() if p == pk]
+            else:
+                documents = list(self._docs.values())
+        results = compiled.execute(documents, parameters)
+        _respond(kwargs, "query", results, scanned=len(documents))
+        return LocalItemPaged(results, kwargs.get("max_item_count"))
+
+    def execute_item_batch(self, batch_operations, partition_key, **kwargs):
+        with self._lock:
+            responses, staged = _run_batch(
+                lambda item_id: self._docs.get(self._key(item_id, partition_key)),
+                batch_operations, partition_key, self.partition_key_path,
+            )
+            for item_id, doc in staged.items():
+                if doc is None:
+                    self._docs.pop(self._key(item_id, partition_key), None)
+                else:
+                    self._store(self._key(item_id, partition_key), doc)
+        _respond(kwargs, "write", [d for d in staged.values() if d is not None])
+        return responses
+
+    def query_items_change_feed(self, partition_key=None, max_item_count=None, **kwargs):
+        pk = json.dumps(partition_key) if partition_key is not None else None
+
+        def fetch(after, limit, since_ts):
+            with self._lock:
+                changed = [
+                    d for (p, _), d in self._docs.items()
+                    if d.get("_lsn", 0) > after and (pk is None or p == pk)
+                    and (since_ts is None or d.get("_ts", 0) >= since_ts)
+                ]
+            page = [deepcopy(d) for d in sorted(changed, key=lambda d: d.get("_lsn", 0))[:limit]]
+            _respond(kwargs, "read", page)
+            return page
+
+        with self._lock:
+            after, since_ts = _feed_start(kwargs, self._lsn)
+        return LocalChangeFeed(fetch, after, since_ts, max_item_count)
+
+
+class SQLiteContainer:
+    """
+    Contenedor respaldado por SQLite. Los documentos se guardan como JSON; el
+    filtrado por partition key se hace en SQL y el resto de la query con el
+    mismo intérprete que MemoryContainer (resultados idénticos entre motores).
+    """
+
+    def __init__(self, name: str, partition_key_path: str = "/id", path: str = STORAGE_SQLITE_PATH):
+        self.id = name
+        self.partition_key_path = partition_key_path
+        self._conn = _sqlite_connection(path)
+        self._lock = _sqlite_locks[path]
+
+    def read_item(self, item, partition_key, **kwargs):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body FROM documents WHERE container = ? AND pk = ? AND id = ?",
+                (self.id, json.dumps(partition_key), item),
+            ).fetchone()
+        doc = json.loads(row[0]) if row else None
+        if doc is None or _expired(doc):
+            raise _not_found(item)
+        if _not_modified(doc, kwargs):
+            _respond(kwargs, "read", [])
+            return {}
+        _respond(kwargs, "read", [doc])
+        return doc
+
+    def _next_lsn(self) -> int:
+        """Siguiente _lsn del contenedor (dentro de la transacción de la escritura)."""
+        self._conn.execute(
+            "INSERT INTO change_feed_lsn (container, lsn) VALUES (?, 1) "
+            "ON CONFLICT(container) DO UPDATE SET lsn = lsn + 1",
+            (self.id,),
+        )
+        return self._conn.execute("SELECT lsn FROM change_feed_lsn WHERE container = ?", (self.id,)).fetchone()[0]
+
+    def _write(self, body, replace, **kwargs):
+        doc = _stamp(body)
+        pk = json.dumps(_pk_value(body, self.partition_key_path))
+        verb = "INSERT OR REPLACE" if replace else "INSERT"
+        with self._lock:
+            try:
+                doc["_lsn"] = self._next_lsn()
+                self._conn.execute(
+                    f"{verb} INTO documents (container, pk, id, body, ts) VALUES (?, ?, ?, ?, ?)",
+                    (self.id, pk, doc["id"], json.dumps(doc), doc["_ts"]),
+                )
+                self._conn.commit()
+            except sqlite3.IntegrityError:
+                self._conn.rollback()
+                raise _conflict(doc["id"])
+        _respond(kwargs, "write", [doc])
+        return doc
+
+    def create_item(self, body, **kwargs):
+        return self._write(body, replace=False, **kwargs)
+
+    def upsert_item(self, body, **kwargs):
+        return self._write(body, replace=True, **kwargs)
+
+    def replace_item(self, item, body, **kwargs):
+        pk = json.dumps(_pk_value(body, self.partition_key_path))
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body FROM documents WHERE container = ? AND pk = ? AND id = ?",
+                (self.id, pk, item),
+            ).fetchone()
+            _check_replace(json.loads(row[0]) if row else None, item, body, kwargs)
+            return self._write(body, replace=True, **kwargs)
+
+    def patch_item(self, item, partition_key, patch_operations, filter_predicate=None, **kwargs):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body FROM documents WHERE container = ? AND pk = ? AND id = ?",
+                (self.id, json.dumps(partition_key), item),
+            ).fetchone()
+            existing = json.loads(row[0]) if row else None
+            _check_precondition(existing, item, kwargs)
+            doc = _apply_patch(existing, item, patch_operations, filter_predicate)
+            if _pk_value(doc, self.partition_key_path) != partition_key:
+                raise _bad_patch("no se puede modificar la partition key")
+            return self._write(doc, replace=True, **kwargs)
+
+    def query_items(self, query, parameters=None, partition_key=None, **kwargs):
+        compiled = compile_query(query)
+        sql = "SELECT body FROM documents WHERE container = ?"
+        args = [self.id]
+        if partition_key is not None:
+            sql += " AND pk = ?"
+            args.append(json.dumps(partition_key))
+        with self._lock:
+            rows = self._conn.execute(sql + " ORDER BY rowid", args).fetchall()
+        now = time.time()
+        documents = (d for d in (json.loads(r[0]) for r in rows) if not _expired(d, now))
+        results = compiled.execute(documents, parameters)
+        _respond(kwargs, "query", results, scanned=len(rows))
+        return LocalItemPaged(results, kwargs.get("max_item_count"))
+
+    def execute_item_batch(self, batch_operations, partition_key, **kwargs):
+        pk = json.dumps(partition_key)
+
+        def load(item_id):
+            row = self._conn.execute(
+                "SELECT body FROM documents WHERE container = ? AND pk = ? AND id = ?",
+                (self.id, pk, item_id),
+            ).fetchone()
+            return json.loads(row[0]) if row else None
+
+        with self._lock:
+            responses, staged = _run_batch(load, batch_operations, partition_key, self.partition_key_path)
+            try:
+                for item_id, doc in staged.items():
+                    if doc is None:
+                        self._conn.execute(
+                            "DELETE FROM documents WHERE container = ? AND pk = ? AND id = ?",
+                            (self.id, pk, item_id),
+                        )
+                    else:
+                        doc["_lsn"] = self._next_lsn()
+                        self._conn.execute(
+                            "INSERT OR REPLACE INTO documents (container, pk, id, body, ts) VALUES (?, ?, ?, ?, ?)",
+                            (self.id, pk, item_id, json.dumps(doc), doc["_ts"]),
+                        )
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+        _respond(kwargs, "write", [d for d in staged.values() if d is not None])
+        return responses
+
+    def query_items_change_feed(self, partition_key=None, max_item_count=None, **kwargs):
+        # Documentos escritos antes de que existiera _lsn cuentan como _lsn 0
+        lsn = "COALESCE(json_extract(body, '$._lsn'), 0)"
+
+        def fetch(after, limit, since_ts):
+            sql = f"SELECT body FROM documents WHERE container = ? AND {lsn} > ?"
+            args = [self.id, after]
+            if partition_key is not None:
+                sql += " AND pk = ?"
+                args.append(json.dumps(partition_key))
+            if since_ts is not None:
+                sql += " AND ts >= ?"
+                args.append(since_ts)
+            with self._lock:
+                rows = self._conn.execute(f"{sql} ORDER BY {lsn} LIMIT ?", args + [limit]).fetchall()
+            page = [json.loads(r[0]) for r in rows]
+            _respond(kwargs, "read", page)
+            return page
+
+        with self._lock:
+            row = self._conn.execute("SELECT lsn FROM change_feed_lsn WHERE container = ?", (self.id,)).fetchone()
+        after, since_ts = _feed_start(kwargs, row[0] if row else 0)
+        return LocalChangeFeed(fetch, after, since_ts, max_item_count)
+
+
+_sqlite_connections: Dict[str, sqlite3.Connection] = {}
+_sqlite_locks: Dict[str, threading.RLock] = {}
+
+
+def _sqlite_connection(path: str) -> sqlite3.Connection:
+    if path not in _sqlite_connections:
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS documents (
+                   container TEXT NOT NULL,
+                   pk TEXT NOT NULL,
+                   id TEXT NOT NULL,
+                   body TEXT NOT NULL,
+                   ts INTEGER NOT NULL,
+                   PRIMARY KEY (container, pk, id)
+               )"""
+        )
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS change_feed_lsn (
+                   container TEXT PRIMARY KEY,
+                   lsn INTEGER NOT NULL
+               )"""
+        )
+        conn.commit()
+        _sqlite_connections[path] = conn
+        _sqlite_locks[path] = threading.RLock()
+    return _sqlite_connections[path]
+
+
+# ============================================
+# ADAPTADOR ASYNC
+# ============================================
+
+class _AsyncItemIterator:
+    """Iterable async sobre resultados ya calculados (imita CosmosAsyncItemPaged)."""
+
+    def __init__(self, items):
+        self._paged = items
+        self._items = iter(items)
+
+    def by_page(self, continuation_token=None):
+        return self._paged.by_page(continuation_token)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._items)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class AsyncLocalContainer:
+    """Expone un contenedor local con la interfaz del ContainerProxy de azure.cosmos.aio."""
+
+    def __init__(self, container):
+        self._container = container
+        self.id = container.id
+
+    async def read_item(self, item, partition_key, **kwargs):
+        return self._container.read_item(item, partition_key, **kwargs)
+
+    async def create_item(self, body, **kwargs):
+        return self._container.create_item(body, **kwargs)
+
+    async def upsert_item(self, body, **kwargs):
+        return self._container.upsert_item(body, **kwargs)
+
+    async def replace_item(self, item, body, **kwargs):
+        return self._container.replace_item(item, body, **kwargs)
+
+    async def patch_item(self, item, partition_key, patch_operations, **kwargs):
+        return self._container.patch_item(item, partition_key, patch_operations, **kwargs)
+
+    async def execute_item_batch(self, batch_operations, partition_key, **kwargs):
+        return self._container.execute_item_batch(batch_operations, partition_key, **kwargs)
+
+    def query_items(self, query, parameters=None, **kwargs):
+        return _AsyncItemIterator(self._container.query_items(query, parameters, **kwargs))
+
+    def query_items_change_feed(self, **kwargs):
+        return _AsyncItemIterator(self._container.query_items_change_feed(**kwargs))
+
+
+# ============================================
+# REGISTRO DE CONTENEDORES LOCALES
+# ============================================
+
+_local_lock = threading.Lock()
+_local_containers: Dict[str, Any] = {}
+
+
+def get_local_container(container_name: str, partition_key_path: str = "/id"):
+    """Retorna (creándolo la primera vez) el contenedor local del backend configurado."""
+    container = _local_containers.get(container_name)
+    if container is None:
+        with _local_lock:
+            container = _local_containers.get(container_name)
+            if container is None:
+                if STORAGE_BACKEND == "sqlite":
+                    container = SQLiteContainer(container_name, partition_key_path)
+                elif STORAGE_BACKEND == "memory":
+                    container = MemoryContainer(container_name, partition_key_path)
+                else:
+                    raise ValueError(f"STORAGE_BACKEND no soportado: {STORAGE_BACKEND}")
+                _local_containers[container_name] = container
+    return container
+
+
+def is_local_backend() -> bool:
+    """True si el backend configurado no es Azure Cosmos DB."""
+    return STORAGE_BACKEND != "cosmos"
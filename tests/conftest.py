@@ -0,0 +1,31 @@
+"""
+Configuración común de las pruebas: backend de almacenamiento en memoria
+(sin cuenta de Cosmos) y contenedores vacíos en cada prueba.
+
+Uso (desde la raíz del repo):
+    python -m pytest -q tests
+"""
+
+import os
+import sys
+import tempfile
+
+os.environ["STORAGE_BACKEND"] = "memory"
+os.environ.setdefault("COSMOS_CONTAINER_CARNETS", "carnets")
+os.environ.setdefault("COSMOS_CONTAINER_NOTAS", "notas")
+# Leases del change feed de main.py fuera del repo
+os.environ.setdefault("CHANGE_FEED_LEASE_FILE", os.path.join(tempfile.mkdtemp(), "change_feed_leases.json"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import storage_backends
+
+
+@pytest.fixture(autouse=True)
+def fresh_storage():
+    """Cada prueba empieza con los contenedores en memoria vacíos."""
+    storage_backends._local_containers.clear()
+    yield
+    storage_backends._local_containers.clear()
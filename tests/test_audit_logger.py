@@ -0,0 +1,126 @@
+import asyncio
+import json
+import multiprocessing
+import os
+
+import pytest
+
+from audit_logger import AuditLogger
+
+N_PROCESOS, N_ENTRADAS = 3, 200
+
+
+class _CosmosCaido:
+    async def create_item(self, item):
+        raise ConnectionError("Cosmos no disponible")
+
+
+def _escribir(spill_file, worker):
+    logger = AuditLogger(None, spill_file=spill_file)
+    for i in range(N_ENTRADAS):
+        logger._spill([{"id": f"audit:{worker}-{i}"}])
+
+
+@pytest.mark.skipif(not hasattr(__import__("os"), "fork"), reason="requiere fork (flock entre procesos)")
+def test_respaldo_compartido_no_pierde_entradas(tmp_path):
+    spill_file = str(tmp_path / "audit_spill.ndjson")
+    ctx = multiprocessing.get_context("fork")
+    workers = [ctx.Process(target=_escribir, args=(spill_file, w)) for w in range(N_PROCESOS)]
+    for w in workers:
+        w.start()
+    lector = AuditLogger(None, spill_file=spill_file)
+    ids = set()
+
+    def tomar():
+        entries, claimed = lector._take_spill()
+        ids.update(e["id"] for e in entries)
+        lector._remove_claimed(claimed)
+    # Reclamar el archivo mientras los otros procesos siguen agregando
+    while any(w.is_alive() for w in workers):
+        tomar()
+    for w in workers:
+        w.join()
+    tomar()
+    assert len(ids) == N_PROCESOS * N_ENTRADAS
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_fallas_van_al_respaldo_y_se_reintentan(tmp_path):
+    spill_file = str(tmp_path / "audit_spill.ndjson")
+    logger = AuditLogger(_CosmosCaido(), spill_file=spill_file)
+    escritas = []
+
+    class _Cosmos:
+        async def create_item(self, item):
+            escritas.append(item["id"])
+
+    async def run():
+        failed = await logger._flush([{"id": "audit:1"}, {"id": "audit:2"}])
+        assert len(failed) == 2
+        logger.helper = _Cosmos()
+        return await logger.replay_spill()
+    assert asyncio.run(run()) == 2
+    assert escritas == ["audit:1", "audit:2"]
+    assert logger.stats()["spilled"] == 2 and logger.stats()["replayed"] == 2
+
+
+class _CosmosOk:
+    def __init__(self):
+        self.escritas = []
+
+    async def create_item(self, item):
+        self.escritas.append(item["id"])
+
+
+def _replay_file(spill_file, pid, ids):
+    path = f"{spill_file}.{pid}.x.replay"
+    with open(path, "w", encoding="utf-8") as f:
+        f.writelines(json.dumps({"id": i}) + "\n" for i in ids)
+    return path
+
+
+def test_reclamado_se_conserva_hasta_escribir(tmp_path):
+    spill_file = str(tmp_path / "audit_spill.ndjson")
+    logger = AuditLogger(_CosmosOk(), spill_file=spill_file)
+    logger._spill([{"id": "audit:1"}, {"id": "audit:2"}])
+
+    async def corte(batch, spill=True):
+        # El proceso se corta a mitad de la escritura
+        raise RuntimeError("corte")
+    real_flush, logger._flush = logger._flush, corte
+    with pytest.raises(RuntimeError):
+        asyncio.run(logger.replay_spill())
+    assert [p.name.endswith(".replay") for p in tmp_path.iterdir()] == [True]
+
+    # El siguiente intento del mismo proceso adopta el reclamado
+    logger._flush = real_flush
+    assert asyncio.run(logger.replay_spill()) == 2
+    assert logger.helper.escritas == ["audit:1", "audit:2"]
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_fallas_del_reintento_vuelven_al_respaldo(tmp_path):
+    spill_file = str(tmp_path / "audit_spill.ndjson")
+    logger = AuditLogger(_CosmosCaido(), spill_file=spill_file)
+    logger._spill([{"id": "audit:1"}, {"id": "audit:2"}])
+    assert asyncio.run(logger.replay_spill()) == 0
+    # El reclamado se borró solo porque las entradas volvieron al archivo de respaldo
+    assert [p.name for p in tmp_path.iterdir()] == ["audit_spill.ndjson"]
+    entries, claimed = logger._take_spill()
+    assert sorted(e["id"] for e in entries) == ["audit:1", "audit:2"]
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requiere PIDs de procesos terminados")
+def test_solo_adopta_reclamados_de_procesos_muertos(tmp_path):
+    spill_file = str(tmp_path / "audit_spill.ndjson")
+    muerto = multiprocessing.get_context("fork").Process(target=int)
+    muerto.start()
+    muerto.join()
+    vivo = _replay_file(spill_file, os.getppid(), ["audit:vivo"])
+    _replay_file(spill_file, muerto.pid, ["audit:huerfano"])
+
+    logger = AuditLogger(_CosmosOk(), spill_file=spill_file)
+    assert asyncio.run(logger.replay_spill()) == 1
+    assert logger.helper.escritas == ["audit:huerfano"]
+    # El reclamado de un proceso vivo (su replay sigue en curso) no se toca
+    assert [str(p) for p in tmp_path.iterdir()] == [vivo]
@@ -0,0 +1,169 @@
+import asyncio
+from datetime import date
+
+import pytest
+
+import audit_retention
+from audit_retention import (
+    INDEX_NAME,
+    AuditArchive,
+    LocalArchiveStore,
+    build_rollup,
+    retain_day,
+    run_retention,
+    run_retention_once,
+)
+from audit_store import AUDIT_PARTITION_KEY, audit_day
+from change_feed import MemoryLeaseStore
+from cosmos_helper import AsyncCosmosDBHelper
+
+DIAS = ("2026-01-10", "2026-01-11", "2026-03-01")
+
+
+def _entry(dia, i, usuario="ana", accion="LOGIN"):
+    timestamp = f"{dia}T10:00:{i:02d}"
+    return {"id": f"audit:{dia}-{i}", "dia": audit_day(timestamp), "timestamp": timestamp,
+            "usuario": usuario, "accion": accion, "campus": "rectoria"}
+
+
+def _seed(helper, entries):
+    asyncio.run(helper.execute_batch([("upsert", (e,)) for e in entries]))
+
+
+@pytest.fixture
+def auditoria():
+    helper = AsyncCosmosDBHelper("auditoria_dia", AUDIT_PARTITION_KEY)
+    _seed(helper, [_entry(dia, i, usuario="luis" if i % 2 else "ana") for dia in DIAS for i in range(3)])
+    return helper
+
+
+@pytest.fixture
+def archive(tmp_path):
+    return AuditArchive(LocalArchiveStore(str(tmp_path), durable=True), index_ttl=0)
+
+
+async def _query_day(helper, dia):
+    return await helper.query_items("SELECT * FROM c WHERE c.dia = @dia ORDER BY c.id",
+                                    [{"name": "@dia", "value": dia}], partition_key=dia)
+
+
+def _day(helper, dia):
+    return asyncio.run(_query_day(helper, dia))
+
+
+def test_build_rollup():
+    rollup = build_rollup("2026-01-10", [_entry("2026-01-10", 0), _entry("2026-01-10", 1, accion="LOGOUT"),
+                                         {"id": "x", "usuario": None}])
+    assert rollup["id"] == "rollup:2026-01-10" and rollup["total"] == 3
+    assert rollup["porUsuario"] == {"ana": 2, "desconocido": 1}
+    assert rollup["porAccion"] == {"LOGIN": 1, "LOGOUT": 1, "desconocida": 1}
+    assert rollup["porCampus"] == {"rectoria": 2, "Sin campus": 1}
+
+
+def test_retain_day_archiva_antes_de_asignar_ttl(auditoria, archive):
+    real_add = archive.add_segment
+    sin_ttl_al_archivar = []
+
+    async def add_segment(dia, entries):
+        crudas = [e for e in await _query_day(auditoria, dia) if e["id"].startswith("audit:")]
+        sin_ttl_al_archivar.append(len(crudas) == 3 and all("ttl" not in e for e in crudas))
+        return await real_add(dia, entries)
+    archive.add_segment = add_segment
+
+    report = asyncio.run(retain_day(auditoria, archive, "2026-01-10"))
+    assert report["archivadas"] == 3 and report["expiradas"] == 3
+    assert sin_ttl_al_archivar == [True]
+    docs = {d["id"]: d for d in _day(auditoria, "2026-01-10")}
+    assert all("ttl" in docs[f"audit:2026-01-10-{i}"] for i in range(3))
+    assert docs["rollup:2026-01-10"]["total"] == 3 and "ttl" not in docs["rollup:2026-01-10"]
+    archivadas = asyncio.run(archive.read_day("2026-01-10"))
+    assert [e["id"] for e in archivadas] == [f"audit:2026-01-10-{i}" for i in (2, 1, 0)]
+    assert not any(k.startswith("_") or k == "ttl" for e in archivadas for k in e)
+
+
+def test_sin_ttl_si_falla_el_archivo(auditoria, archive):
+    async def falla(dia, entries):
+        raise OSError("disco lleno")
+    archive.add_segment = falla
+    with pytest.raises(OSError):
+        asyncio.run(retain_day(auditoria, archive, "2026-01-10"))
+    assert not any("ttl" in d for d in _day(auditoria, "2026-01-10"))
+
+
+def test_retain_day_repetido_no_duplica(auditoria, archive, monkeypatch):
+    # Primera corrida cortada después de archivar, antes de asignar ttl
+    async def corte(helper, dia, ids):
+        raise RuntimeError("corte")
+    monkeypatch.setattr(audit_retention, "_expire", corte)
+    with pytest.raises(RuntimeError):
+        asyncio.run(retain_day(auditoria, archive, "2026-01-10"))
+    monkeypatch.undo()
+
+    report = asyncio.run(retain_day(auditoria, archive, "2026-01-10"))
+    assert report["archivadas"] == 0 and report["expiradas"] == 3
+
+    # Una entrada tardía va a un segmento nuevo del mismo día
+    _seed(auditoria, [_entry("2026-01-10", 9)])
+    report = asyncio.run(retain_day(auditoria, archive, "2026-01-10"))
+    assert report["archivadas"] == 1
+    day = asyncio.run(archive.index())["dias"]["2026-01-10"]
+    assert day["total"] == 4 and len({s["archivo"] for s in day["segmentos"]}) == 2
+    assert len(asyncio.run(archive.read_day("2026-01-10"))) == 4
+    rollup = next(d for d in _day(auditoria, "2026-01-10") if d["id"] == "rollup:2026-01-10")
+    assert rollup["total"] == 4
+
+
+def test_archivo_no_durable_no_expira(auditoria, tmp_path):
+    archive = AuditArchive(LocalArchiveStore(str(tmp_path), durable=False), index_ttl=0)
+    with pytest.raises(RuntimeError, match="no es durable"):
+        asyncio.run(retain_day(auditoria, archive, "2026-01-10"))
+    assert not any("ttl" in d for d in _day(auditoria, "2026-01-10"))
+    assert asyncio.run(archive.index())["dias"] == {}
+    # Un dry run no escribe y sí se permite
+    assert asyncio.run(retain_day(auditoria, archive, "2026-01-10", dry_run=True))["pendientes"] == 3
+
+
+def test_run_retention_respeta_el_corte(auditoria, archive):
+    reports = asyncio.run(run_retention(auditoria, archive, retention_days=30, today=date(2026, 3, 2)))
+    assert [r["dia"] for r in reports] == ["2026-01-10", "2026-01-11"]
+    assert asyncio.run(archive.has_day("2026-01-11")) and not asyncio.run(archive.has_day("2026-03-01"))
+    assert asyncio.run(run_retention(auditoria, archive, retention_days=30, today=date(2026, 3, 2))) == []
+
+
+def test_run_retention_once_un_solo_dueno(auditoria, archive):
+    leases = MemoryLeaseStore()
+    primero = asyncio.run(run_retention_once(auditoria, archive, leases, owner="a", lease_seconds=60))
+    assert len(primero) == 3
+    assert asyncio.run(run_retention_once(auditoria, archive, leases, owner="b", lease_seconds=60)) is None
+    assert asyncio.run(run_retention_once(auditoria, archive, leases, owner="a", lease_seconds=60)) == []
+
+
+def test_count_day(auditoria, archive):
+    asyncio.run(retain_day(auditoria, archive, "2026-01-10"))
+    # Día completo dentro de la ventana: total del índice
+    assert asyncio.run(archive.count_day("2026-01-10", "2026-01-09T00:00:00", "2026-01-11T00:00:00")) == 3
+    # Ventana parcial: se leen las entradas
+    assert asyncio.run(archive.count_day("2026-01-10", "2026-01-10T10:00:01", "2026-01-10T23:59:59")) == 2
+    assert asyncio.run(archive.count_day("2026-01-11", "2026-01-01T00:00:00", "2026-02-01T00:00:00")) == 0
+
+
+def test_indice_condicional_entre_escritores(tmp_path):
+    uno = AuditArchive(LocalArchiveStore(str(tmp_path), durable=True), index_ttl=0)
+    otro = AuditArchive(LocalArchiveStore(str(tmp_path), durable=True), index_ttl=0)
+    a = uno._add_segment("2026-01-10", [_entry("2026-01-10", 0)])
+    b = otro._add_segment("2026-01-10", [_entry("2026-01-10", 1)])
+    assert a["archivo"] != b["archivo"]
+    day = asyncio.run(uno.index())["dias"]["2026-01-10"]
+    assert [s["archivo"] for s in day["segmentos"]] == [a["archivo"], b["archivo"]] and day["total"] == 2
+
+    store = uno.store
+    data, etag = store.read_versioned(INDEX_NAME)
+    assert store.write_if_match(INDEX_NAME, data, etag)
+    assert not store.write_if_match(INDEX_NAME, b"{}", "etag-viejo")
+    assert not store.write_if_match(INDEX_NAME, b"{}", None)
+
+
+def test_lectura_descarta_ids_repetidos(archive):
+    archive._add_segment("2026-01-10", [_entry("2026-01-10", 0)])
+    archive._add_segment("2026-01-10", [_entry("2026-01-10", 1), _entry("2026-01-10", 0)])
+    assert [e["id"] for e in asyncio.run(archive.read_day("2026-01-10"))] == ["audit:2026-01-10-1", "audit:2026-01-10-0"]
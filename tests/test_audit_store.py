@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from audit_store import (
+    AUDIT_PARTITION_KEY,
+    audit_day,
+    count_audit,
+    decode_cursor,
+    encode_cursor,
+    iter_audit,
+    query_audit_page,
+)
+from cosmos_helper import AsyncCosmosDBHelper
+
+DESDE, HASTA = "2026-03-01T00:00:00", "2026-03-03T23:59:59.999999"
+
+
+@pytest.fixture
+def auditoria():
+    helper = AsyncCosmosDBHelper("auditoria_dia", AUDIT_PARTITION_KEY)
+    entries = []
+    for dia in ("2026-03-01", "2026-03-02", "2026-03-03"):
+        for i in range(4):
+            # Dos entradas por timestamp: el id desempata el orden
+            timestamp = f"{dia}T10:00:0{i // 2}"
+            entries.append({"id": f"audit:{dia}-{i}", "dia": audit_day(timestamp), "timestamp": timestamp,
+                            "usuario": "ana" if i % 2 else "luis", "accion": "LOGIN"})
+
+    async def seed():
+        await helper.execute_batch([("upsert", (e,)) for e in entries])
+    asyncio.run(seed())
+    return helper
+
+
+def _collect(helper, **kwargs):
+    async def run():
+        return [e async for e in iter_audit(helper, DESDE, HASTA, **kwargs)]
+    return asyncio.run(run())
+
+
+def _key(e):
+    return e["timestamp"], e["id"]
+
+
+def test_orden_descendente_entre_dias(auditoria):
+    entries = _collect(auditoria, page_size=3)
+    assert len(entries) == 12
+    assert [_key(e) for e in entries] == sorted((_key(e) for e in entries), reverse=True)
+
+
+def test_cursor_reanuda_sin_repetir_ni_saltar(auditoria):
+    todas = _collect(auditoria)
+    for corte in (1, 3, 4, 7, 11):
+        resto = _collect(auditoria, cursor=encode_cursor(todas[corte - 1]), page_size=2)
+        assert [e["id"] for e in resto] == [e["id"] for e in todas[corte:]]
+
+
+def test_cursor_codifica_timestamp_e_id():
+    entry = {"timestamp": "2026-03-01T10:00:00", "id": "audit:x"}
+    assert decode_cursor(encode_cursor(entry)) == ("2026-03-01T10:00:00", "audit:x")
+
+
+def test_paginas_con_filtro(auditoria):
+    async def pages():
+        result, cursor = [], None
+        while True:
+            page, cursor = await query_audit_page(auditoria, DESDE, HASTA, 4, usuario="ana", cursor=cursor)
+            result.append([e["id"] for e in page])
+            if cursor is None:
+                return result
+    result = asyncio.run(pages())
+    assert [len(p) for p in result] == [4, 2]
+    ids = [i for p in result for i in p]
+    assert len(set(ids)) == 6 and all(i.endswith(("-1", "-3")) for i in ids)
+
+
+def test_count(auditoria):
+    assert asyncio.run(count_audit(auditoria, DESDE, HASTA)) == 12
+    assert asyncio.run(count_audit(auditoria, "2026-03-02T00:00:00", "2026-03-02T10:00:00")) == 2
@@ -0,0 +1,87 @@
+from datetime import timedelta
+
+import pytest
+from fastapi import HTTPException
+from jose import jwt
+
+import auth_service
+from auth_service import ALGORITHM, SECRET_KEY, AuthService
+from ttl_cache import TTLCache
+
+CLAIMS = {"sub": "ana", "rol": "medico", "campus": "cres-zumpango"}
+
+
+class _Reloj:
+    def __init__(self):
+        self.ahora = 0.0
+
+    def __call__(self):
+        return self.ahora
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = _Reloj()
+    monkeypatch.setattr(auth_service, "jwt_claims_cache", TTLCache(16, 8 * 3600, clock=reloj))
+    return reloj
+
+
+@pytest.fixture
+def decodificados(monkeypatch):
+    """Cuenta las verificaciones reales de firma (jwt.decode)."""
+    llamadas = []
+    real = auth_service.jwt.decode
+
+    def decode(*args, **kwargs):
+        llamadas.append(args[0])
+        return real(*args, **kwargs)
+    monkeypatch.setattr(auth_service.jwt, "decode", decode)
+    return llamadas
+
+
+def _token(expira=timedelta(hours=8), **claims):
+    return AuthService.create_access_token({**CLAIMS, **claims}, expires_delta=expira)
+
+
+def test_token_verificado_se_resuelve_desde_cache(reloj, decodificados):
+    token = _token()
+    primero = AuthService.decode_token(token)
+    assert (primero.username, primero.rol.value, primero.campus.value) == ("ana", "medico", "cres-zumpango")
+    assert AuthService.decode_token(token) is primero
+    assert len(decodificados) == 1
+    assert auth_service.jwt_claims_cache.stats()["hits"] == 1
+
+
+def test_ttl_del_cache_no_pasa_del_exp(reloj, decodificados):
+    token = _token(expira=timedelta(seconds=60))
+    AuthService.decode_token(token)
+    reloj.ahora = 55
+    AuthService.decode_token(token)
+    assert len(decodificados) == 1
+    # Pasado el exp la entrada venció aunque el TTL del caché sea de 8 horas
+    reloj.ahora = 61
+    AuthService.decode_token(token)
+    assert len(decodificados) == 2
+
+
+@pytest.mark.parametrize("token", [
+    pytest.param(lambda: _token() + "x", id="firma"),
+    pytest.param(lambda: jwt.encode({**CLAIMS, "exp": 1}, SECRET_KEY, algorithm=ALGORITHM), id="vencido"),
+    pytest.param(lambda: jwt.encode({**CLAIMS, "exp": 2**31}, "otra-clave", algorithm=ALGORITHM), id="otra-clave"),
+    pytest.param(lambda: _token(sub=None), id="sin-sub"),
+])
+def test_token_invalido_no_se_cachea(reloj, decodificados, token):
+    token = token()
+    for _ in range(2):
+        with pytest.raises(HTTPException) as exc:
+            AuthService.decode_token(token)
+        assert exc.value.status_code == 401
+    assert len(decodificados) == 2
+    assert len(auth_service.jwt_claims_cache) == 0
+
+
+def test_token_sin_exp_no_se_cachea(reloj, decodificados):
+    token = jwt.encode(CLAIMS, SECRET_KEY, algorithm=ALGORITHM)
+    AuthService.decode_token(token)
+    AuthService.decode_token(token)
+    assert len(decodificados) == 2 and len(auth_service.jwt_claims_cache) == 0
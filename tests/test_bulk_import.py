@@ -0,0 +1,39 @@
+import asyncio
+
+from bulk_import import LineTooLong, iter_lines
+
+
+async def _chunks(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+def _lines(*chunks, max_line_bytes=40):
+    async def collect():
+        return [item async for item in iter_lines(_chunks(*chunks), max_line_bytes=max_line_bytes)]
+    return asyncio.run(collect())
+
+
+def test_lineas_partidas_entre_chunks():
+    result = _lines(b'{"a": 1}\n{"b"', b': 2}\n\n{"c": 3}')
+    assert result == [(1, b'{"a": 1}'), (2, b'{"b": 2}'), (4, b'{"c": 3}')]
+
+
+def test_linea_larga_terminada():
+    result = _lines(b"A" * 50 + b'\n{"a": 1}\n')
+    assert [n for n, _ in result] == [1, 2]
+    assert isinstance(result[0][1], LineTooLong)
+
+
+def test_linea_larga_sin_terminar_no_desfasa_numeros():
+    # La línea larga se reporta antes de su \n; el \n no debe contarla otra vez
+    result = _lines(b"A" * 50, b"A" * 50 + b'\n{"a": 1}\n{"b": 2}\n')
+    assert [n for n, _ in result] == [1, 2, 3]
+    assert isinstance(result[0][1], LineTooLong)
+    assert result[1:] == [(2, b'{"a": 1}'), (3, b'{"b": 2}')]
+
+
+def test_linea_larga_al_final_sin_salto():
+    result = _lines(b'{"a": 1}\n', b"A" * 50)
+    assert [n for n, _ in result] == [1, 2]
+    assert isinstance(result[1][1], LineTooLong)
@@ -0,0 +1,89 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from auth_models import Campus, UserRole
+from auth_service import AuthService
+
+
+@pytest.fixture(scope="module")
+def client():
+    # Un solo lifespan (y event loop) para el módulo: audit_logger vive en él
+    with TestClient(main.app) as c:
+        token = AuthService.create_access_token(
+            {"sub": "medico1", "user_id": "user:medico1@rectoria",
+             "rol": UserRole.MEDICO.value, "campus": Campus.RECTORIA.value}
+        )
+        c.headers["Authorization"] = f"Bearer {token}"
+        yield c
+
+
+def _crear_carnet(client, matricula):
+    r = client.post("/carnet", json={"matricula": matricula, "nombreCompleto": "Alumno"})
+    assert r.status_code == 200, r.text
+    return r.json()["id"]
+
+
+def test_get_condicional_304(client):
+    carnet_id = _crear_carnet(client, "E304")
+    r = client.get(f"/carnet/{carnet_id}")
+    assert r.status_code == 200
+    etag = r.headers["ETag"]
+    r = client.get(f"/carnet/{carnet_id}", headers={"If-None-Match": etag})
+    assert r.status_code == 304 and r.content == b""
+    assert r.headers["ETag"] == etag
+    # ETag débil (W/) también coincide
+    assert client.get(f"/carnet/{carnet_id}", headers={"If-None-Match": f"W/{etag}"}).status_code == 304
+
+
+def test_get_despues_de_editar_es_200(client):
+    carnet_id = _crear_carnet(client, "E200")
+    etag = client.get(f"/carnet/{carnet_id}").headers["ETag"]
+    r = client.put(f"/carnet/{carnet_id}", json={"matricula": "E200", "nombreCompleto": "Otro"})
+    assert r.status_code == 200
+    r = client.get(f"/carnet/{carnet_id}", headers={"If-None-Match": etag})
+    assert r.status_code == 200 and r.json()["nombreCompleto"] == "Otro"
+    assert r.headers["ETag"] != etag
+
+
+def test_proyeccion_tiene_otro_etag(client):
+    carnet_id = _crear_carnet(client, "EPRJ")
+    completo = client.get(f"/carnet/{carnet_id}").headers["ETag"]
+    r = client.get(f"/carnet/{carnet_id}", params={"fields": "matricula"})
+    assert r.headers["ETag"] != completo
+    assert client.get(f"/carnet/{carnet_id}", params={"fields": "matricula"},
+                      headers={"If-None-Match": completo}).status_code == 200
+
+
+def test_put_if_match_412(client):
+    carnet_id = _crear_carnet(client, "E412")
+    etag = client.get(f"/carnet/{carnet_id}").headers["ETag"]
+    # Otro usuario edita primero
+    r = client.put(f"/carnet/{carnet_id}", json={"matricula": "E412", "nombreCompleto": "Primero"},
+                   headers={"If-Match": etag})
+    assert r.status_code == 200
+    nuevo = r.headers["ETag"]
+    r = client.put(f"/carnet/{carnet_id}", json={"matricula": "E412", "nombreCompleto": "Segundo"},
+                   headers={"If-Match": etag})
+    assert r.status_code == 412
+    assert client.get(f"/carnet/{carnet_id}").json()["nombreCompleto"] == "Primero"
+    r = client.put(f"/carnet/{carnet_id}", json={"matricula": "E412", "nombreCompleto": "Segundo"},
+                   headers={"If-Match": nuevo})
+    assert r.status_code == 200
+
+
+def test_put_no_existe_404(client):
+    r = client.put("/carnet/carnet:no-existe", json={"matricula": "X"})
+    assert r.status_code == 404
+
+
+def test_put_if_match_con_etag_de_proyeccion(client):
+    carnet_id = _crear_carnet(client, "EPUT")
+    r = client.get(f"/carnet/{carnet_id}", params={"fields": "matricula"})
+    proyeccion, documento = r.headers["ETag"], r.json()["_etag"]
+    assert proyeccion != documento
+    body = {"matricula": "EPUT", "nombreCompleto": "Editado"}
+    # El ETag de la proyección no es el del documento: If-Match nunca coincide
+    assert client.put(f"/carnet/{carnet_id}", json=body, headers={"If-Match": proyeccion}).status_code == 412
+    # El _etag que trae toda proyección sí sirve para el PUT condicional
+    assert client.put(f"/carnet/{carnet_id}", json=body, headers={"If-Match": documento}).status_code == 200
@@ -0,0 +1,173 @@
+import asyncio
+import time
+
+from change_feed import ChangeFeedProcessor, ContainerLeaseStore, FileLeaseStore, MemoryLeaseStore, ViewBuilder
+from cosmos_helper import AsyncCosmosDBHelper
+
+
+class Registro(ViewBuilder):
+    """Vista de prueba: guarda los ids entregados y las llamadas a reset/caught_up."""
+
+    name = "registro"
+    sources = ("docs",)
+
+    def __init__(self):
+        self.ids = []
+        self.resets = 0
+        self.al_dia = 0
+
+    async def reset(self):
+        self.resets += 1
+        self.ids = []
+
+    async def apply(self, source, docs):
+        self.ids.extend(d["id"] for d in docs)
+
+    async def caught_up(self, source):
+        self.al_dia += 1
+
+
+def _seed(helper, desde, hasta):
+    async def run():
+        for i in range(desde, hasta):
+            await helper.upsert_item({"id": f"doc:{i:02d}", "n": i}, partition_value=f"doc:{i:02d}")
+    asyncio.run(run())
+
+
+def _processor(helper, leases, view=None, **kwargs):
+    processor = ChangeFeedProcessor(leases=leases, page_size=3, **kwargs)
+    processor.add_source("docs", helper)
+    processor.register(view or Registro())
+    return processor
+
+
+def test_run_once_entrega_todo_y_guarda_checkpoint():
+    helper = AsyncCosmosDBHelper("feed", "/id")
+    _seed(helper, 0, 7)
+    leases = MemoryLeaseStore()
+    processor = _processor(helper, leases)
+    view = processor.views["registro"]
+
+    assert asyncio.run(processor.run_once()) == 7
+    assert view.ids == [f"doc:{i:02d}" for i in range(7)]
+    assert view.resets == 1 and view.al_dia == 1
+    lease = asyncio.run(leases.get("registro:docs"))
+    assert lease["continuation"] and lease["owner"] == processor.owner and lease["processed"] == 7
+    # Sin cambios nuevos no se entrega nada
+    assert asyncio.run(processor.run_once()) == 0
+
+
+def test_pagina_corta_no_corta_el_drenado():
+    helper = AsyncCosmosDBHelper("feed", "/id")
+    _seed(helper, 0, 5)
+    real = helper.read_change_feed
+
+    async def paginas_cortas(continuation=None, page_size=100, **kwargs):
+        # El feed puede devolver menos documentos que page_size sin haber terminado
+        return await real(continuation, page_size=1, **kwargs)
+    helper.read_change_feed = paginas_cortas
+    processor = _processor(helper, MemoryLeaseStore())
+    assert asyncio.run(processor.run_once()) == 5
+
+
+def test_reanuda_desde_el_lease_sin_reset():
+    helper = AsyncCosmosDBHelper("feed", "/id")
+    leases = MemoryLeaseStore()
+    _seed(helper, 0, 4)
+    primero = _processor(helper, leases)
+    asyncio.run(primero.run_once())
+    asyncio.run(primero.stop())
+
+    _seed(helper, 4, 6)
+    segundo = _processor(helper, leases)
+    assert asyncio.run(segundo.run_once()) == 2
+    view = segundo.views["registro"]
+    assert view.ids == ["doc:04", "doc:05"] and view.resets == 0
+
+
+def test_error_en_la_vista_no_avanza_el_lease():
+    helper = AsyncCosmosDBHelper("feed", "/id")
+    _seed(helper, 0, 2)
+    leases = MemoryLeaseStore()
+
+    class Falla(Registro):
+        async def apply(self, source, docs):
+            raise RuntimeError("sin conexión")
+
+    processor = _processor(helper, leases, view=Falla())
+    assert asyncio.run(processor.run_once()) == 0
+    assert processor.stats()["leases"]["registro:docs"]["errors"] == 1
+    assert not asyncio.run(leases.get("registro:docs")).get("continuation")
+
+
+def test_solo_el_dueno_del_lease_procesa():
+    helper = AsyncCosmosDBHelper("feed", "/id")
+    _seed(helper, 0, 3)
+    leases = MemoryLeaseStore()
+    a = _processor(helper, leases, owner="a")
+    b = _processor(helper, leases, owner="b")
+
+    assert asyncio.run(a.run_once()) == 3
+    _seed(helper, 3, 5)
+    # b no toma el lease vigente de a ni llama a reset/caught_up
+    assert asyncio.run(b.run_once()) == 0
+    assert b.views["registro"].ids == [] and b.views["registro"].al_dia == 0
+    assert asyncio.run(a.run_once()) == 2
+
+    # Al soltarlo (stop) b sigue desde la continuation de a
+    asyncio.run(a.stop())
+    _seed(helper, 5, 6)
+    assert asyncio.run(b.run_once()) == 1
+    assert b.views["registro"].ids == ["doc:05"]
+
+
+def test_lease_vencido_pasa_a_otro_worker():
+    helper = AsyncCosmosDBHelper("feed", "/id")
+    _seed(helper, 0, 2)
+    leases = MemoryLeaseStore()
+    a = _processor(helper, leases, owner="a", lease_seconds=0.05)
+    b = _processor(helper, leases, owner="b", lease_seconds=0.05)
+    asyncio.run(a.run_once())
+    time.sleep(0.1)
+    _seed(helper, 2, 3)
+    assert asyncio.run(b.run_once()) == 1
+    assert asyncio.run(leases.get("registro:docs"))["owner"] == "b"
+    # a ya no puede avanzar la continuation de b
+    _seed(helper, 3, 4)
+    assert asyncio.run(a.run_once()) == 0
+
+
+def test_file_lease_store_relee_el_archivo(tmp_path):
+    path = str(tmp_path / "leases.json")
+    uno, otro = FileLeaseStore(path), FileLeaseStore(path)
+    asyncio.run(uno.set("vista:a", {"continuation": "1"}))
+    asyncio.run(otro.set("vista:b", {"continuation": "2"}))
+    # Cada escritura parte del archivo actual: no se pisan las claves del otro proceso
+    assert asyncio.run(uno.get("vista:a")) == {"continuation": "1"}
+    assert asyncio.run(uno.get("vista:b")) == {"continuation": "2"}
+    assert asyncio.run(otro.update("vista:a", lambda lease: None)) is None
+    asyncio.run(otro.delete("vista:a"))
+    assert asyncio.run(uno.get("vista:a")) is None
+
+
+def test_container_lease_store_condicional():
+    store = ContainerLeaseStore(AsyncCosmosDBHelper("leases", "/id"))
+    assert asyncio.run(store.update("vista:a", lambda lease: {"owner": "a"})) == {"owner": "a"}
+    actual = asyncio.run(store.get("vista:a"))
+    assert actual["owner"] == "a"
+
+    async def carrera():
+        # Otro proceso escribe entre la lectura y el replace: el etag ya no coincide
+        real_get = store.get
+
+        async def get_y_pisa(key):
+            lease = await real_get(key)
+            await store.set(key, {"owner": "b"})
+            return lease
+        store.get = get_y_pisa
+        try:
+            return await store.update("vista:a", lambda lease: {"owner": "a", "n": 1})
+        finally:
+            store.get = real_get
+    assert asyncio.run(carrera()) is None
+    assert asyncio.run(store.get("vista:a"))["owner"] == "b"
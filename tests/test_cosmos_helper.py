@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+
+from cosmos_helper import AsyncCosmosDBHelper, CosmosDBHelper, detect_partition_key, partition_query_kwargs
+from storage_backends import get_local_container
+from ttl_cache import TTLCache
+
+
+def _helper_con(n):
+    helper = AsyncCosmosDBHelper("paginas", "/id")
+
+    async def seed():
+        for i in range(n):
+            await helper.upsert_item({"id": f"doc:{i:02d}", "n": i}, partition_value=f"doc:{i:02d}")
+    asyncio.run(seed())
+    return helper
+
+
+SQL = "SELECT * FROM c WHERE c.n >= @min ORDER BY c.n"
+PARAMS = [{"name": "@min", "value": 0}]
+
+
+def test_query_page_continuation():
+    helper = _helper_con(7)
+    items, token = asyncio.run(helper.query_page(SQL, PARAMS, page_size=3))
+    assert [i["n"] for i in items] == [0, 1, 2] and token
+    items, token = asyncio.run(helper.query_page(SQL, PARAMS, page_size=3, continuation=token))
+    assert [i["n"] for i in items] == [3, 4, 5] and token
+    items, token = asyncio.run(helper.query_page(SQL, PARAMS, page_size=3, continuation=token))
+    assert [i["n"] for i in items] == [6] and token is None
+
+
+def test_query_pages_recorre_todo_sin_repetir():
+    helper = _helper_con(10)
+
+    async def collect():
+        return [[i["n"] for i in items] async for items, _ in helper.query_pages(SQL, PARAMS, page_size=4)]
+    assert asyncio.run(collect()) == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+
+
+def test_query_pages_reanuda_desde_token():
+    helper = _helper_con(5)
+    _, token = asyncio.run(helper.query_page(SQL, PARAMS, page_size=2))
+
+    async def collect():
+        return [i["n"] async for items, _ in helper.query_pages(SQL, PARAMS, page_size=2, continuation=token)
+                for i in items]
+    assert asyncio.run(collect()) == [2, 3, 4]
+
+
+# ============================================
+# DETECCIÓN DE PARTITION KEY
+# ============================================
+
+PARAMS_X = [{"name": "@x", "value": "a"}, {"name": "@y", "value": "b"}]
+
+
+@pytest.mark.parametrize("sql, esperado", [
+    ("SELECT * FROM c WHERE c.id = @x", "a"),
+    ("SELECT * FROM c WHERE @x = c.id", "a"),
+    ("SELECT * FROM c WHERE c.tipo = 'nota' AND c.id = @x ORDER BY c.fecha DESC", "a"),
+    ("SELECT * FROM c WHERE STARTSWITH(c.nombre, @y) AND c['id'] = 'carnet:1'", "carnet:1"),
+    ("SELECT * FROM c WHERE c.id = 'O''Brien OR x'", None),
+    ("SELECT * FROM c WHERE c.id = 'A OR B'", "A OR B"),
+    ("SELECT * FROM c WHERE c.id = 42", 42),
+    ("SELECT * FROM c WHERE c.edad BETWEEN 1 AND 5 AND c.id = @x", "a"),
+    ("SELECT * FROM c WHERE c.id = @z", None),
+])
+def test_detecta_conjuncion_and(sql, esperado):
+    assert detect_partition_key(sql, PARAMS_X, "/id") == esperado
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM c WHERE NOT (c.id = @x)",
+    "SELECT * FROM c WHERE NOT  c.id = @x",
+    "SELECT * FROM c WHERE c.tipo = 'nota' AND NOT(c.id = @x)",
+    "SELECT * FROM c WHERE c.id = @x OR c.id = @y",
+    "SELECT * FROM c WHERE (c.id = @x)",
+    "SELECT * FROM c WHERE c.tipo = 'a' AND (c.id = @x OR c.tipo = 'b')",
+    "SELECT * FROM c WHERE c.id = @x AND EXISTS(SELECT VALUE t FROM t IN c.tags WHERE t = 'x')",
+    "SELECT * FROM c WHERE c.id = @x AND c.activo ?? true",
+    "SELECT * FROM c WHERE c.id != @x",
+    "SELECT * FROM c WHERE c.id.sub = @x",
+    "SELECT * FROM c WHERE c.otro.id = @x",
+    "SELECT * FROM c WHERE c['otro'] = @x",
+    "SELECT * FROM c",
+])
+def test_no_detecta_si_puede_ampliar_o_negar(sql):
+    assert detect_partition_key(sql, PARAMS_X, "/id") is None
+
+
+def test_partition_query_kwargs():
+    assert partition_query_kwargs("SELECT * FROM c WHERE c.matricula = @x", PARAMS_X, "/matricula") == {"partition_key": "a"}
+    assert partition_query_kwargs("SELECT * FROM c WHERE NOT c.matricula = @x", PARAMS_X, "/matricula") == {
+        "enable_cross_partition_query": True}
+
+
+class _Reloj:
+    def __init__(self):
+        self.t = 0.0
+
+    def __call__(self):
+        return self.t
+
+
+@pytest.mark.parametrize("asincrono", [False, True])
+def test_read_revalida_por_etag(asincrono):
+    reloj = _Reloj()
+    clase = AsyncCosmosDBHelper if asincrono else CosmosDBHelper
+    helper = clase("cacheados", "/id", cache=TTLCache(10, ttl=1, clock=reloj))
+    backend = get_local_container("cacheados", "/id")
+    backend.upsert_item({"id": "doc:1", "v": 1})
+
+    def leer():
+        result = helper.read_item("doc:1", "doc:1")
+        return asyncio.run(result) if asincrono else result
+
+    assert leer()["v"] == 1
+    backend.upsert_item({"id": "doc:1", "v": 2})
+    assert leer()["v"] == 1          # entrada vigente
+    reloj.t += 2
+    assert leer()["v"] == 2          # vencida y cambiada: se reemplaza
+    etag = leer()["_etag"]
+    reloj.t += 2
+    assert leer()["_etag"] == etag   # vencida sin cambios: 304 y se renueva
+    backend.upsert_item({"id": "doc:1", "v": 3})
+    assert leer()["v"] == 2          # renovada por el 304, sigue vigente
@@ -0,0 +1,121 @@
+import asyncio
+import time
+
+import pytest
+from azure.cosmos.exceptions import CosmosHttpResponseError
+
+import cosmos_throttle
+from cosmos_throttle import (
+    RETRY_AFTER_HEADER,
+    RUTokenBucket,
+    _on_throttled,
+    acall_with_throttle,
+    backoff_delay,
+    call_with_throttle,
+    get_bucket,
+    get_throttle_stats,
+)
+
+
+def _throttled(retry_after_ms=None):
+    error = CosmosHttpResponseError(status_code=429, message="Request rate is large")
+    error.headers = {RETRY_AFTER_HEADER: str(retry_after_ms)} if retry_after_ms is not None else {}
+    return error
+
+
+def _delta(before, key):
+    return get_throttle_stats()[key] - before[key]
+
+
+@pytest.fixture(autouse=True)
+def fresh_buckets(monkeypatch):
+    monkeypatch.setattr(cosmos_throttle, "_buckets", {})
+    monkeypatch.setattr(cosmos_throttle, "THROTTLE_BASE_DELAY_MS", 1.0)
+
+
+class _Fallas:
+    """fn que responde 429 las primeras `fallas` veces."""
+
+    def __init__(self, fallas, retry_after_ms=None):
+        self.fallas = fallas
+        self.retry_after_ms = retry_after_ms
+        self.llamadas = 0
+
+    def __call__(self):
+        self.llamadas += 1
+        if self.llamadas <= self.fallas:
+            raise _throttled(self.retry_after_ms)
+        return "ok"
+
+
+def test_backoff_respeta_retry_after():
+    for _ in range(20):
+        delay = backoff_delay(0, _throttled(250))
+        assert 0.25 <= delay <= 0.251
+
+
+def test_backoff_exponencial_con_tope(monkeypatch):
+    monkeypatch.setattr(cosmos_throttle, "THROTTLE_MAX_DELAY_MS", 8.0)
+    for attempt in range(6):
+        delay = backoff_delay(attempt, _throttled())
+        assert 0.0005 <= delay <= min(0.008, 0.001 * 2 ** attempt)
+
+
+def test_reintenta_429_y_espera_retry_after():
+    before = get_throttle_stats()
+    fn = _Fallas(2, retry_after_ms=20)
+    started = time.monotonic()
+    assert call_with_throttle("throttle_test", "read", fn) == "ok"
+    assert fn.llamadas == 3
+    assert time.monotonic() - started >= 0.04
+    assert _delta(before, "throttled") == 2 and _delta(before, "retries") == 2
+
+
+def test_version_async_reintenta():
+    fn = _Fallas(1, retry_after_ms=5)
+
+    async def llamada():
+        return fn()
+    assert asyncio.run(acall_with_throttle("throttle_test", "read", llamada)) == "ok"
+    assert fn.llamadas == 2
+
+
+def test_presupuesto_de_reintentos_agotado(monkeypatch):
+    monkeypatch.setattr(cosmos_throttle, "THROTTLE_MAX_RETRIES", 2)
+    before = get_throttle_stats()
+    fn = _Fallas(10)
+    with pytest.raises(CosmosHttpResponseError) as exc:
+        call_with_throttle("throttle_test", "read", fn)
+    assert exc.value.status_code == 429 and fn.llamadas == 3
+    assert _delta(before, "exhausted") == 1 and _delta(before, "retries") == 2
+
+
+def test_presupuesto_de_espera_agotado(monkeypatch):
+    monkeypatch.setattr(cosmos_throttle, "THROTTLE_MAX_WAIT_MS", 50.0)
+    fn = _Fallas(10, retry_after_ms=100)
+    with pytest.raises(CosmosHttpResponseError):
+        call_with_throttle("throttle_test", "read", fn)
+    assert fn.llamadas == 1
+
+
+def test_429_devuelve_lo_reservado():
+    bucket = RUTokenBucket(100.0)
+    bucket.tokens = -500.0  # cola de llamadas concurrentes esperando
+    bucket.reserve(6.0)
+    _on_throttled(bucket, 6.0, 0, time.monotonic(), _throttled(1))
+    # Solo queda la cola previa (más lo que se rellenó mientras tanto), no el intento fallido
+    assert bucket.tokens == pytest.approx(-500.0, abs=1.0)
+
+
+def test_descarta_si_la_cola_excede_la_espera(monkeypatch):
+    monkeypatch.setattr(cosmos_throttle, "THROTTLE_MAX_WAIT_MS", 100.0)
+    bucket = get_bucket("throttle_test")
+    bucket.tokens = -bucket.rate  # un segundo de cola
+    before = get_throttle_stats()
+    fn = _Fallas(0)
+    with pytest.raises(CosmosHttpResponseError) as exc:
+        call_with_throttle("throttle_test", "read", fn)
+    assert exc.value.status_code == 429 and fn.llamadas == 0
+    assert _delta(before, "shed") == 1
+    # La reserva rechazada se devolvió
+    assert bucket.tokens == pytest.approx(-bucket.rate, abs=bucket.rate * 0.05)
@@ -0,0 +1,107 @@
+from types import SimpleNamespace
+
+import pytest
+
+import login_limiter
+from login_limiter import LoginLimiter, MemoryBuckets, SQLiteBuckets, client_ip, parse_rate
+
+
+class _Reloj:
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def monotonic(self):
+        return self.ahora
+
+    def time(self):
+        return self.ahora
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = _Reloj()
+    monkeypatch.setattr(login_limiter, "time", reloj)
+    return reloj
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def buckets(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteBuckets(str(tmp_path / "login_limits.db"))
+    return MemoryBuckets()
+
+
+def test_parse_rate():
+    assert parse_rate("20/60") == (20.0, pytest.approx(1 / 3))
+    assert parse_rate("10/300") == (10.0, pytest.approx(1 / 30))
+    assert parse_rate("5") == (5.0, pytest.approx(5 / 60))
+
+
+def test_bucket_se_agota_y_se_recupera(reloj, buckets):
+    capacity, rate = parse_rate("2/60")
+    assert buckets.take("ip:1", capacity, rate) == 0
+    assert buckets.take("ip:1", capacity, rate) == 0
+    assert buckets.take("ip:1", capacity, rate) == pytest.approx(30.0)
+    # Otra clave tiene su propio bucket
+    assert buckets.take("ip:2", capacity, rate) == 0
+    reloj.ahora += 29
+    assert buckets.take("ip:1", capacity, rate) > 0
+    reloj.ahora += 60
+    assert buckets.take("ip:1", capacity, rate) == 0
+
+
+def test_refund_no_pasa_de_la_capacidad(reloj, buckets):
+    capacity, rate = parse_rate("2/60")
+    buckets.take("ip:1", capacity, rate)
+    buckets.refund("ip:1", capacity, rate)
+    buckets.refund("ip:1", capacity, rate)
+    assert buckets.take("ip:1", capacity, rate) == 0
+    assert buckets.take("ip:1", capacity, rate) == 0
+    assert buckets.take("ip:1", capacity, rate) > 0
+
+
+def test_login_exitoso_devuelve_el_intento(reloj, buckets):
+    limiter = LoginLimiter(buckets, ip_rate="2/60", user_rate="3/300", enabled=True)
+    # Muchos usuarios detrás de la misma IP: los logins correctos no gastan su bucket
+    for i in range(10):
+        assert limiter.check("10.0.0.1", f"usuario{i}") == 0
+        limiter.succeeded("10.0.0.1", f"usuario{i}")
+    # Los fallidos sí
+    assert limiter.check("10.0.0.1", "x") == 0
+    assert limiter.check("10.0.0.1", "y") == 0
+    assert limiter.check("10.0.0.1", "z") > 0
+    assert limiter.stats()["limited_ip"] == 1
+
+
+def test_limite_por_usuario_se_reinicia_al_entrar(reloj, buckets):
+    limiter = LoginLimiter(buckets, ip_rate="100/60", user_rate="2/300", enabled=True)
+    assert limiter.check("10.0.0.1", "Ana") == 0
+    assert limiter.check("10.0.0.2", "ana ") == 0
+    assert limiter.check("10.0.0.3", "ana") == pytest.approx(150.0)
+    limiter.succeeded("10.0.0.3", "ana")
+    assert limiter.check("10.0.0.3", "ana") == 0
+
+
+def test_deshabilitado_no_limita(buckets):
+    limiter = LoginLimiter(buckets, ip_rate="1/60", enabled=False)
+    assert all(limiter.check("10.0.0.1", "ana") == 0 for _ in range(5))
+
+
+def _request(forwarded=None, host="10.1.1.1"):
+    headers = {"x-forwarded-for": forwarded} if forwarded is not None else {}
+    return SimpleNamespace(headers=headers, client=SimpleNamespace(host=host))
+
+
+@pytest.mark.parametrize("hops, esperado", [(1, "203.0.113.7"), (2, "198.51.100.2"), (5, "1.2.3.4")])
+def test_client_ip_cuenta_proxies_desde_la_derecha(monkeypatch, hops, esperado):
+    monkeypatch.setattr(login_limiter, "LOGIN_LIMIT_TRUST_FORWARDED", True)
+    monkeypatch.setattr(login_limiter, "LOGIN_LIMIT_PROXY_HOPS", hops)
+    # El cliente puede inventar la entrada de la izquierda
+    assert client_ip(_request("1.2.3.4, 198.51.100.2, 203.0.113.7")) == esperado
+
+
+def test_client_ip_sin_forwarded(monkeypatch):
+    assert client_ip(_request("1.2.3.4")) == "10.1.1.1"
+    monkeypatch.setattr(login_limiter, "LOGIN_LIMIT_TRUST_FORWARDED", True)
+    assert client_ip(_request("")) == "10.1.1.1"
+    assert client_ip(SimpleNamespace(headers={}, client=None)) is None
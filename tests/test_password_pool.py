@@ -0,0 +1,63 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from password_pool import PasswordPool
+
+
+async def _until(condition):
+    for _ in range(500):
+        if condition():
+            return
+        await asyncio.sleep(0.002)
+    raise AssertionError("la condición no se cumplió")
+
+
+def test_cola_llena_responde_503_con_retry_after():
+    pool = PasswordPool(workers=1, max_queue=1)
+    liberar = threading.Event()
+
+    async def run():
+        ocupado = asyncio.create_task(pool.run(liberar.wait))
+        await _until(lambda: pool.stats()["running"] == 1)
+        en_cola = asyncio.create_task(pool.run(lambda: "ok"))
+        await _until(lambda: pool.stats()["queued"] == 1)
+        with pytest.raises(HTTPException) as exc:
+            await pool.run(lambda: "no")
+        liberar.set()
+        return exc.value, await ocupado, await en_cola
+
+    error, primero, segundo = asyncio.run(run())
+    assert error.status_code == 503 and error.headers == {"Retry-After": "1"}
+    assert primero is True and segundo == "ok"
+    stats = pool.stats()
+    assert stats["rejected"] == 1 and stats["calls"] == 2 and stats["queued"] == 0
+
+
+def test_request_cancelado_sale_de_la_cola():
+    pool = PasswordPool(workers=1, max_queue=1)
+    liberar = threading.Event()
+    calculados = []
+
+    async def run():
+        ocupado = asyncio.create_task(pool.run(liberar.wait))
+        await _until(lambda: pool.stats()["running"] == 1)
+        en_cola = asyncio.create_task(pool.run(calculados.append, "cancelado"))
+        await _until(lambda: pool.stats()["queued"] == 1)
+        # Cliente desconectado mientras espera: libera su lugar en la cola
+        en_cola.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await en_cola
+        assert pool.stats()["queued"] == 0
+        # El lugar liberado acepta otro cálculo sin 503
+        siguiente = asyncio.create_task(pool.run(calculados.append, "siguiente"))
+        await _until(lambda: pool.stats()["queued"] == 1)
+        liberar.set()
+        await ocupado
+        await siguiente
+
+    asyncio.run(run())
+    assert calculados == ["siguiente"]
+    assert pool.stats()["rejected"] == 0 and pool.stats()["queued"] == 0
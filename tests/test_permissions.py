@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from auth_models import Campus, TokenData, UserRole, has_permissions
+from auth_service import require_permission
+
+
+def _user(rol):
+    return TokenData(username="u", rol=rol, campus=Campus.RECTORIA)
+
+
+def test_sin_permisos_falla_al_declarar():
+    with pytest.raises(ValueError):
+        require_permission()
+    with pytest.raises(ValueError):
+        require_permission(any_of=True)
+
+
+def test_permiso_desconocido_falla_al_declarar():
+    with pytest.raises(ValueError):
+        require_permission("carnets:volar")
+
+
+def test_checker_se_reutiliza_y_niega():
+    checker = require_permission("carnets:create")
+    assert require_permission("carnets:create") is checker
+    assert asyncio.run(checker(_user(UserRole.MEDICO))).rol == UserRole.MEDICO
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(checker(_user(UserRole.LECTURA)))
+    assert exc.value.status_code == 403
+
+
+def test_has_permissions():
+    assert has_permissions(UserRole.ADMIN, "carnets:create", "users:create")
+    assert not has_permissions(UserRole.LECTURA, "carnets:create", "carnets:read")
+    assert has_permissions(UserRole.LECTURA, "carnets:create", "carnets:read", any_of=True)
+
+
+@pytest.mark.parametrize("any_of", [False, True])
+def test_has_permissions_sin_permisos_es_error(any_of):
+    with pytest.raises(ValueError):
+        has_permissions(UserRole.ADMIN, any_of=any_of)
@@ -0,0 +1,194 @@
+import pytest
+from azure.cosmos.exceptions import (
+    CosmosAccessConditionFailedError,
+    CosmosBatchOperationError,
+    CosmosHttpResponseError,
+    CosmosResourceNotFoundError,
+)
+
+import storage_backends
+from storage_backends import MemoryContainer, compile_query
+
+DOCS = [
+    {"id": "carnet:1", "matricula": "A1", "edad": 20, "campus": "rectoria"},
+    {"id": "carnet:2", "matricula": "A2", "edad": 18, "campus": "prep-1"},
+    {"id": "carnet:3", "matricula": "A3", "edad": 25, "campus": "rectoria", "alergias": "polen"},
+    {"id": "cita:1", "matricula": "A1", "inicio": "2026-01-01T09:00:00"},
+]
+
+
+def _ids(rows):
+    return [r["id"] for r in rows]
+
+
+# ============================================
+# INTÉRPRETE DE QUERIES
+# ============================================
+
+def test_where_con_parametros_y_funciones():
+    sql = """SELECT * FROM c WHERE c.campus = @campus AND STARTSWITH(c.id, 'carnet:')
+             AND NOT IS_DEFINED(c.inicio)"""
+    rows = compile_query(sql).execute(DOCS, [{"name": "@campus", "value": "rectoria"}])
+    assert _ids(rows) == ["carnet:1", "carnet:3"]
+
+
+def test_where_or_in_y_comparaciones():
+    sql = "SELECT * FROM c WHERE c.edad >= 20 OR c.matricula IN ('A2')"
+    assert _ids(compile_query(sql).execute(DOCS)) == ["carnet:1", "carnet:2", "carnet:3"]
+    assert compile_query("SELECT * FROM c WHERE c.edad <> 20 AND c.edad < 25").execute(DOCS)[0]["id"] == "carnet:2"
+
+
+def test_parametro_ausente_no_coincide():
+    assert compile_query("SELECT * FROM c WHERE c.campus = @campus").execute(DOCS) == []
+
+
+def test_order_by_top_y_proyeccion():
+    sql = "SELECT TOP 2 c.id, c.edad AS anios FROM c WHERE IS_DEFINED(c.edad) ORDER BY c.edad DESC"
+    assert compile_query(sql).execute(DOCS) == [{"id": "carnet:3", "anios": 25}, {"id": "carnet:1", "anios": 20}]
+
+
+def test_order_by_varias_claves():
+    sql = "SELECT c.id FROM c WHERE IS_DEFINED(c.edad) ORDER BY c.campus ASC, c.edad DESC"
+    assert _ids(compile_query(sql).execute(DOCS)) == ["carnet:2", "carnet:3", "carnet:1"]
+
+
+def test_offset_limit():
+    sql = "SELECT c.id FROM c ORDER BY c.id OFFSET @offset LIMIT @limit"
+    params = [{"name": "@offset", "value": 1}, {"name": "@limit", "value": 2}]
+    assert _ids(compile_query(sql).execute(DOCS, params)) == ["carnet:2", "carnet:3"]
+    assert _ids(compile_query("SELECT * FROM c ORDER BY c.id OFFSET 3 LIMIT 10").execute(DOCS)) == ["cita:1"]
+
+
+def test_offset_sin_limit_es_error():
+    with pytest.raises(CosmosHttpResponseError) as exc:
+        compile_query("SELECT * FROM c OFFSET 1")
+    assert exc.value.status_code == 400
+
+
+def test_value_count():
+    assert compile_query("SELECT VALUE COUNT(1) FROM c WHERE c.campus = 'rectoria'").execute(DOCS) == [2]
+
+
+def test_sintaxis_no_soportada():
+    with pytest.raises(CosmosHttpResponseError) as exc:
+        compile_query("SELECT * FROM c WHERE c.a ; DROP")
+    assert exc.value.status_code == 400
+
+
+# ============================================
+# PATCH
+# ============================================
+
+@pytest.fixture
+def container():
+    c = MemoryContainer("pruebas", "/id")
+    c.create_item({"id": "u1", "intentos": 1, "tags": ["a"], "perfil": {"nombre": "Ana"}})
+    return c
+
+
+def test_patch_operaciones(container):
+    doc = container.patch_item("u1", "u1", [
+        {"op": "incr", "path": "/intentos", "value": 2},
+        {"op": "set", "path": "/perfil/nombre", "value": "Ana B"},
+        {"op": "add", "path": "/tags/0", "value": "z"},
+        {"op": "add", "path": "/tags/-", "value": "b"},
+        {"op": "remove", "path": "/perfil"},
+        {"op": "incr", "path": "/nuevo", "value": 1},
+    ])
+    assert doc["intentos"] == 3
+    assert doc["tags"] == ["z", "a", "b"]
+    assert "perfil" not in doc
+    assert doc["nuevo"] == 1
+
+
+def test_patch_move_y_replace(container):
+    doc = container.patch_item("u1", "u1", [
+        {"op": "move", "from": "/perfil/nombre", "path": "/nombre"},
+        {"op": "replace", "path": "/intentos", "value": 0},
+    ])
+    assert doc["nombre"] == "Ana" and doc["perfil"] == {} and doc["intentos"] == 0
+
+
+def test_patch_invalido_no_aplica_nada(container):
+    before = container.read_item("u1", "u1")
+    with pytest.raises(CosmosHttpResponseError) as exc:
+        container.patch_item("u1", "u1", [
+            {"op": "set", "path": "/intentos", "value": 9},
+            {"op": "replace", "path": "/no_existe", "value": 1},
+        ])
+    assert exc.value.status_code == 400
+    assert container.read_item("u1", "u1")["_etag"] == before["_etag"]
+    assert container.read_item("u1", "u1")["intentos"] == 1
+
+
+def test_patch_condicional(container):
+    with pytest.raises(CosmosAccessConditionFailedError):
+        container.patch_item("u1", "u1", [{"op": "set", "path": "/x", "value": 1}],
+                             filter_predicate="FROM c WHERE c.intentos > 5")
+    doc = container.patch_item("u1", "u1", [{"op": "set", "path": "/x", "value": 1}],
+                               filter_predicate="FROM c WHERE c.intentos = 1")
+    assert doc["x"] == 1
+
+
+def test_patch_no_existe(container):
+    with pytest.raises(CosmosResourceNotFoundError):
+        container.patch_item("u2", "u2", [{"op": "set", "path": "/x", "value": 1}])
+
+
+# ============================================
+# BATCH TRANSACCIONAL
+# ============================================
+
+def test_batch_aplica_todo():
+    c = MemoryContainer("batch", "/dia")
+    responses = c.execute_item_batch([
+        ("create", ({"id": "a", "dia": "d1"},)),
+        ("upsert", ({"id": "b", "dia": "d1"},)),
+        ("patch", ("a", [{"op": "set", "path": "/ttl", "value": 60}])),
+    ], partition_key="d1")
+    assert [r["statusCode"] for r in responses] == [201, 201, 200]
+    assert c.read_item("a", "d1")["ttl"] == 60
+
+
+def test_batch_fallido_revierte_todo():
+    c = MemoryContainer("batch", "/dia")
+    c.create_item({"id": "a", "dia": "d1", "v": 1})
+    with pytest.raises(CosmosBatchOperationError) as exc:
+        c.execute_item_batch([
+            ("upsert", ({"id": "a", "dia": "d1", "v": 2},)),
+            ("create", ({"id": "b", "dia": "d1"},)),
+            ("create", ({"id": "a", "dia": "d1"},)),
+        ], partition_key="d1")
+    assert exc.value.error_index == 2
+    assert [r["statusCode"] for r in exc.value.operation_responses] == [424, 424, 409]
+    assert c.read_item("a", "d1")["v"] == 1
+    with pytest.raises(CosmosResourceNotFoundError):
+        c.read_item("b", "d1")
+
+
+def test_batch_if_match():
+    c = MemoryContainer("batch", "/dia")
+    doc = c.create_item({"id": "a", "dia": "d1"})
+    with pytest.raises(CosmosBatchOperationError) as exc:
+        c.execute_item_batch([("replace", ("a", {"id": "a", "dia": "d1"}), {"if_match_etag": '"viejo"'})],
+                             partition_key="d1")
+    assert exc.value.operation_responses[0]["statusCode"] == 412
+    c.execute_item_batch([("replace", ("a", {"id": "a", "dia": "d1", "v": 1}), {"if_match_etag": doc["_etag"]})],
+                         partition_key="d1")
+    assert c.read_item("a", "d1")["v"] == 1
+
+
+# ============================================
+# TTL
+# ============================================
+
+def test_ttl_vence(monkeypatch):
+    c = MemoryContainer("ttl", "/id")
+    c.create_item({"id": "temporal", "ttl": 60})
+    c.create_item({"id": "permanente"})
+    now = storage_backends.time.time()
+    assert len(c.query_items("SELECT * FROM c")) == 2
+    monkeypatch.setattr(storage_backends.time, "time", lambda: now + 61)
+    with pytest.raises(CosmosResourceNotFoundError):
+        c.read_item("temporal", "temporal")
+    assert _ids(c.query_items("SELECT * FROM c")) == ["permanente"]
@@ -0,0 +1,120 @@
+import asyncio
+
+from change_feed import ChangeFeedProcessor, MemoryLeaseStore
+from cosmos_helper import AsyncCosmosDBHelper
+from vaccination_stats import TIPO_APLICACION, VaccinationStats, VaccinationStatsView
+
+
+def _app(id, matricula, vacuna="Influenza", campus="rectoria", dia="2026-03-02", **extra):
+    return {"id": id, "tipo": TIPO_APLICACION, "matricula": matricula, "vacuna": vacuna,
+            "campana": "Invierno", "campus": campus, "fechaAplicacion": f"{dia}T10:00:00", **extra}
+
+
+def _recount(docs):
+    stats = VaccinationStats()
+    for doc in docs:
+        stats.apply(doc)
+    return stats
+
+
+def _all_snapshots(stats):
+    return [stats.snapshot(), stats.snapshot("rectoria"), stats.snapshot("prep-1"),
+            stats.snapshot(desde="2026-03-01", hasta="2026-03-02"),
+            stats.snapshot("rectoria", desde="2026-03-03")]
+
+
+def test_apply_cuenta_totales_y_unicos():
+    stats = _recount([_app("v1", "A1"), _app("v2", "A1", vacuna="Hepatitis B"), _app("v3", "A2", campus="prep-1"),
+                      {"id": "x", "tipo": "otro"}])
+    assert stats.snapshot() == {
+        "totalAplicaciones": 3, "estudiantesVacunados": 2,
+        "porVacuna": {"Influenza": 2, "Hepatitis B": 1}, "porCampana": {"Invierno": 3},
+        "porCampus": {"rectoria": 2, "prep-1": 1},
+    }
+    assert stats.snapshot("prep-1")["totalAplicaciones"] == 1
+
+
+def test_edicion_resta_la_version_anterior():
+    stats = VaccinationStats()
+    original = _app("v1", "A1")
+    stats.apply(original)
+    editada = _app("v1", "A1", vacuna="Tétanos", campus="prep-1", dia="2026-03-04",
+                   anterior={k: original[k] for k in ("vacuna", "campana", "matricula", "campus", "fechaAplicacion")})
+    stats.apply(editada, editada["anterior"])
+    assert _all_snapshots(stats) == _all_snapshots(_recount([editada]))
+    assert stats.snapshot("rectoria")["totalAplicaciones"] == 0
+
+
+def test_borrado_resta_y_unicos_siguen_con_otra_aplicacion():
+    stats = VaccinationStats()
+    docs = [_app("v1", "A1"), _app("v2", "A1", dia="2026-03-03"), _app("v3", "A2")]
+    for doc in docs:
+        stats.apply(doc)
+    stats.remove(docs[0])
+    assert stats.snapshot()["estudiantesVacunados"] == 2
+    # Borrado lógico por el change feed: el documento trae su versión anterior
+    stats.apply({**docs[2], "eliminado": True}, docs[2])
+    assert _all_snapshots(stats) == _all_snapshots(_recount([docs[1]]))
+    assert stats.snapshot(desde="2026-03-02", hasta="2026-03-02")["totalAplicaciones"] == 0
+
+
+def test_secuencia_mixta_coincide_con_recuento():
+    stats = VaccinationStats()
+    vigentes = {}
+    for i in range(30):
+        doc = _app(f"v{i}", f"A{i % 7}", vacuna=["Influenza", "Tétanos"][i % 2],
+                   campus=["rectoria", "prep-1"][i % 3 == 0], dia=f"2026-03-0{1 + i % 4}")
+        stats.apply(doc)
+        vigentes[doc["id"]] = doc
+    for i in range(0, 30, 4):
+        anterior = vigentes[f"v{i}"]
+        nuevo = {**anterior, "vacuna": "Hepatitis B", "fechaAplicacion": "2026-03-05T08:00:00"}
+        stats.apply(nuevo, anterior)
+        vigentes[nuevo["id"]] = nuevo
+    for i in range(1, 30, 5):
+        stats.remove(vigentes.pop(f"v{i}"))
+    assert _all_snapshots(stats) == _all_snapshots(_recount(vigentes.values()))
+
+
+def test_estado_guardado_se_restaura_igual():
+    stats = _recount([_app("v1", "A1"), _app("v2", "A2", campus="prep-1", dia="2026-03-03")])
+    copia = VaccinationStats()
+    copia.load_state(stats.to_state())
+    assert _all_snapshots(copia) == _all_snapshots(stats)
+
+
+def test_vista_del_feed_cuenta_una_vez_y_comparte_estado():
+    helper = AsyncCosmosDBHelper("vacunacion", "/matricula")
+    leases = MemoryLeaseStore()
+
+    def processor(owner):
+        stats = VaccinationStats()
+        processor = ChangeFeedProcessor(leases=leases, page_size=2, owner=owner)
+        processor.add_source("vacunacion", helper)
+        processor.register(VaccinationStatsView(stats))
+        return processor, stats
+
+    async def run():
+        for i in range(5):
+            await helper.create_item(_app(f"v{i}", f"A{i % 3}"))
+        lider, stats_lider = processor("a")
+        seguidor, stats_seguidor = processor("b")
+        # Falla el checkpoint de la segunda página, ya aplicada en memoria
+        real_update, calls = leases.update, []
+
+        async def update(key, fn):
+            calls.append(key)
+            if len(calls) == 3:
+                raise RuntimeError("sin conexión")
+            return await real_update(key, fn)
+        leases.update = update
+        await lider.run_once()
+        assert stats_lider.snapshot()["totalAplicaciones"] == 4
+        # La página se vuelve a entregar sobre el estado guardado: no se cuenta dos veces
+        await lider.run_once()
+        await seguidor.run_once()
+        return stats_lider, stats_seguidor
+
+    stats_lider, stats_seguidor = asyncio.run(run())
+    assert stats_lider.snapshot()["totalAplicaciones"] == 5
+    assert stats_seguidor.loaded and stats_seguidor.snapshot() == stats_lider.snapshot()
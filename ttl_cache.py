@@ -0,0 +1,100 @@
+# temp_backend/ttl_cache.py
+"""
+Caché en memoria con tamaño máximo, TTL por entrada y desalojo LRU.
+
+Las entradas vencidas no se borran al vencer: get() las ignora, pero
+get_entry() las sigue devolviendo (con expired=True) para que el llamador
+pueda revalidarlas (p. ej. If-None-Match con el _etag de Cosmos) y
+renovarlas con touch() sin volver a transferir el valor.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, NamedTuple, Optional
+
+
+class CacheEntry(NamedTuple):
+    value: Any
+    expired: bool
+
+
+class TTLCache:
+    """LRU con TTL, seguro entre threads. maxsize <= 0 o ttl <= 0 deshabilitan el caché."""
+
+    def __init__(self, maxsize: int, ttl: float, clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[Hashable, list]" = OrderedDict()  # key -> [value, expires_at]
+        self._stats = {"hits": 0, "misses": 0, "revalidated": 0, "evictions": 0, "invalidations": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0 and self.ttl > 0
+
+    def get_entry(self, key: Hashable) -> Optional[CacheEntry]:
+        """Retorna la entrada (vigente o vencida) o None; cuenta hit solo si está vigente."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self._stats["misses"] += 1
+                return None
+            self._data.move_to_end(key)
+            expired = item[1] <= self._clock()
+            self._stats["misses" if expired else "hits"] += 1
+            return CacheEntry(item[0], expired)
+
+    def get(self, key: Hashable, default=None):
+        """Retorna el valor si la entrada está vigente."""
+        entry = self.get_entry(key)
+        if entry is None or entry.expired:
+            return default
+        return entry.value
+
+    def set(self, key: Hashable, value, ttl: Optional[float] = None):
+        """Guarda value por ttl segundos (default self.ttl), desalojando el LRU si hace falta."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._data[key] = [value, self._clock() + (self.ttl if ttl is None else ttl)]
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def touch(self, key: Hashable, ttl: Optional[float] = None) -> bool:
+        """Renueva el vencimiento de una entrada revalidada."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return False
+            item[1] = self._clock() + (self.ttl if ttl is None else ttl)
+            self._data.move_to_end(key)
+            self._stats["revalidated"] += 1
+            return True
+
+    def pop(self, key: Hashable, default=None):
+        """Invalida una entrada."""
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None:
+                return default
+            self._stats["invalidations"] += 1
+            return item[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def __contains__(self, key: Hashable):
+        return self.get(key) is not None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, size=len(self._data), maxsize=self.maxsize, ttl=self.ttl)
@@ -0,0 +1,268 @@
+# temp_backend/vaccination_stats.py
+"""
+Estadísticas de vacunación mantenidas de forma incremental.
+
+GET /vacunacion/estadisticas ya no recorre el contenedor en cada request: los
+contadores viven en memoria del proceso y se actualizan con cada aplicación.
+
+Por defecto (VACUNACION_STATS_FEED=true) los contadores los mantiene una sola
+vez el change feed del contenedor (VaccinationStatsView), aunque
+CHANGE_FEED_ENABLED sea false: solo el worker dueño del lease los calcula y
+los guarda en el lease junto con la continuation (exactly-once); los demás
+workers cargan ese estado cuando avanza, sin releer el feed. Una escritura
+aparece en todos los workers a lo más CHANGE_FEED_POLL_SECONDS después. Con
+VACUNACION_STATS_FEED=false cada worker los carga con un recorrido paginado y
+solo ve sus propias escrituras (el endpoint lo indica en "actualizacion").
+
+- Solo agregados: no se guarda cada aplicación. apply(doc, anterior) suma la
+  aplicación y resta la versión anterior que reemplaza; remove(doc) la resta.
+- Las aplicaciones se crean y no se editan (POST /vacunacion/aplicacion).
+  Una edición debe guardar en el documento la versión que reemplaza
+  ("anterior": sus campos vacuna, campana, matricula, campus,
+  fechaAplicacion) y un borrado debe ser lógico ("eliminado": true, con ttl
+  para el borrado físico): el change feed no informa los borrados ni la
+  versión previa de un documento.
+- Estudiantes únicos exactos: conteo de aplicaciones por matrícula, así una
+  matrícula deja de contar solo cuando ya no le queda ninguna aplicación.
+- Además del total global hay agregados por campus y por día de aplicación
+  (fechaAplicacion), para filtrar por campus y por ventana de fechas sumando a
+  lo más un agregado por día de la ventana.
+
+Reconstruir los contadores desde el principio del feed (p. ej. tras editar
+documentos a mano): borrar el lease "vacunacion_estadisticas:vacunacion" del
+archivo o contenedor de leases; el próximo dueño los recalcula.
+
+Configuración (variables de entorno):
+    VACUNACION_STATS_FEED   mantener los contadores con el change feed (default true)
+"""
+
+import asyncio
+import base64
+import gzip
+import json
+import os
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional
+
+from change_feed import ViewBuilder
+
+VACUNACION_STATS_FEED = os.environ.get("VACUNACION_STATS_FEED", "true").lower() == "true"
+
+TIPO_APLICACION = "aplicacion_vacuna"
+SIN_CAMPUS = "Sin campus"
+
+
+class _Aplicacion(NamedTuple):
+    vacuna: str
+    campana: str
+    matricula: str
+    campus: str
+    dia: str
+
+
+def _aplicacion(doc: dict) -> _Aplicacion:
+    campus = doc.get("campus") or SIN_CAMPUS
+    return _Aplicacion(
+        vacuna=doc.get("vacuna", "Desconocida"),
+        campana=doc.get("campana", "Sin campaña"),
+        matricula=doc.get("matricula"),
+        campus=campus,
+        dia=(doc.get("fechaAplicacion") or "")[:10],
+    )
+
+
+class _Aggregate:
+    """Contadores de un conjunto de aplicaciones (global, un campus o un día)."""
+
+    __slots__ = ("total", "por_vacuna", "por_campana", "por_campus", "matriculas")
+
+    def __init__(self):
+        self.total = 0
+        self.por_vacuna = Counter()
+        self.por_campana = Counter()
+        self.por_campus = Counter()
+        self.matriculas = Counter()
+
+    def add(self, app: _Aplicacion, sign: int):
+        self.total += sign
+        for counter, key in ((self.por_vacuna, app.vacuna), (self.por_campana, app.campana),
+                             (self.por_campus, app.campus), (self.matriculas, app.matricula)):
+            counter[key] += sign
+            if counter[key] <= 0:
+                del counter[key]
+
+    def merge(self, other: "_Aggregate"):
+        self.total += other.total
+        self.por_vacuna.update(other.por_vacuna)
+        self.por_campana.update(other.por_campana)
+        self.por_campus.update(other.por_campus)
+        self.matriculas.update(other.matriculas)
+
+    def to_list(self) -> list:
+        """Forma compacta para el estado guardado (ver VaccinationStats.to_state)."""
+        return [self.total, dict(self.por_vacuna), dict(self.por_campana), dict(self.matriculas)]
+
+    @classmethod
+    def from_list(cls, campus: str, data: list) -> "_Aggregate":
+        aggregate = cls()
+        aggregate.total = data[0]
+        aggregate.por_vacuna.update(data[1])
+        aggregate.por_campana.update(data[2])
+        aggregate.matriculas.update(data[3])
+        aggregate.por_campus[campus] = aggregate.total
+        return aggregate
+
+    def as_dict(self) -> dict:
+        return {
+            "totalAplicaciones": self.total,
+            "estudiantesVacunados": len(self.matriculas),
+            "porVacuna": dict(self.por_vacuna),
+            "porCampana": dict(self.por_campana),
+            "porCampus": dict(self.por_campus),
+        }
+
+
+class VaccinationStats:
+    """Agregados de aplicaciones de vacuna globales, por campus y por día."""
+
+    def __init__(self):
+        self._total = _Aggregate()
+        self._por_campus: Dict[str, _Aggregate] = {}
+        self._por_dia: Dict[str, _Aggregate] = {}
+        self._por_campus_dia: Dict[str, Dict[str, _Aggregate]] = {}
+        self._loaded = asyncio.Event()
+        self._load_lock = asyncio.Lock()
+        # True si los contadores los mantiene el change feed (VaccinationStatsView)
+        self.feed_managed = False
+
+    def _add(self, app: _Aplicacion, sign: int):
+        self._total.add(app, sign)
+        dias = self._por_campus_dia.setdefault(app.campus, {})
+        for index, key in ((self._por_campus, app.campus), (self._por_dia, app.dia), (dias, app.dia)):
+            aggregate = index.setdefault(key, _Aggregate())
+            aggregate.add(app, sign)
+            if aggregate.total <= 0:
+                # Sin aplicaciones: no se guarda el agregado vacío
+                del index[key]
+        if not dias:
+            del self._por_campus_dia[app.campus]
+
+    def apply(self, doc: dict, anterior: Optional[dict] = None):
+        """
+        Suma una aplicación nueva o editada: si reemplaza a otra versión
+        (anterior), primero resta esa. Un documento con "eliminado" solo resta.
+        Ignora documentos que no son aplicaciones.
+        """
+        if doc.get("tipo") != TIPO_APLICACION:
+            return
+        if anterior and not anterior.get("eliminado"):
+            self._add(_aplicacion(anterior), -1)
+        if not doc.get("eliminado"):
+            self._add(_aplicacion(doc), 1)
+
+    def remove(self, doc: dict):
+        """Resta una aplicación borrada."""
+        if doc.get("tipo") == TIPO_APLICACION and not doc.get("eliminado"):
+            self._add(_aplicacion(doc), -1)
+
+    def clear(self):
+        self._total = _Aggregate()
+        self._por_campus.clear()
+        self._por_dia.clear()
+        self._por_campus_dia.clear()
+
+    def to_state(self) -> str:
+        """
+        Agregados por campus y día (los demás se derivan de ellos) en JSON con
+        gzip y base64, para guardarlos en el lease del change feed.
+        """
+        data = {campus: {dia: aggregate.to_list() for dia, aggregate in dias.items()}
+                for campus, dias in self._por_campus_dia.items()}
+        raw = json.dumps(data, separators=(",", ":")).encode("utf-8")
+        return base64.b64encode(gzip.compress(raw)).decode("ascii")
+
+    def load_state(self, state: str):
+        """Reemplaza los contadores por los de to_state()."""
+        data = json.loads(gzip.decompress(base64.b64decode(state)))
+        self.clear()
+        for campus, dias in data.items():
+            for dia, values in dias.items():
+                aggregate = _Aggregate.from_list(campus, values)
+                self._por_campus_dia.setdefault(campus, {})[dia] = aggregate
+                for target in (self._total, self._por_campus.setdefault(campus, _Aggregate()),
+                               self._por_dia.setdefault(dia, _Aggregate())):
+                    target.merge(aggregate)
+
+    def mark_loaded(self):
+        self._loaded.set()
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded.is_set()
+
+    async def rebuild(self, helper, page_size: int = 1000):
+        """Reconstruye los contadores con un recorrido paginado del contenedor."""
+        self.clear()
+        query = f"SELECT * FROM c WHERE c.tipo = '{TIPO_APLICACION}'"
+        async for items, _ in helper.query_pages(query, [], page_size=page_size):
+            for item in items:
+                self.apply(item)
+        self.mark_loaded()
+
+    async def ensure_loaded(self, helper, timeout: float = 10.0):
+        """Espera la carga inicial (o la hace, si no la maneja el change feed)."""
+        if self._loaded.is_set():
+            return
+        if self.feed_managed:
+            await asyncio.wait_for(self._loaded.wait(), timeout)
+            return
+        async with self._load_lock:
+            if not self._loaded.is_set():
+                await self.rebuild(helper)
+
+    def snapshot(self, campus: Optional[str] = None, desde: Optional[str] = None,
+                 hasta: Optional[str] = None) -> dict:
+        """
+        Estadísticas globales, de un campus y/o de la ventana [desde, hasta]
+        (fechas YYYY-MM-DD inclusivas). Sin ventana es una lectura directa; con
+        ventana se suman los agregados de los días que caen en ella.
+        """
+        if desde is None and hasta is None:
+            aggregate = self._total if campus is None else self._por_campus.get(campus, _Aggregate())
+            return aggregate.as_dict()
+        result = _Aggregate()
+        days = self._por_dia if campus is None else self._por_campus_dia.get(campus, {})
+        for dia, aggregate in days.items():
+            if dia and (desde is None or dia >= desde) and (hasta is None or dia <= hasta):
+                result.merge(aggregate)
+        return result.as_dict()
+
+
+class VaccinationStatsView(ViewBuilder):
+    """
+    Vista del change feed que mantiene un VaccinationStats con las escrituras
+    de todos los workers. Guarda los contadores en el lease (ver to_state).
+    """
+
+    name = "vacunacion_estadisticas"
+    sources = ("vacunacion",)
+
+    def __init__(self, stats: VaccinationStats):
+        self.stats = stats
+        stats.feed_managed = True
+
+    async def reset(self):
+        self.stats.clear()
+
+    async def apply(self, source: str, docs: List[dict]):
+        for doc in docs:
+            self.stats.apply(doc, doc.get("anterior"))
+
+    def state(self, source: str) -> str:
+        return self.stats.to_state()
+
+    async def restore(self, source: str, state: str):
+        self.stats.load_state(state)
+
+    async def caught_up(self, source: str):
+        self.stats.mark_loaded()